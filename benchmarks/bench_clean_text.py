@@ -0,0 +1,80 @@
+"""Compare the compiled text rules with the previous replace-per-sign clean_text
+
+Example:
+    python benchmarks/bench_clean_text.py --size-mb 1 10 50
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tts_core import SIGNS, clean_text, extract_speech_text
+
+def legacy_clean_text(text, signs_to_exclude):
+    """clean_text as it was before the rule engine: one str.replace pass per selected sign"""
+    replacements = [
+        ("|", ""),
+        ("-", " "),
+        ("=", " "),
+        ("__", " "),
+        ("`", ""),
+        ("*", ""),
+        ("#", ""),
+        ("!", ""),
+        ("[", ""),
+        ("]", ""),
+        ("(", ""),
+        (")", ""),
+    ]
+    for old, new in replacements:
+        if old in signs_to_exclude:
+            text = text.replace(old, new)
+    return text
+
+def build_text(size_bytes):
+    """Repeat the README's extracted text, which keeps its tables and symbols, until it reaches size_bytes"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(root, "README.md"), 'r', encoding='utf-8') as f:
+        sample = extract_speech_text(f.read())
+    return (sample * (size_bytes // len(sample) + 1))[:size_bytes]
+
+def best_of(repeats, function, *args):
+    """Return the fastest of several runs in seconds, with the result of the last run"""
+    best = None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start_time
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, nargs="+", default=[1, 10], help="Text sizes to test (default: 1 10)")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per measurement, the fastest is reported (default: 3)")
+    args = parser.parse_args(argv)
+
+    # The legacy function only understood single signs, so give it the characters the SIGNS entries stand for
+    signs = list(SIGNS.values())
+    legacy_signs = [sign for sign in signs if len(sign) == 1] + ["__", "[", "]", "(", ")"]
+    custom_rules = (("e.g.", "for example"), ("i.e.", "that is"))
+
+    print(f"{'size':>8} {'implementation':<22} {'seconds':>9} {'MB/s':>8}")
+    for size_mb in args.size_mb:
+        text = build_text(int(size_mb * 1024 * 1024))
+        runs = (
+            ("legacy", legacy_clean_text, text, legacy_signs),
+            ("compiled", clean_text, text, signs),
+            ("compiled + custom", clean_text, text, signs, custom_rules),
+        )
+        for name, function, *function_args in runs:
+            seconds, _ = best_of(args.repeats, function, *function_args)
+            print(f"{size_mb:>6g}MB {name:<22} {seconds:>9.3f} {size_mb / seconds:>8.1f}")
+
+        legacy_result = legacy_clean_text(text, legacy_signs)
+        print(f"{'':>8} output matches legacy: {clean_text(text, signs) == legacy_result}")
+
+if __name__ == "__main__":
+    main()
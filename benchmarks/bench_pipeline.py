@@ -0,0 +1,169 @@
+"""Measure each stage of the conversion pipeline on synthetic documents, fully offline
+
+gTTS and OpenAI are replaced by the stubs in stubs.py, so the numbers show the cost of
+this code rather than the network. Give the stubs latency and an error rate to see how
+the thread pools and error handling behave under realistic conditions. Throughput is
+given in megabytes of the Markdown document per second for every stage, so the stages
+can be compared with each other. The stream stage runs the whole streaming conversion
+from a file on disk; with --memory, its peak should stay flat as the documents grow.
+
+Example:
+    python benchmarks/bench_pipeline.py --size-mb 0.001 1 10 50 --latency 0.2 --workers 8
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown
+from bs4 import BeautifulSoup
+
+import tts_core
+import tts_retry
+from tts_core import SIGNS, clean_text, combine_audio_chunks, combine_audio_data, convert_markdown_stream, extract_speech_text, optimize_for_speech, remove_temp_files, split_into_chunks, synthesize_chunks, write_temp_audio_files
+from corpus import generate_markdown
+from stubs import RequestLog, openai, patch_gtts, patch_openai
+
+def run_stage(function, trace_memory):
+    """Return (seconds, peak traced bytes or None, result, error) for one call of function"""
+    if trace_memory:
+        tracemalloc.start()
+    start_time = time.perf_counter()
+    result = error = None
+    try:
+        result = function()
+    except Exception as e:
+        error = str(e)
+    seconds = time.perf_counter() - start_time
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return seconds, peak, result, error
+
+def optimize_uncached(document, max_workers):
+    """Optimize with an empty cache in a temporary directory, so every chunk reaches the stub"""
+    original_get_cache_dir = tts_core.get_cache_dir
+    cache_dir = tempfile.mkdtemp(prefix="bench_optimization_cache_")
+    tts_core.get_cache_dir = lambda: cache_dir
+    try:
+        return optimize_for_speech(document, "sk-benchmark", max_workers=max_workers)
+    finally:
+        tts_core.get_cache_dir = original_get_cache_dir
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+def combine_with_builtin(audio_chunks, output_dir):
+    if not combine_audio_data(audio_chunks, os.path.join(output_dir, "combined.mp3")):
+        raise Exception("Built-in concatenation failed")
+
+def combine_with_ffmpeg(audio_chunks, output_dir):
+    temp_files = write_temp_audio_files(audio_chunks)
+    try:
+        if not combine_audio_chunks(temp_files, os.path.join(output_dir, "combined_ffmpeg.mp3")):
+            raise Exception("FFmpeg concatenation failed")
+    finally:
+        remove_temp_files(temp_files)
+
+def benchmark_document(document, args, output_dir):
+    """Run every stage on one document, yielding (stage, seconds, peak, items, request log, error)"""
+    signs = list(SIGNS.values())
+    state = {"document": document}
+    source_file = os.path.join(output_dir, "document.md")
+    with open(source_file, 'w', encoding='utf-8') as f:
+        f.write(document)
+
+    def gtts_stage():
+        with patch_gtts(args.latency, args.error_rate, args.seed, max_concurrent=args.rate_limit) as log:
+            state["log"] = log
+            return synthesize_chunks(state["chunks"], "en", max_workers=args.workers, use_cache=False)
+
+    def stream_stage():
+        # The whole pipeline reading from disk; its peak memory should not grow with the document
+        with patch_gtts(args.latency, args.error_rate, args.seed, max_concurrent=args.rate_limit) as log:
+            state["log"] = log
+            if not convert_markdown_stream(source_file, os.path.join(output_dir, "streamed.mp3"), "en", args.chunk_size, signs,
+                                           max_workers=args.workers, use_audio_cache=False):
+                raise Exception("Streaming conversion failed")
+
+    def openai_stage():
+        with patch_openai(args.latency, args.error_rate, args.seed, max_concurrent=args.rate_limit) as log:
+            state["log"] = log
+            return optimize_uncached(document, args.workers)
+
+    # (name, function, state key for the result, states it needs, function counting its items)
+    stages = [
+        ("parse", lambda: markdown.markdown(document), "html", (), None),
+        ("html-extract", lambda: ''.join(BeautifulSoup(state["html"], "html.parser").find_all(string=True)), None, ("html",), None),
+        ("extract", lambda: extract_speech_text(document), "text", (), None),
+        ("clean_text", lambda: clean_text(state["text"], signs), "cleaned", ("text",), None),
+        ("chunk", lambda: split_into_chunks(state["cleaned"], args.chunk_size), "chunks", ("cleaned",), len),
+        ("synthesize", gtts_stage, "audio", ("chunks",), len),
+        ("combine", lambda: combine_with_builtin(state["audio"], output_dir), None, ("audio",), None),
+    ]
+    if shutil.which("ffmpeg"):
+        stages.append(("combine-ffmpeg", lambda: combine_with_ffmpeg(state["audio"], output_dir), None, ("audio",), None))
+    stages.append(("stream", stream_stage, None, (), None))
+    if openai is not None and not args.no_optimize:
+        stages.append(("optimize", openai_stage, None, (), None))
+
+    for name, function, result_key, needs, count_items in stages:
+        if any(key not in state for key in needs):
+            yield name, None, None, None, None, "skipped, an earlier stage failed"
+            continue
+        state.pop("log", None)
+        seconds, _, result, error = run_stage(function, False)
+        log = state.get("log")
+        peak = None
+        if args.memory and error is None:
+            _, peak, _, _ = run_stage(function, True)
+        if error is None and result_key:
+            state[result_key] = result
+        yield name, seconds, peak, count_items(result) if count_items and error is None else None, log, error
+
+def column(value, number_format, width):
+    """Format a table cell, leaving it blank when the value doesn't apply to the stage"""
+    return f"{'' if value is None else format(value, number_format):>{width}}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, nargs="+", default=[0.001, 0.1, 1], help="Document sizes to test (default: 0.001 0.1 1)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Characters per synthesis chunk (default: 1000)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent stub requests (default: 4)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each stub request takes (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub requests that fail with HTTP 429 or 5xx (default: 0)")
+    parser.add_argument("--rate-limit", type=int, metavar="N", help="Fail stub requests with HTTP 429 while more than N are in flight")
+    parser.add_argument("--retry-delay", type=float, default=tts_retry.RETRY_BASE_DELAY,
+                        help=f"Base delay of the retry backoff in seconds (default: {tts_retry.RETRY_BASE_DELAY:g})")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the corpus and the injected errors (default: 0)")
+    parser.add_argument("--memory", action="store_true", help="Also measure peak memory; each stage runs a second time under tracemalloc")
+    parser.add_argument("--no-optimize", action="store_true", help="Skip the GPT-4o optimization stage")
+    args = parser.parse_args(argv)
+    tts_retry.RETRY_BASE_DELAY = args.retry_delay
+
+    print(f"{'size':>8} {'stage':<15} {'seconds':>9} {'MB/s':>9} {'items':>7} {'requests':>9} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory(prefix="bench_pipeline_") as output_dir:
+        for size_mb in args.size_mb:
+            document = generate_markdown(int(size_mb * 1024 * 1024), args.seed)
+            document_mb = len(document.encode('utf-8')) / 1024 / 1024
+            for name, seconds, peak, items, log, error in benchmark_document(document, args, output_dir):
+                if seconds is None:
+                    print(f"{size_mb:>6g}MB {name:<15} {error}")
+                    continue
+                log = log or RequestLog()
+                print(
+                    f"{size_mb:>6g}MB {name:<15} {seconds:>9.3f} {column(document_mb / seconds if seconds else None, '.1f', 9)}"
+                    f" {column(items, 'd', 7)} {column(log.count or None, 'd', 9)} {column(log.errors if log.count else None, 'd', 7)}"
+                    f" {column(log.percentile(0.5) * 1000 if log.count else None, '.1f', 8)}"
+                    f" {column(log.percentile(0.95) * 1000 if log.count else None, '.1f', 8)}"
+                    f" {column(peak / 1024 / 1024 if peak is not None else None, '.1f', 8)}"
+                )
+                if error:
+                    print(f"{'':>8} {'':<15} failed: {error}")
+
+if __name__ == "__main__":
+    main()
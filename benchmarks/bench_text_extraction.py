@@ -0,0 +1,51 @@
+"""Compare the direct Markdown extractor with the markdown + BeautifulSoup round trip
+
+Example:
+    python benchmarks/bench_text_extraction.py --size-mb 1 5 20
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tts_core import extract_plain_text, extract_speech_text
+
+SAMPLE_FILES = ("README.md", "test_content.md")
+
+def build_document(size_bytes):
+    """Repeat the repository's own Markdown files until the document reaches size_bytes"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    samples = []
+    for filename in SAMPLE_FILES:
+        with open(os.path.join(root, filename), 'r', encoding='utf-8') as f:
+            samples.append(f.read())
+    sample = "\n\n".join(samples)
+    return (sample * (size_bytes // len(sample) + 1))[:size_bytes]
+
+def measure(extractor, document):
+    """Return (seconds, peak traced bytes, output length) for one extraction"""
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    text = extractor(document)
+    seconds = time.perf_counter() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, len(text)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, nargs="+", default=[1, 5], help="Document sizes to test (default: 1 5)")
+    args = parser.parse_args(argv)
+
+    print(f"{'size':>8} {'extractor':<12} {'seconds':>9} {'peak MB':>9} {'chars':>10}")
+    for size_mb in args.size_mb:
+        document = build_document(int(size_mb * 1024 * 1024))
+        for name, extractor in (("html", extract_plain_text), ("direct", extract_speech_text)):
+            seconds, peak, chars = measure(extractor, document)
+            print(f"{size_mb:>6g}MB {name:<12} {seconds:>9.2f} {peak / 1024 / 1024:>9.1f} {chars:>10}")
+
+if __name__ == "__main__":
+    main()
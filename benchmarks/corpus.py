@@ -0,0 +1,128 @@
+"""Generate synthetic Markdown documents for the benchmarks
+
+The documents mix headings, paragraphs with inline links, emphasis and code, lists,
+tables, fenced code blocks, block quotes and images in roughly the proportions of
+technical documentation, plus the odd heading with no text. The same size and seed always produce the same document.
+
+Example:
+    python benchmarks/corpus.py -o /tmp/corpus --size-kb 1 100 1024 10240 51200
+"""
+import argparse
+import os
+import random
+
+WORDS = (
+    "audio speech markdown chunk request cache engine stream voice language document section "
+    "server client latency buffer frame sample parser token table column value default option "
+    "install configure convert render extract optimize combine download upload session worker "
+    "the a of to and in is for with on that by this be are from it as at or an can will"
+).split()
+
+LANGUAGES = ("python", "bash", "json", "yaml")
+
+def sentence(rng, min_words=6, max_words=18):
+    """A sentence of random words, sometimes with inline code, emphasis or a link"""
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    position = rng.randrange(len(words))
+    markup = rng.random()
+    if markup < 0.15:
+        words[position] = f"`{words[position]}()`"
+    elif markup < 0.3:
+        words[position] = f"**{words[position]}**"
+    elif markup < 0.4:
+        words[position] = f"[{words[position]}](https://example.com/{words[position]}/{rng.randint(1, 999)})"
+    elif markup < 0.45:
+        words[position] = f"_{words[position]}_"
+    words[0] = words[0].capitalize()
+    return " ".join(words) + rng.choice((".", ".", ".", "?", "!"))
+
+def paragraph(rng):
+    return " ".join(sentence(rng) for _ in range(rng.randint(2, 6)))
+
+def bullet_list(rng):
+    ordered = rng.random() < 0.3
+    return "\n".join(
+        f"{i + 1}. {sentence(rng, 3, 10)}" if ordered else f"- {sentence(rng, 3, 10)}"
+        for i in range(rng.randint(3, 7))
+    )
+
+def table(rng):
+    columns = rng.randint(2, 5)
+    header = [rng.choice(WORDS).capitalize() for _ in range(columns)]
+    rows = [
+        [rng.choice((rng.choice(WORDS), str(rng.randint(0, 10000)), f"`{rng.choice(WORDS)}`")) for _ in range(columns)]
+        for _ in range(rng.randint(2, 8))
+    ]
+    lines = ["| " + " | ".join(header) + " |", "|" + "|".join("---" for _ in range(columns)) + "|"]
+    lines.extend("| " + " | ".join(row) + " |" for row in rows)
+    return "\n".join(lines)
+
+def code_block(rng):
+    language = rng.choice(LANGUAGES)
+    body = "\n".join(
+        f"{rng.choice(WORDS)}_{rng.choice(WORDS)} = {rng.choice(WORDS)}({rng.randint(0, 99)})"
+        for _ in range(rng.randint(2, 12))
+    )
+    return f"```{language}\n{body}\n```"
+
+def block_quote(rng):
+    return "\n".join(f"> {sentence(rng)}" for _ in range(rng.randint(1, 3)))
+
+def image(rng):
+    name = rng.choice(WORDS)
+    return f"![{name} diagram](images/{name}-{rng.randint(1, 99)}.png)"
+
+def empty_heading(rng):
+    # A bare "#" is valid Markdown and must be skipped rather than break extraction
+    return "#" * rng.randint(1, 3)
+
+BLOCKS = (
+    (paragraph, 50),
+    (bullet_list, 14),
+    (table, 10),
+    (code_block, 12),
+    (block_quote, 6),
+    (image, 3),
+    (empty_heading, 1),
+)
+
+def iter_blocks(seed=0):
+    """Endless Markdown blocks, with a heading starting a new section every few blocks"""
+    rng = random.Random(seed)
+    builders, weights = zip(*BLOCKS)
+    section = 0
+    while True:
+        section += 1
+        level = 1 if section == 1 else rng.choice((2, 2, 3))
+        yield f"{'#' * level} {section}. {sentence(rng, 2, 6).rstrip('.?!')}"
+        for builder in rng.choices(builders, weights, k=rng.randint(3, 9)):
+            yield builder(rng)
+
+def generate_markdown(size_bytes, seed=0):
+    """Build a document of about size_bytes UTF-8 bytes, ending at a block boundary"""
+    blocks = []
+    total = 0
+    for block in iter_blocks(seed):
+        blocks.append(block)
+        total += len(block.encode('utf-8')) + 2
+        if total >= size_bytes:
+            break
+    return "\n\n".join(blocks) + "\n"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output-dir", required=True, help="Directory to write the documents to")
+    parser.add_argument("--size-kb", type=float, nargs="+", default=[1, 100, 1024, 10240, 51200],
+                        help="Document sizes in KB (default: 1 100 1024 10240 51200, i.e. 1 KB to 50 MB)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for size_kb in args.size_kb:
+        path = os.path.join(args.output_dir, f"corpus_{size_kb:g}kb.md")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(generate_markdown(int(size_kb * 1024), args.seed))
+        print(f"{path} ({os.path.getsize(path)} bytes)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Offline stand-ins for gTTS and openai.OpenAI with configurable latency and errors
+
+patch_gtts and patch_openai swap the stubs into tts_core for the duration of a with
+block, so the real pipeline runs without network access. Every stubbed request is
+recorded in a RequestLog for latency percentiles. Failures are drawn from a seeded
+random generator, so a run with the same settings fails the same requests, and they
+raise the exceptions the real libraries raise for HTTP 429 and 5xx responses.
+"""
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http import HTTPStatus
+from types import SimpleNamespace
+
+import requests
+from gtts.tts import gTTSError
+
+import tts_core
+from tts_retry import call_with_retries
+
+try:
+    import openai
+except ImportError:
+    openai = None
+
+ERROR_STATUSES = (429, 500, 503)
+
+# MPEG-2 Layer III, 32 kbit/s, 24 kHz mono: the format gTTS returns, 96 bytes and 24 ms per frame
+MP3_FRAME = b"\xff\xf3\x44\xc4" + bytes(92)
+FRAMES_PER_CHAR = 0.25  # Real speech is about 2.7 frames per character; less keeps 50 MB corpora in memory
+
+class RequestLog:
+    """Thread-safe record of stubbed requests: (seconds, succeeded)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+
+    def record(self, seconds, succeeded):
+        with self.lock:
+            self.requests.append((seconds, succeeded))
+
+    @property
+    def count(self):
+        return len(self.requests)
+
+    @property
+    def errors(self):
+        return sum(1 for _, succeeded in self.requests if not succeeded)
+
+    def percentile(self, fraction):
+        """Latency below which the given fraction of requests finished, in seconds"""
+        if not self.requests:
+            return 0.0
+        latencies = sorted(seconds for seconds, _ in self.requests)
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+class FaultInjector:
+    """Sleeps for the configured latency and decides which requests fail
+
+    With max_concurrent set, requests beyond that many in flight fail with HTTP 429,
+    like a provider enforcing a rate limit.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0, log=None, max_concurrent=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_concurrent = max_concurrent
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.log = log or RequestLog()
+
+    @contextmanager
+    def request(self):
+        """Time one request, yielding the HTTP status it should fail with, or None"""
+        with self.lock:
+            self.in_flight += 1
+            failure = self.random.random() < self.error_rate
+            status = self.random.choice(ERROR_STATUSES) if failure else None
+            if self.max_concurrent and self.in_flight > self.max_concurrent:
+                status = 429
+        start_time = time.perf_counter()
+        try:
+            if self.latency:
+                time.sleep(self.latency / 10 if status == 429 else self.latency)
+            yield status
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+            self.log.record(time.perf_counter() - start_time, status is None)
+
+class StubGTTS:
+    """Replacement for tts_core.PooledGTTS that makes one fake request per tokenized part
+
+    Like PooledGTTS, each request is retried on its own and waits for the limiter.
+    """
+
+    def __init__(self, text, lang="en", tokenizer_func=None, faults=None, frames_per_char=FRAMES_PER_CHAR, limiter=None, **kwargs):
+        self.text = text
+        self.lang = lang
+        self.tokenizer_func = tokenizer_func or (lambda text: [text])
+        self.faults = faults or FaultInjector()
+        self.frames_per_char = frames_per_char
+        self.limiter = limiter
+
+    def _fetch_audio(self, part):
+        with self.faults.request() as status:
+            if status:
+                response = requests.Response()
+                response.status_code = status
+                response.reason = HTTPStatus(status).phrase
+                raise gTTSError(tts=self, response=response)
+        return MP3_FRAME * max(1, math.ceil(len(part) * self.frames_per_char))
+
+    def stream(self):
+        for part in self.tokenizer_func(self.text):
+            yield call_with_retries(self._fetch_audio, part, api=tts_core.TTS_ENGINE, limiter=self.limiter)
+
+    def write_to_fp(self, fp):
+        for part in self.stream():
+            fp.write(part)
+
+class StubCompletions:
+    """client.chat.completions of the stub OpenAI client; echoes the content it was asked to optimize, cut off at max_tokens"""
+
+    def __init__(self, faults):
+        self.faults = faults
+
+    def create(self, model, messages, max_tokens=None, **kwargs):
+        with self.faults.request() as status:
+            if status:
+                # The exceptions only read these attributes of the HTTP response
+                response = SimpleNamespace(status_code=status, headers={}, request=None)
+                error_class = openai.RateLimitError if status == 429 else openai.InternalServerError
+                raise error_class(f"Error code: {status}", response=response, body=None)
+        # The instructions are in the system message and the chunk is the user message
+        optimized = messages[-1]["content"]
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        completion_tokens = len(optimized) // 4
+        finish_reason = "stop"
+        if max_tokens is not None and completion_tokens > max_tokens:
+            optimized = optimized[:max_tokens * 4]
+            completion_tokens = max_tokens
+            finish_reason = "length"
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=optimized), finish_reason=finish_reason)],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens),
+        )
+
+class StubOpenAI:
+    """Replacement for openai.OpenAI supporting client.chat.completions.create"""
+
+    def __init__(self, api_key=None, faults=None, **kwargs):
+        self.chat = SimpleNamespace(completions=StubCompletions(faults or FaultInjector()))
+
+@contextmanager
+def patch_gtts(latency=0.0, error_rate=0.0, seed=0, frames_per_char=FRAMES_PER_CHAR, max_concurrent=None):
+    """Make tts_core synthesize with StubGTTS, yielding the RequestLog of its requests"""
+    faults = FaultInjector(latency, error_rate, seed, max_concurrent=max_concurrent)
+    original = tts_core.PooledGTTS
+    tts_core.PooledGTTS = lambda text, **kwargs: StubGTTS(text, faults=faults, frames_per_char=frames_per_char, **kwargs)
+    try:
+        yield faults.log
+    finally:
+        tts_core.PooledGTTS = original
+
+@contextmanager
+def patch_openai(latency=0.0, error_rate=0.0, seed=0, max_concurrent=None):
+    """Make tts_core optimize with StubOpenAI, yielding the RequestLog of its requests"""
+    if openai is None:
+        raise RuntimeError("The OpenAI stub raises the openai package's exceptions; install openai to use it")
+    faults = FaultInjector(latency, error_rate, seed, max_concurrent=max_concurrent)
+    original = openai.OpenAI
+    openai.OpenAI = lambda api_key=None, **kwargs: StubOpenAI(api_key, faults=faults, **kwargs)
+    try:
+        yield faults.log
+    finally:
+        openai.OpenAI = original
@@ -0,0 +1,109 @@
+"""Speech engines and lookup of engines by name
+
+Every engine implements tts_core.TTSBackend. gTTS lives in tts_core as the default;
+espeak-ng runs locally through a subprocess, so it needs no network access and has no
+rate limits, and FakeBackend produces deterministic tones for tests and benchmarks.
+"""
+import array
+import logging
+import math
+import os
+import shutil
+import subprocess
+import time
+import zlib
+
+from tts_core import TTSBackend, GTTSBackend, read_wav, write_wav
+
+logger = logging.getLogger(__name__)
+
+# espeak-ng voices whose names differ from the language codes in tts_core.LANGUAGES
+ESPEAK_VOICES = {"zh-cn": "cmn"}
+ESPEAK_SPEED = int(os.environ.get("TTS_ESPEAK_SPEED", "175"))  # Words per minute, espeak-ng's default
+ESPEAK_TIMEOUT = 120  # Seconds allowed for synthesizing a single chunk
+
+# Fake engine audio: a quiet tone, 10 ms per character so long documents stay small
+FAKE_SAMPLE_RATE = 8000
+FAKE_SECONDS_PER_CHAR = 0.01
+
+class EspeakBackend(TTSBackend):
+    """Offline synthesis with the espeak-ng command-line program, producing WAV"""
+    name = "espeak-ng"
+    label = "espeak-ng (offline)"
+    audio_format = "wav"
+
+    def __init__(self, speed=ESPEAK_SPEED, executable=None):
+        self.speed = speed
+        self.executable = executable or shutil.which("espeak-ng") or shutil.which("espeak")
+
+    @property
+    def cache_id(self):
+        return f"{self.name}:{self.speed}"
+
+    def is_available(self):
+        return self.executable is not None
+
+    def synthesize(self, text, lang):
+        if not self.executable:
+            raise Exception("espeak-ng is not installed")
+        # Text goes through stdin so chunks starting with "-" aren't taken for options
+        command = [self.executable, "-v", ESPEAK_VOICES.get(lang.lower(), lang), "-s", str(self.speed), "-b", "1", "--stdin", "--stdout"]
+        result = subprocess.run(command, input=text.encode('utf-8'), capture_output=True, timeout=ESPEAK_TIMEOUT)
+        if result.returncode != 0:
+            raise Exception(f"espeak-ng failed with exit code {result.returncode}: {result.stderr.decode('utf-8', 'replace').strip()}")
+        # espeak-ng can't seek back on a pipe to fill in the WAV sizes, so rewrite the header
+        return write_wav(*read_wav(result.stdout))
+
+class FakeBackend(TTSBackend):
+    """Deterministic offline engine for tests and benchmarks
+
+    Each chunk becomes a tone whose pitch and length depend only on its text, so the same
+    input always produces the same audio. latency adds a delay to every chunk, and
+    error_rate makes that fraction of chunks fail, picked by a hash of their text so the
+    same chunks fail on every run.
+    """
+    name = "fake"
+    label = "Fake tones (testing)"
+    audio_format = "wav"
+
+    def __init__(self, latency=0.0, error_rate=0.0, sample_rate=FAKE_SAMPLE_RATE):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.sample_rate = sample_rate
+
+    @property
+    def cache_id(self):
+        return f"{self.name}:{self.sample_rate}"
+
+    def synthesize(self, text, lang):
+        if self.latency:
+            time.sleep(self.latency)
+        text_hash = zlib.crc32(f"{lang}\0{text}".encode('utf-8'))
+        if text_hash % 10000 < self.error_rate * 10000:
+            raise Exception(f"Fake engine failure for chunk {text_hash:08x}")
+
+        # One period of a sine wave between 220 and 660 Hz, repeated for the chunk's length
+        period = self.sample_rate // (220 + text_hash % 440)
+        cycle = array.array('h', (int(3000 * math.sin(2 * math.pi * i / period)) for i in range(period)))
+        frame_count = max(1, int(len(text) * FAKE_SECONDS_PER_CHAR * self.sample_rate))
+        samples = cycle * (frame_count // period + 1)
+        return write_wav((1, 2, self.sample_rate), samples[:frame_count].tobytes())
+
+BACKENDS = {
+    GTTSBackend.name: GTTSBackend,
+    EspeakBackend.name: EspeakBackend,
+    FakeBackend.name: FakeBackend,
+}
+
+def get_backend(name, **options):
+    """Create the engine registered under name, passing options to its constructor"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown speech engine: {name}. Choose from {', '.join(BACKENDS)}")
+    return BACKENDS[name](**options)
+
+def available_backends(include_testing=False):
+    """Names of the engines that can run on this machine, the fake engine only if asked for"""
+    return [
+        name for name, backend_class in BACKENDS.items()
+        if (include_testing or backend_class is not FakeBackend) and backend_class().is_available()
+    ]
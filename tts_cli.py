@@ -0,0 +1,228 @@
+"""Batch converter for rendering directory trees of Markdown files to speech
+
+Example:
+    python tts_cli.py docs/ -o build/audio --jobs 4 --workers 4
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tts_core import LANGUAGES, SIGNS, OPENAI_AVAILABLE, OUTPUT_PROFILES, TEXT_RULE_SEPARATOR, convert_markdown, convert_markdown_sections, convert_markdown_stream, get_output_extension, optimize_for_speech, parse_text_rules
+from tts_backends import BACKENDS, get_backend
+from tts_metrics import REGISTRY, write_metrics
+
+logger = logging.getLogger("tts_cli")
+
+MARKDOWN_EXTENSIONS = ('.md', '.markdown')
+
+def find_markdown_files(inputs, output_dir, extension=".mp3"):
+    """Collect (input_path, output_path) pairs, mirroring each input directory's layout under output_dir"""
+    jobs = []
+    for input_path in inputs:
+        if os.path.isfile(input_path):
+            base_name = os.path.splitext(os.path.basename(input_path))[0]
+            jobs.append((input_path, os.path.join(output_dir, base_name + extension)))
+            continue
+        if not os.path.isdir(input_path):
+            raise FileNotFoundError(f"No such file or directory: {input_path}")
+
+        for root, dirs, files in os.walk(input_path):
+            # Skip hidden directories such as .git and the app's own caches
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for filename in sorted(files):
+                if filename.lower().endswith(MARKDOWN_EXTENSIONS):
+                    source = os.path.join(root, filename)
+                    relative = os.path.relpath(source, input_path)
+                    jobs.append((source, os.path.join(output_dir, os.path.splitext(relative)[0] + extension)))
+    return jobs
+
+def is_up_to_date(input_path, output_path):
+    """Check whether the output exists and is newer than its Markdown source"""
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+
+def convert_file(input_path, output_path, options):
+    """Convert one Markdown file in a worker process, returning (success, seconds, error, metrics)
+
+    The metrics snapshot covers this file only, so the parent can add them up.
+    """
+    configure_logging(options["verbose"], options["debug"])
+    REGISTRY.reset()
+    start_time = time.time()
+    messages = []
+
+    def collect_message(level, message):
+        if level in ("warning", "error"):
+            messages.append(message)
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        common = dict(
+            max_workers=options["workers"],
+            use_audio_cache=options["use_audio_cache"],
+            message_callback=collect_message,
+            custom_rules=options["custom_rules"],
+            backend=get_backend(options["engine"]),
+            output_profile=options["output_profile"]
+        )
+        if options["stream"]:
+            # The file is read a block at a time instead of being loaded here
+            success = convert_markdown_stream(input_path, output_path, options["lang"], options["chunk_size"], options["signs_to_exclude"], **common)
+        else:
+            with open(input_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+
+            if options["optimize"]:
+                content = optimize_for_speech(content, options["api_key"], max_workers=options["optimization_workers"], message_callback=collect_message)
+
+            convert = convert_markdown_sections if options["sections"] else convert_markdown
+            success = convert(
+                content,
+                output_path,
+                options["lang"],
+                options["chunk_size"],
+                options["signs_to_exclude"],
+                use_ffmpeg=options["use_ffmpeg"],
+                resume=options["resume"],
+                **common
+            )
+        error = None if success else ("; ".join(messages) or "Conversion failed")
+        return success, time.time() - start_time, error, REGISTRY.snapshot()
+    except Exception as e:
+        return False, time.time() - start_time, str(e), REGISTRY.snapshot()
+
+def configure_logging(verbose, debug=False):
+    """Log pipeline details only when asked, so batch output stays readable"""
+    logging.basicConfig(
+        level=logging.DEBUG if debug else logging.INFO if verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert Markdown files and directory trees to speech")
+    parser.add_argument("inputs", nargs="+", help="Markdown files or directories to convert (directories are searched recursively)")
+    parser.add_argument("-o", "--output-dir", required=True, help="Directory to write audio files to, mirroring the input layout")
+    parser.add_argument("--lang", default="en", choices=sorted(LANGUAGES.values()), help="Speech language (default: en)")
+    parser.add_argument("--engine", default="gtts", choices=list(BACKENDS),
+                        help="Speech engine: gtts (online, MP3), espeak-ng (offline, WAV) or fake (test tones, WAV). Default: gtts")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Maximum characters per synthesis chunk (default: 1000)")
+    parser.add_argument("--exclude", action="append", default=[], choices=list(SIGNS.values()), metavar="SIGN",
+                        help=f"Sign to remove before synthesis, may be repeated. One of: {' '.join(SIGNS.values())}")
+    parser.add_argument("--replace", action="append", default=[], metavar="RULE",
+                        help=f"Custom replacement written as 'old {TEXT_RULE_SEPARATOR} new', may be repeated")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of files converted in parallel processes (default: CPU count)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent synthesis requests per file (default: 4)")
+    parser.add_argument("--no-audio-cache", action="store_true", help="Synthesize every chunk instead of reusing cached audio")
+    parser.add_argument("--no-resume", action="store_true", help="With --no-audio-cache, ignore checkpoints left by failed runs and don't write new ones")
+    parser.add_argument("--profile", default="original", choices=list(OUTPUT_PROFILES),
+                        help="Output format: original (the engine's MP3 or WAV), opus (OGG, smallest) or mp3-mono (low bitrate). "
+                             "Profiles other than original need FFmpeg. Default: original")
+    parser.add_argument("--sections", action="store_true",
+                        help="Write one track per top-level heading with an .m3u playlist and chapter list; "
+                             "later runs re-render only the sections that changed")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read, synthesize and write each file a block at a time, so memory stays flat for huge inputs. "
+                             "Repeats are only shared through the audio cache; can't be combined with --sections, --optimize or --ffmpeg")
+    parser.add_argument("--ffmpeg", action="store_true", help="Combine chunks with FFmpeg instead of the built-in concatenation")
+    parser.add_argument("--optimize", action="store_true", help="Optimize text with GPT-4o first (needs OPENAI_API_KEY)")
+    parser.add_argument("--optimization-workers", type=int, default=4, help="Concurrent GPT-4o requests per file (default: 4)")
+    parser.add_argument("--force", action="store_true", help="Convert files even if their audio is newer than the source")
+    parser.add_argument("--metrics-out", metavar="FILE",
+                        help="Write stage durations, chunk latency, cache and API counters to FILE (JSON if it ends in .json, Prometheus text otherwise)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show detailed pipeline logging")
+    parser.add_argument("--debug", action="store_true", help="Also log every chunk, temporary file and FFmpeg output")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_logging(args.verbose, args.debug)
+
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if args.optimize and not (OPENAI_AVAILABLE and api_key):
+        print("--optimize needs the openai package and the OPENAI_API_KEY environment variable", file=sys.stderr)
+        return 2
+
+    if args.stream and (args.sections or args.optimize or args.ffmpeg):
+        print("--stream can't be combined with --sections, --optimize or --ffmpeg", file=sys.stderr)
+        return 2
+
+    try:
+        custom_rules = parse_text_rules("\n".join(args.replace))
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+
+    backend = get_backend(args.engine)
+    if not backend.is_available():
+        print(f"The {args.engine} speech engine is not installed on this machine", file=sys.stderr)
+        return 2
+
+    if args.profile != "original" and not shutil.which("ffmpeg"):
+        print(f"The {args.profile} output profile needs FFmpeg, which is not installed on this machine", file=sys.stderr)
+        return 2
+
+    try:
+        extension = ".m3u" if args.sections else "." + get_output_extension(backend.audio_format, args.profile)
+        jobs = find_markdown_files(args.inputs, args.output_dir, extension)
+    except FileNotFoundError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+
+    if not args.force:
+        skipped = [job for job in jobs if is_up_to_date(*job)]
+        jobs = [job for job in jobs if not is_up_to_date(*job)]
+        if skipped:
+            print(f"Skipping {len(skipped)} up-to-date file(s)")
+    if not jobs:
+        print("Nothing to convert")
+        return 0
+
+    options = {
+        "lang": args.lang,
+        "chunk_size": args.chunk_size,
+        "signs_to_exclude": args.exclude,
+        "custom_rules": custom_rules,
+        "engine": args.engine,
+        "output_profile": args.profile,
+        "sections": args.sections,
+        "stream": args.stream,
+        "workers": args.workers,
+        "use_audio_cache": not args.no_audio_cache,
+        "use_ffmpeg": args.ffmpeg,
+        "resume": not args.no_resume,
+        "optimize": args.optimize,
+        "optimization_workers": args.optimization_workers,
+        "api_key": api_key,
+        "verbose": args.verbose,
+        "debug": args.debug,
+    }
+
+    print(f"Converting {len(jobs)} file(s) with {min(args.jobs, len(jobs))} process(es)")
+    start_time = time.time()
+    failures = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(jobs)))) as executor:
+        futures = {
+            executor.submit(convert_file, input_path, output_path, options): (input_path, output_path)
+            for input_path, output_path in jobs
+        }
+        for completed, future in enumerate(as_completed(futures), start=1):
+            input_path, output_path = futures[future]
+            success, seconds, error, metrics = future.result()
+            REGISTRY.merge(metrics)
+            if success:
+                print(f"[{completed}/{len(jobs)}] {input_path} -> {output_path} ({seconds:.1f}s)")
+            else:
+                failures += 1
+                print(f"[{completed}/{len(jobs)}] FAILED {input_path}: {error}", file=sys.stderr)
+
+    print(f"Done in {time.time() - start_time:.1f}s: {len(jobs) - failures} converted, {failures} failed")
+    if args.metrics_out:
+        write_metrics(args.metrics_out)
+        print(f"Metrics written to {args.metrics_out}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
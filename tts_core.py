@@ -0,0 +1,2364 @@
+"""Markdown to speech conversion without any Streamlit dependency
+
+Used by the Streamlit app in tts_streamlit.py and the batch converter in tts_cli.py.
+Progress is reported through progress_callback(status, percent) and user-facing
+notices through message_callback(level, message), where level is one of
+"info", "success", "warning" or "error".
+"""
+import markdown
+from gtts import gTTS
+from gtts.tts import gTTSError
+from gtts.tokenizer import pre_processors
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+import os
+import io
+import base64
+import collections
+import re
+import tempfile
+import subprocess
+import shutil
+import sqlite3
+import struct
+import wave
+from bs4 import BeautifulSoup
+import time
+import json
+import threading
+import hashlib
+import html
+import itertools
+import logging
+import zlib
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tts_metrics import API_REQUESTS, CACHE_REQUESTS, CHUNK_LATENCY, DEDUPLICATED_CHUNKS, HTTP_CONNECTIONS, HTTP_REQUESTS, OPENAI_TOKENS, SECTIONS, STAGE_DURATION, SYNTHESIZED_BYTES
+from tts_retry import AdaptiveLimiter, call_with_retries, classify_error
+
+logger = logging.getLogger(__name__)
+
+try:
+    import openai
+    OPENAI_AVAILABLE = True
+    logger.info("OpenAI library loaded successfully")
+except ImportError:
+    OPENAI_AVAILABLE = False
+    logger.warning("OpenAI library not available")
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Supported languages
+LANGUAGES = {
+    "English": "en",
+    "German": "de",
+    "French": "fr",
+    "Spanish": "es",
+    "Italian": "it",
+    "Portuguese": "pt",
+    "Dutch": "nl",
+    "Russian": "ru",
+    "Chinese (Simplified)": "zh-cn",
+    "Japanese": "ja",
+    "Korean": "ko"
+}
+
+# Signs to exclude
+SIGNS = {
+    "Pipes (|)": "|",
+    "Hyphens (-)": "-",
+    "Equals (=)": "=",
+    "Double Underscores (__)": "__",
+    "Backticks (`)": "`",
+    "Asterisks (*)": "*",
+    "Hashes (#)": "#",
+    "Exclamation Marks (!)": "!",
+    "Square Brackets ([])": "[]",
+    "Parentheses (())": "()",
+}
+
+# Text replacements applied for each sign in SIGNS, as (old, new) pairs
+SIGN_RULES = {
+    "|": (("|", ""),),              # Remove pipe characters from tables
+    "-": (("-", " "),),             # Replace hyphens with spaces
+    "=": (("=", " "),),             # Replace equal signs with spaces
+    "__": (("__", " "),),           # Replace double underscores with spaces
+    "`": (("`", ""),),              # Remove backticks
+    "*": (("*", ""),),              # Remove asterisks
+    "#": (("#", ""),),              # Remove hashes
+    "!": (("!", ""),),              # Remove exclamation marks
+    "[]": (("[", ""), ("]", "")),   # Remove square brackets
+    "()": (("(", ""), (")", "")),   # Remove parentheses
+}
+
+# Separates the text to find from its replacement in user-defined rules, e.g. "e.g. => for example"
+TEXT_RULE_SEPARATOR = "=>"
+
+# Maximum number of characters gTTS sends to Google in a single HTTP request
+GTTS_MAX_REQUEST_CHARS = gTTS.GOOGLE_TTS_MAX_CHARS
+
+GTTS_TIMEOUT = 30  # Seconds to wait for each request to Google, so a stalled connection gets retried
+OPENAI_TIMEOUT = 120  # Seconds to wait for a GPT-4o response before retrying
+
+# GPT-4o optimization requests are packed up to a token budget instead of a fixed number of characters
+OPTIMIZATION_MODEL = "gpt-4o"
+OPTIMIZATION_TOKEN_BUDGET = int(os.environ.get("TTS_OPTIMIZATION_TOKEN_BUDGET", "4000"))  # Content tokens per request
+OPTIMIZATION_MIN_FILL = 0.85  # Requests only end early at an anchor once this share of the budget is used
+OPTIMIZATION_MAX_OUTPUT_TOKENS = 16384  # GPT-4o's output limit
+OPTIMIZATION_OUTPUT_RATIO = 1.5  # Spelled-out numbers and symbols make the answer longer than the input
+OPTIMIZATION_OUTPUT_MARGIN = 256
+OPTIMIZATION_PROMPT = """You are an expert at converting written text to speech-friendly format. 
+
+Please optimize the markdown content in the user's message for text-to-speech conversion by:
+1. Expanding abbreviations and acronyms 
+2. Converting numbers to written form (e.g., "123" to "one hundred twenty-three")
+3. Adding pronunciation guides for technical terms in parentheses
+4. Converting symbols and special characters to spoken words
+5. Adding natural pauses with commas and periods
+6. Removing or converting markdown formatting that doesn't translate well to speech
+7. Making sentences flow more naturally when spoken aloud
+8. Converting URLs to "link" or describing their purpose
+9. Handling code blocks by describing what they do instead of reading code syntax
+
+Keep the core meaning and content intact, but make it sound natural when read aloud.
+Return ONLY the optimized text without any additional commentary."""
+GTTS_POOL_SIZE = 32  # Keep-alive connections to Google kept open, enough for two jobs at the maximum worker count
+GTTS_AUDIO_PATTERN = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+# gTTS's default pre-processors, run on each chunk before it is split into requests
+GTTS_PRE_PROCESSORS = [
+    pre_processors.tone_marks,
+    pre_processors.end_of_line,
+    pre_processors.abbreviations,
+    pre_processors.word_sub,
+]
+
+# Boundaries used when splitting text, from coarsest to finest
+PARAGRAPH_BREAK_PATTERN = re.compile(r'\n\s*\n')
+SENTENCE_BREAK_PATTERN = re.compile(r'(?<=[.!?…。！？])\s+|\n')
+WORD_BREAK_PATTERN = re.compile(r'\s+')
+WORD_PATTERN = re.compile(r'\S+')
+
+# Words ending a sentence or a clause make better request boundaries than plain spaces
+SENTENCE_END_PATTERN = re.compile(r'[.!?…。！？]["\'”’)\]]*$')
+CLAUSE_END_PATTERN = re.compile(r'[,;:—–)\]]["\'”’]*$')
+SPEAKABLE_PATTERN = re.compile(r'\w')
+
+# Markdown block syntax, matched one line at a time
+BLOCKQUOTE_PATTERN = re.compile(r'^\s{0,3}(?:>\s?)+')
+FENCE_PATTERN = re.compile(r'^\s{0,3}(`{3,}|~{3,})')
+ATX_HEADING_PATTERN = re.compile(r'^\s{0,3}#{1,6}(?:\s+(.*?))??(?:\s+#+)?\s*$')
+SETEXT_UNDERLINE_PATTERN = re.compile(r'^\s{0,3}(?:=+|-+)\s*$')
+HORIZONTAL_RULE_PATTERN = re.compile(r'^\s{0,3}([-*_])(?:\s*\1){2,}\s*$')
+LIST_ITEM_PATTERN = re.compile(r'^\s*(?:[-*+]|\d{1,9}[.)])\s+')
+INDENTED_CODE_PATTERN = re.compile(r'^(?: {4}|\t)')
+TABLE_DELIMITER_PATTERN = re.compile(r'^\s*\|?\s*:?-+:?\s*(?:\|\s*:?-+:?\s*)+\|?\s*$')
+REFERENCE_DEFINITION_PATTERN = re.compile(r'^\s{0,3}\[[^\]]+\]:\s*\S+')
+
+# Inline Markdown and HTML, in priority order; whatever has no spoken text is dropped
+INLINE_MARKUP_PATTERN = re.compile(r"""
+    (?P<code>(?P<ticks>`+)(?P<code_text>.+?)(?P=ticks))
+  | (?P<image>!\[[^\]]*\](?:\([^)]*\)|\[[^\]]*\]))
+  | (?P<link>\[(?P<link_text>[^\]]+)\](?:\([^)]*\)|\[[^\]]*\]))
+  | (?P<autolink><(?P<url>(?:https?|ftp|mailto):[^>\s]+)>)
+  | (?P<comment><!--.*?-->)
+  | (?P<tag></?[A-Za-z][^>]*>)
+  | (?P<escape>\\(?P<escaped>[!-/:-@\[-`{-~]))
+  | (?P<emphasis>(?<!\s)\*+|\*+(?!\s)|(?<!\w)_+(?=\w)|(?<=\w)_+(?!\w))
+""", re.VERBOSE | re.DOTALL)
+
+# Roughly one segment in this many may end a chunk once it is half full, so chunk
+# boundaries depend on the text itself and line up again shortly after an edit
+CHUNK_ANCHOR_INTERVAL = 4
+
+# Repeated paragraphs at least this long get chunks of their own, so they are synthesized
+# once per document. Shorter ones would cost more in extra chunk boundaries than they save.
+DEDUP_MIN_CHARS = 50
+
+# MPEG audio frame header tables
+MPEG_VERSIONS = {0: "2.5", 2: "2", 3: "1"}
+MPEG_SAMPLE_RATES = {
+    "1": [44100, 48000, 32000],
+    "2": [22050, 24000, 16000],
+    "2.5": [11025, 12000, 8000],
+}
+MPEG_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# Output profiles: "original" keeps the engine's audio, the others re-encode it with FFmpeg.
+# gTTS already returns 32 kbit/s mono MP3, so the savings are largest for WAV engines and Opus.
+OUTPUT_PROFILES = {
+    "original": {"label": "Original (MP3 from gTTS, WAV from offline engines)", "extension": None, "ffmpeg_args": None},
+    "opus": {
+        "label": "Opus in OGG, 16 kbit/s mono (smallest)",
+        "extension": "ogg",
+        "ffmpeg_args": ["-c:a", "libopus", "-b:a", "16k", "-ac", "1", "-application", "voip", "-f", "ogg"],
+    },
+    "mp3-mono": {
+        "label": "MP3, 24 kbit/s mono (plays everywhere)",
+        "extension": "mp3",
+        "ffmpeg_args": ["-c:a", "libmp3lame", "-b:a", "24k", "-ac", "1", "-f", "mp3"],
+    },
+}
+WAV_SAMPLE_FORMATS = {1: "u8", 2: "s16le", 3: "s24le", 4: "s32le"}  # FFmpeg raw formats by WAV sample width
+
+# Optimized content cache, one SQLite file; the size cap can be set in MB with TTS_OPTIMIZATION_CACHE_MAX_MB
+OPTIMIZATION_CACHE_FILE = "cache.sqlite3"
+OPTIMIZATION_CACHE_MAX_BYTES = int(os.environ.get("TTS_OPTIMIZATION_CACHE_MAX_MB", "200")) * 1024 * 1024
+OPTIMIZATION_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+# Entry count and total size live in the totals row, kept up to date by triggers
+OPTIMIZATION_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    hash TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE INDEX IF NOT EXISTS entries_created ON entries (created);
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    count INTEGER NOT NULL,
+    total_size INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals VALUES (0, 0, 0);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    UPDATE totals SET count = count + 1, total_size = total_size + new.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    UPDATE totals SET count = count - 1, total_size = total_size - old.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_resize AFTER UPDATE OF size ON entries BEGIN
+    UPDATE totals SET total_size = total_size - old.size + new.size WHERE id = 0;
+END;
+"""
+
+# Synthesized chunk audio cache
+TTS_ENGINE = "gtts"
+AUDIO_CACHE_VERSION = "1"
+AUDIO_CACHE_MAX_BYTES = 500 * 1024 * 1024
+AUDIO_CACHE_EXTENSIONS = ('.mp3', '.wav')
+
+# Checkpoints of unfinished conversions are kept for a week
+CHECKPOINT_MAX_AGE = 7 * 24 * 60 * 60
+
+# Sectioned output: <name>.m3u plus these files, and one <name>-NN-<title> track per section
+SECTION_MANIFEST_SUFFIX = ".sections.json"
+SECTION_CHAPTERS_SUFFIX = ".chapters.txt"
+SECTION_MANIFEST_VERSION = 1
+SECTION_DEFAULT_TITLE = "Introduction"
+SECTION_SLUG_PATTERN = re.compile(r'\W+')
+
+def notify(message_callback, level, message):
+    """Log a user-facing message and pass it on to the caller's message callback"""
+    logger.log(logging.ERROR if level == "error" else logging.WARNING if level == "warning" else logging.INFO, message)
+    if message_callback:
+        message_callback(level, message)
+
+# Cache functions for optimized content
+_optimization_cache_lock = threading.Lock()
+_optimization_cache_ready = set()
+
+def get_cache_dir():
+    """Get or create the cache directory for optimized content"""
+    cache_dir = os.path.join(os.path.dirname(__file__), '.optimization_cache')
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir
+
+def get_optimization_cache_path():
+    """Path of the SQLite database holding all optimized content"""
+    return os.path.join(get_cache_dir(), OPTIMIZATION_CACHE_FILE)
+
+def open_optimization_cache():
+    """Open a connection to the optimization cache, creating and migrating it on first use
+
+    Connections are cheap and not shared between threads, so every operation opens its own.
+    The entry count and total size are kept in the totals table by triggers, so stats don't scan.
+    """
+    path = get_optimization_cache_path()
+    connection = sqlite3.connect(path, timeout=30)
+    if path not in _optimization_cache_ready:
+        with _optimization_cache_lock:
+            if path not in _optimization_cache_ready:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.executescript(OPTIMIZATION_CACHE_SCHEMA)
+                migrate_json_cache(connection)
+                _optimization_cache_ready.add(path)
+    return connection
+
+def migrate_json_cache(connection):
+    """Move entries from the old one-JSON-file-per-hash cache into the database"""
+    cache_dir = get_cache_dir()
+    legacy_files = [filename for filename in os.listdir(cache_dir) if filename.endswith('.json')]
+    if not legacy_files:
+        return
+    
+    migrated = 0
+    for filename in legacy_files:
+        file_path = os.path.join(cache_dir, filename)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                cache_data = json.load(f)
+            value = zlib.compress(cache_data["optimized_content"].encode('utf-8'))
+            timestamp = cache_data.get("timestamp", time.time())
+            with connection:
+                connection.execute(
+                    "INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?, ?)",
+                    (filename[:-len('.json')], value, len(value), timestamp, timestamp)
+                )
+            migrated += 1
+        except Exception as e:
+            logger.warning(f"Could not migrate cache file {filename}: {str(e)}")
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+    logger.info(f"Migrated {migrated} of {len(legacy_files)} optimization cache files into {OPTIMIZATION_CACHE_FILE}")
+
+def get_content_hash(content):
+    """Generate a hash for the markdown content"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def get_chunk_hash(chunk):
+    """Generate a cache hash for a single optimization chunk, distinct from whole-document hashes"""
+    return get_content_hash(f"chunk\0{chunk}")
+
+def save_optimized_content(content_hash, optimized_content):
+    """Save optimized content to cache"""
+    try:
+        value = zlib.compress(optimized_content.encode('utf-8'))
+        now = time.time()
+        connection = open_optimization_cache()
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT INTO entries VALUES (?, ?, ?, ?, ?) ON CONFLICT (hash) DO UPDATE SET "
+                    "value = excluded.value, size = excluded.size, created = excluded.created, accessed = excluded.accessed",
+                    (content_hash, value, len(value), now, now)
+                )
+        finally:
+            connection.close()
+        return True
+    except Exception as e:
+        logger.warning(f"Could not save optimized content to cache: {str(e)}")
+        return False
+
+def load_optimized_content(content_hash):
+    """Load optimized content from cache if it exists and hasn't expired, marking it as recently used"""
+    try:
+        connection = open_optimization_cache()
+        try:
+            with connection:
+                row = connection.execute("SELECT value, created FROM entries WHERE hash = ?", (content_hash,)).fetchone()
+                if row is None:
+                    return None
+                value, created = row
+                if time.time() - created > OPTIMIZATION_CACHE_MAX_AGE:
+                    connection.execute("DELETE FROM entries WHERE hash = ?", (content_hash,))
+                    return None
+                connection.execute("UPDATE entries SET accessed = ? WHERE hash = ?", (time.time(), content_hash))
+            return zlib.decompress(value).decode('utf-8')
+        finally:
+            connection.close()
+    except zlib.error:
+        # Drop entries that can't be decoded so they are optimized again
+        logger.warning(f"Removing unreadable optimization cache entry {content_hash[:12]}")
+        try:
+            connection = open_optimization_cache()
+            with connection:
+                connection.execute("DELETE FROM entries WHERE hash = ?", (content_hash,))
+            connection.close()
+        except Exception:
+            pass
+        return None
+    except Exception as e:
+        logger.warning(f"Could not read optimization cache: {str(e)}")
+        return None
+
+def prune_optimization_cache(max_bytes=OPTIMIZATION_CACHE_MAX_BYTES, max_age=OPTIMIZATION_CACHE_MAX_AGE):
+    """Drop expired entries, then evict the least recently used until the cache fits in max_bytes"""
+    try:
+        connection = open_optimization_cache()
+        try:
+            with connection:
+                expired = connection.execute("DELETE FROM entries WHERE created < ?", (time.time() - max_age,)).rowcount
+            
+            evicted = 0
+            while True:
+                count, total_size = connection.execute("SELECT count, total_size FROM totals").fetchone()
+                if total_size <= max_bytes or count == 0:
+                    break
+                with connection:
+                    evicted += connection.execute(
+                        "DELETE FROM entries WHERE hash IN (SELECT hash FROM entries ORDER BY accessed LIMIT 100)"
+                    ).rowcount
+        finally:
+            connection.close()
+        if expired or evicted:
+            logger.info(f"Pruned optimization cache: {expired} expired, {evicted} evicted")
+    except Exception as e:
+        logger.warning(f"Could not prune optimization cache: {str(e)}")
+
+def clear_optimization_cache():
+    """Clear all cached optimized content"""
+    try:
+        connection = open_optimization_cache()
+        try:
+            with connection:
+                connection.execute("DELETE FROM entries")
+            connection.execute("VACUUM")
+        finally:
+            connection.close()
+        return True
+    except Exception as e:
+        logger.error(f"Error clearing cache: {str(e)}")
+        return False
+
+def get_cache_stats():
+    """Get cache statistics"""
+    try:
+        connection = open_optimization_cache()
+        try:
+            count, total_size = connection.execute("SELECT count, total_size FROM totals").fetchone()
+        finally:
+            connection.close()
+        return {"count": count, "total_size": total_size}
+    except:
+        return {"count": 0, "total_size": 0}
+
+# Cache functions for synthesized audio
+def get_audio_cache_dir():
+    """Get or create the cache directory for synthesized chunk audio"""
+    cache_dir = os.path.join(os.path.dirname(__file__), '.audio_cache')
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir
+
+def get_audio_cache_key(text, lang, engine=TTS_ENGINE):
+    """Generate a cache key from the whitespace-normalized chunk text, language and engine"""
+    normalized_text = ' '.join(text.split())
+    key_source = f"{AUDIO_CACHE_VERSION}\0{engine}\0{lang}\0{normalized_text}"
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+def load_cached_audio(cache_key, audio_format="mp3"):
+    """Load cached audio for a chunk, marking it as recently used"""
+    cache_file = os.path.join(get_audio_cache_dir(), f"{cache_key}.{audio_format}")
+    try:
+        with open(cache_file, 'rb') as f:
+            audio_data = f.read()
+        # The modification time doubles as the last-used time for LRU eviction
+        os.utime(cache_file)
+        return audio_data or None
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Could not read cached audio {cache_file}: {e}")
+        return None
+
+def save_cached_audio(cache_key, audio_data, audio_format="mp3"):
+    """Save chunk audio to the cache"""
+    try:
+        cache_file = os.path.join(get_audio_cache_dir(), f"{cache_key}.{audio_format}")
+        # Write to a temporary name first so concurrent readers never see a partial file
+        partial_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(partial_file, 'wb') as f:
+            f.write(audio_data)
+        os.replace(partial_file, cache_file)
+        return True
+    except Exception as e:
+        logger.warning(f"Could not save audio to cache: {e}")
+        return False
+
+def prune_audio_cache(max_bytes=AUDIO_CACHE_MAX_BYTES):
+    """Evict least recently used audio until the cache fits in max_bytes"""
+    try:
+        cache_dir = get_audio_cache_dir()
+        entries = []
+        total_size = 0
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(AUDIO_CACHE_EXTENSIONS):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+        
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total_size <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total_size -= size
+                removed += 1
+            except FileNotFoundError:
+                pass
+        if removed:
+            logger.info(f"Evicted {removed} entries from the audio cache")
+        return removed
+    except Exception as e:
+        logger.warning(f"Could not prune audio cache: {e}")
+        return 0
+
+def clear_audio_cache():
+    """Clear all cached chunk audio"""
+    try:
+        cache_dir = get_audio_cache_dir()
+        for filename in os.listdir(cache_dir):
+            if filename.endswith(AUDIO_CACHE_EXTENSIONS):
+                os.remove(os.path.join(cache_dir, filename))
+        return True
+    except Exception as e:
+        logger.error(f"Error clearing audio cache: {str(e)}")
+        return False
+
+def get_audio_cache_stats():
+    """Get audio cache statistics"""
+    try:
+        count = 0
+        total_size = 0
+        for entry in os.scandir(get_audio_cache_dir()):
+            if entry.name.endswith(AUDIO_CACHE_EXTENSIONS):
+                count += 1
+                total_size += entry.stat().st_size
+        return {"count": count, "total_size": total_size}
+    except:
+        return {"count": 0, "total_size": 0}
+
+@lru_cache(maxsize=1)
+def get_token_encoder():
+    """The GPT-4o tokenizer from tiktoken, or None if tiktoken or its encoding isn't available"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(OPTIMIZATION_MODEL)
+    except Exception as e:
+        # The encoding is downloaded on first use, which fails offline
+        logger.warning(f"tiktoken could not load the {OPTIMIZATION_MODEL} encoding, estimating tokens from length: {e}")
+        return None
+
+def count_tokens(text):
+    """Number of GPT-4o tokens in text, counted with tiktoken or estimated as one per four characters"""
+    encoder = get_token_encoder()
+    if encoder:
+        return len(encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def _iter_paragraph_segments(text, token_budget):
+    """Yield the paragraphs of text, splitting only paragraphs over the budget into sentences"""
+    for paragraph in _split_after(PARAGRAPH_BREAK_PATTERN, text):
+        if count_tokens(paragraph) <= token_budget:
+            yield paragraph
+        else:
+            yield from _split_after(SENTENCE_BREAK_PATTERN, paragraph)
+
+def pack_optimization_requests(content, token_budget=OPTIMIZATION_TOKEN_BUDGET):
+    """Split content into pieces of up to token_budget tokens at paragraph boundaries, one per GPT-4o request
+
+    Like split_into_chunks, pieces end early at content-defined anchors, so an edit only
+    changes the requests around it and the others still hit the optimization cache. Each
+    request resends the instructions, so pieces only end at an anchor once they are nearly
+    full (OPTIMIZATION_MIN_FILL).
+    """
+    segments = _iter_paragraph_segments(content, token_budget)
+    pieces = _pack_segments(segments, token_budget, size=count_tokens, min_size=int(token_budget * OPTIMIZATION_MIN_FILL))
+    return [piece.strip() for piece in pieces if piece.strip()]
+
+def get_max_output_tokens(input_tokens):
+    """max_tokens for a request: room for an answer somewhat longer than the input, within GPT-4o's limit"""
+    return min(OPTIMIZATION_MAX_OUTPUT_TOKENS, int(input_tokens * OPTIMIZATION_OUTPUT_RATIO) + OPTIMIZATION_OUTPUT_MARGIN)
+
+def optimize_chunk(client, chunk, input_tokens=None):
+    """Send a single content chunk to GPT-4o, returning (optimized text, prompt tokens, completion tokens, truncated)
+
+    The instructions go in the system message and the chunk alone in the user message.
+    Token counts come from the response's usage, or are estimated if it has none.
+    """
+    input_tokens = input_tokens or count_tokens(chunk)
+    try:
+        response = client.chat.completions.create(
+            model=OPTIMIZATION_MODEL,
+            messages=[
+                {"role": "system", "content": OPTIMIZATION_PROMPT},
+                {"role": "user", "content": chunk}
+            ],
+            temperature=0.3,
+            max_tokens=get_max_output_tokens(input_tokens)
+        )
+    except Exception:
+        API_REQUESTS.inc(api="openai", outcome="error")
+        raise
+    API_REQUESTS.inc(api="openai", outcome="success")
+    
+    choice = response.choices[0]
+    optimized_chunk = choice.message.content or ""
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or count_tokens(OPTIMIZATION_PROMPT) + input_tokens
+    completion_tokens = getattr(usage, "completion_tokens", None) or count_tokens(optimized_chunk)
+    OPENAI_TOKENS.inc(prompt_tokens, kind="prompt")
+    OPENAI_TOKENS.inc(completion_tokens, kind="completion")
+    return optimized_chunk, prompt_tokens, completion_tokens, choice.finish_reason == "length"
+
+def optimize_for_speech(content, api_key, progress_callback=None, max_workers=4, message_callback=None, token_budget=OPTIMIZATION_TOKEN_BUDGET):
+    """Optimize markdown content for better speech synthesis using OpenAI GPT-4o with caching
+
+    Content is packed into requests of up to token_budget tokens, cut at paragraph
+    boundaries, and the tokens sent and received are reported when it finishes.
+    """
+    if not OPENAI_AVAILABLE:
+        notify(message_callback, "error", "OpenAI library not installed. Run: pip install openai")
+        return content
+    
+    start_time = time.perf_counter()
+    try:
+        # Check cache first
+        content_hash = get_content_hash(content)
+        cached_content = load_optimized_content(content_hash)
+        CACHE_REQUESTS.inc(cache="optimization", result="hit" if cached_content else "miss")
+        
+        if cached_content:
+            if progress_callback:
+                progress_callback("✅ Found optimized content in cache!", 100)
+            notify(message_callback, "info", "🚀 Using cached optimized content (no API call needed)")
+            return cached_content
+        
+        # If not in cache, proceed with OpenAI optimization
+        if progress_callback:
+            progress_callback("Connecting to OpenAI API...", 5)
+        
+        # Retries are handled by call_with_retries, which also adapts the concurrency
+        client = openai.OpenAI(api_key=api_key, max_retries=0, timeout=OPENAI_TIMEOUT)
+        
+        # Fill each request up to the token budget, cutting only between paragraphs
+        content_chunks = pack_optimization_requests(content, token_budget)
+        chunk_tokens = [count_tokens(chunk) for chunk in content_chunks]
+        
+        total_chunks = len(content_chunks)
+        logger.info(f"Packed {sum(chunk_tokens)} tokens into {total_chunks} requests of up to {token_budget} tokens "
+                    f"({'tiktoken' if get_token_encoder() else 'estimated from length'})")
+        
+        # Stitch in cached results for unchanged chunks and only send the rest to the API
+        chunk_hashes = [get_chunk_hash(chunk) for chunk in content_chunks]
+        optimized_chunks = [load_optimized_content(chunk_hash) for chunk_hash in chunk_hashes]
+        pending_chunks = [i for i, optimized_chunk in enumerate(optimized_chunks) if not optimized_chunk]
+        cached_chunks = total_chunks - len(pending_chunks)
+        CACHE_REQUESTS.inc(cached_chunks, cache="optimization_chunk", result="hit")
+        CACHE_REQUESTS.inc(len(pending_chunks), cache="optimization_chunk", result="miss")
+        logger.info(f"Optimization cache: {cached_chunks} of {total_chunks} chunks cached, {len(pending_chunks)} to optimize")
+        if cached_chunks:
+            notify(message_callback, "info", f"🚀 Reusing {cached_chunks} of {total_chunks} cached chunks, optimizing {len(pending_chunks)} changed chunk(s)")
+        
+        # Keep several chunk requests in flight, then reassemble them in their original order
+        max_workers = max(1, min(max_workers, len(pending_chunks) or 1))
+        logger.info(f"Optimizing {len(pending_chunks)} chunks with up to {max_workers} concurrent requests")
+        if progress_callback:
+            progress_callback(f"Optimizing {len(pending_chunks)} of {total_chunks} chunks...", 10)
+        
+        limiter = AdaptiveLimiter(max_workers, name="OpenAI requests")
+        failed_chunks = []
+        truncated_chunks = []
+        prompt_tokens = completion_tokens = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(call_with_retries, optimize_chunk, client, content_chunks[i], chunk_tokens[i], api="openai", limiter=limiter): i
+                for i in pending_chunks
+            }
+            try:
+                completed = 0
+                for future in as_completed(futures):
+                    index = futures[future]
+                    try:
+                        optimized_chunk, sent, received, truncated = future.result()
+                        prompt_tokens += sent
+                        completion_tokens += received
+                        if truncated:
+                            # A cut-off answer would drop the end of the chunk, so it is read as written
+                            logger.warning(f"Optimized chunk {index + 1} hit max_tokens, keeping the original text")
+                            truncated_chunks.append(index)
+                            optimized_chunks[index] = content_chunks[index]
+                        else:
+                            optimized_chunks[index] = optimized_chunk
+                    except Exception as chunk_error:
+                        # Errors that retrying can't fix, such as a bad API key, stop the optimization
+                        if classify_error(chunk_error) is None:
+                            raise
+                        logger.error(f"Optimizing chunk {index + 1} failed after retries: {chunk_error}")
+                        failed_chunks.append(index)
+                        optimized_chunks[index] = content_chunks[index]
+                    else:
+                        # Cache each chunk as soon as it arrives so a later failure doesn't lose it
+                        if not truncated:
+                            save_optimized_content(chunk_hashes[index], optimized_chunks[index])
+                    completed += 1
+                    if progress_callback:
+                        progress = 10 + int((completed / len(pending_chunks)) * 80)  # 10% to 90% for processing
+                        progress_callback(f"Optimized chunk {completed} of {len(pending_chunks)}...", progress)
+            except Exception:
+                # Don't send the remaining requests once one has failed
+                for future in futures:
+                    future.cancel()
+                raise
+        
+        # Combine all optimized chunks
+        optimized_content = "\n\n".join(optimized_chunks)
+        if pending_chunks:
+            notify(message_callback, "info", f"🔢 Sent {prompt_tokens:,} tokens and received {completion_tokens:,} in {len(pending_chunks)} GPT-4o request(s)")
+        if truncated_chunks:
+            notify(message_callback, "warning", f"⚠️ {len(truncated_chunks)} of {total_chunks} chunks were cut off by the output limit and will be read as written. "
+                   "Lower TTS_OPTIMIZATION_TOKEN_BUDGET to send smaller requests")
+        
+        if failed_chunks or truncated_chunks:
+            # Don't cache the partial result, so optimizing again retries the failed chunks
+            if failed_chunks:
+                notify(message_callback, "warning", f"⚠️ {len(failed_chunks)} of {total_chunks} chunks could not be optimized because the OpenAI API kept failing; they will be read as written. Optimize again later to retry them")
+            prune_optimization_cache()
+            if progress_callback:
+                progress_callback("Optimization finished with unoptimized chunks", 100)
+            return optimized_content
+        
+        # Save to cache
+        if progress_callback:
+            progress_callback("Saving to cache...", 95)
+        
+        if save_optimized_content(content_hash, optimized_content):
+            notify(message_callback, "success", "💾 Optimized content saved to cache for future use!")
+        prune_optimization_cache()
+        
+        if progress_callback:
+            progress_callback("Optimization complete!", 100)
+        
+        return optimized_content
+        
+    except Exception as e:
+        notify(message_callback, "error", f"Error optimizing content with OpenAI, using the original content instead: {str(e)}")
+        return content
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start_time, stage="optimize")
+
+def parse_text_rules(rules_text):
+    """Parse user-defined rules, one "old => new" per line, into (old, new) pairs
+
+    Blank lines and lines starting with # are ignored. Leaving out the replacement removes the text.
+    """
+    rules = []
+    for line_number, line in enumerate(rules_text.splitlines(), start=1):
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        old, separator, new = line.partition(TEXT_RULE_SEPARATOR)
+        old = old.strip()
+        if not separator or not old:
+            raise ValueError(f"Rule on line {line_number} must look like 'old {TEXT_RULE_SEPARATOR} new': {line.strip()}")
+        rules.append((old, new.strip()))
+    return tuple(rules)
+
+def build_text_rules(signs_to_exclude, custom_rules=()):
+    """Combine the rules for the selected signs with user-defined rules, later rules winning on conflicts"""
+    rules = []
+    for sign in signs_to_exclude:
+        rules.extend(SIGN_RULES.get(sign, ()))
+    rules.extend(tuple(rule) for rule in custom_rules)
+    return tuple(rules)
+
+@lru_cache(maxsize=32)
+def compile_text_rules(rules):
+    """Compile (old, new) rules into a function that applies all of them in one pass over the text
+
+    The text is processed as UTF-8 bytes. ASCII characters replaced by at most one ASCII character
+    go into a bytes.translate table, which stays fast on non-ASCII text where str.translate doesn't.
+    Every other rule goes into one alternation regex (longest first). Longer rules take precedence,
+    and no replacement is rewritten by another rule.
+    """
+    replacements = {old.encode('utf-8'): new.encode('utf-8') for old, new in dict(rules).items()}
+    translated = {old: new for old, new in replacements.items() if len(old) == 1 and len(new) <= 1}
+    table = bytes.maketrans(
+        b''.join(old for old, new in translated.items() if new),
+        b''.join(new for new in translated.values() if new)
+    )
+    delete = b''.join(old for old, new in translated.items() if not new)
+    matched = sorted((old for old in replacements if old not in translated), key=len, reverse=True)
+    pattern = re.compile(b'|'.join(map(re.escape, matched))) if matched else None
+    
+    def normalize(text):
+        data = text.encode('utf-8', 'surrogatepass')
+        if not pattern:
+            return data.translate(table, delete).decode('utf-8', 'surrogatepass')
+        # Translate only the bytes between matches so replacements aren't rewritten again
+        pieces = []
+        position = 0
+        for match in pattern.finditer(data):
+            pieces.append(data[position:match.start()].translate(table, delete))
+            pieces.append(replacements[match.group(0)])
+            position = match.end()
+        pieces.append(data[position:].translate(table, delete))
+        return b''.join(pieces).decode('utf-8', 'surrogatepass')
+    
+    return normalize
+
+def clean_text(text, signs_to_exclude, custom_rules=()):
+    """Remove unwanted Markdown elements by replacing them with appropriate text or removing them"""
+    return compile_text_rules(build_text_rules(signs_to_exclude, custom_rules))(text)
+
+def _split_after(pattern, text):
+    """Split text after each match of pattern, keeping the separators attached to the preceding piece"""
+    pieces = []
+    start = 0
+    for match in pattern.finditer(text):
+        if match.end() > start:
+            pieces.append(text[start:match.end()])
+            start = match.end()
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
+
+def _iter_text_segments(text, max_size):
+    """Yield pieces of text no longer than max_size, split at the coarsest boundary that fits"""
+    for paragraph in _split_after(PARAGRAPH_BREAK_PATTERN, text):
+        if len(paragraph) <= max_size:
+            yield paragraph
+            continue
+        for sentence in _split_after(SENTENCE_BREAK_PATTERN, paragraph):
+            if len(sentence) <= max_size:
+                yield sentence
+                continue
+            for word in _split_after(WORD_BREAK_PATTERN, sentence):
+                # Words longer than a whole chunk can only be cut blindly
+                while len(word) > max_size:
+                    yield word[:max_size]
+                    word = word[max_size:]
+                if word:
+                    yield word
+
+def normalize_segment(text):
+    """Collapse whitespace, so text that only differs in line breaks and spacing compares equal"""
+    return ' '.join(text.split())
+
+def _is_chunk_anchor(segment):
+    """Decide from its content alone whether a segment may end a chunk"""
+    return zlib.crc32(normalize_segment(segment).encode('utf-8')) % CHUNK_ANCHOR_INTERVAL == 0
+
+def split_into_chunks(text, chunk_size, isolate_repeats=False):
+    """Split text into chunks of at most chunk_size characters at paragraph, sentence or word boundaries
+
+    Chunks end early at content-defined anchors, so an edit only changes the chunks around it
+    and the rest still match the audio and optimization caches. With isolate_repeats, every
+    paragraph or sentence that occurs more than once becomes a chunk of its own, so that
+    deduplicate_chunks can synthesize it once.
+    """
+    segments = _iter_text_segments(text, chunk_size)
+    repeated = set()
+    if isolate_repeats:
+        segments = list(segments)
+        counts = {}
+        for segment in segments:
+            key = normalize_segment(segment)
+            counts[key] = counts.get(key, 0) + 1
+        repeated = {key for key, count in counts.items() if count > 1 and len(key) >= DEDUP_MIN_CHARS}
+    
+    return [chunk.strip() for chunk in _pack_segments(segments, chunk_size, repeated) if chunk.strip()]
+
+def _pack_segments(segments, chunk_size, repeated=(), size=len, min_size=None):
+    """Join segments into chunks of at most chunk_size, measured by size, ending early at anchors and around repeats
+
+    A chunk only ends at an anchor once it holds min_size, half of chunk_size by default.
+    """
+    if min_size is None:
+        min_size = chunk_size // 2
+    current = []
+    current_size = 0
+    for segment in segments:
+        segment_size = size(segment)
+        if repeated and normalize_segment(segment) in repeated:
+            if current:
+                yield ''.join(current)
+                current = []
+                current_size = 0
+            yield segment
+            continue
+        if current and current_size + segment_size > chunk_size:
+            yield ''.join(current)
+            current = []
+            current_size = 0
+        current.append(segment)
+        current_size += segment_size
+        if current_size >= min_size and _is_chunk_anchor(segment):
+            yield ''.join(current)
+            current = []
+            current_size = 0
+    if current:
+        yield ''.join(current)
+
+def deduplicate_chunks(text_chunks):
+    """Return the distinct chunks in order of first appearance, and the index into them of every chunk"""
+    unique_chunks = []
+    positions = {}
+    chunk_map = []
+    for chunk in text_chunks:
+        key = normalize_segment(chunk)
+        if key not in positions:
+            positions[key] = len(unique_chunks)
+            unique_chunks.append(chunk)
+        chunk_map.append(positions[key])
+    return unique_chunks, chunk_map
+
+def is_speakable(text):
+    """Check whether text contains anything other than whitespace and punctuation"""
+    return SPEAKABLE_PATTERN.search(text) is not None
+
+def pack_speech_requests(text, max_chars=GTTS_MAX_REQUEST_CHARS):
+    """Split text into the fewest pieces of at most max_chars, preferring sentence and clause boundaries
+
+    Used as the gTTS tokenizer, so each piece becomes exactly one request to Google.
+    gTTS's own tokenizer starts a new request at every comma and full stop instead.
+    """
+    spans = []
+    for match in WORD_PATTERN.finditer(text):
+        start, end = match.span()
+        while end - start > max_chars:
+            spans.append((start, start + max_chars))
+            start += max_chars
+        spans.append((start, end))
+    if not spans:
+        return []
+    
+    # Cost of ending a piece after each word: 0 at sentence ends and line breaks, 1 at clauses, 2 elsewhere
+    penalties = []
+    for i, (start, end) in enumerate(spans):
+        word = text[start:end]
+        if i == len(spans) - 1 or '\n' in text[end:spans[i + 1][0]] or SENTENCE_END_PATTERN.search(word):
+            penalties.append(0)
+        elif CLAUSE_END_PATTERN.search(word):
+            penalties.append(1)
+        else:
+            penalties.append(2)
+    
+    # Packing greedily from the end gives the earliest position each piece may start at
+    # while still using the minimum number of pieces
+    earliest_starts = []
+    last = len(spans) - 1
+    while last >= 0:
+        first = last
+        while first > 0 and spans[last][1] - spans[first - 1][0] <= max_chars:
+            first -= 1
+        earliest_starts.append(first)
+        last = first - 1
+    earliest_starts.reverse()
+    
+    # Walk forward, cutting at the best boundary that keeps the piece count minimal
+    pieces = []
+    first = 0
+    for k in range(len(earliest_starts)):
+        if k == len(earliest_starts) - 1:
+            cut = len(spans) - 1
+        else:
+            reach = first
+            while reach + 1 < len(spans) and spans[reach + 1][1] - spans[first][0] <= max_chars:
+                reach += 1
+            cut = reach
+            for candidate in range(reach, max(first, earliest_starts[k + 1] - 1) - 1, -1):
+                if penalties[candidate] < penalties[cut]:
+                    cut = candidate
+        pieces.append(text[spans[first][0]:spans[cut][1]])
+        first = cut + 1
+    
+    return pieces
+
+def count_tts_requests(chunk):
+    """Predict how many HTTP requests gTTS will make to synthesize a chunk"""
+    text = chunk.strip()
+    for pre_processor in GTTS_PRE_PROCESSORS:
+        text = pre_processor(text)
+    if len(text) <= GTTS_MAX_REQUEST_CHARS:
+        return 1 if is_speakable(text) else 0
+    return sum(1 for piece in pack_speech_requests(text) if is_speakable(piece))
+
+def parse_mp3_frame_header(data, offset):
+    """Parse the MPEG audio frame header at offset, returning None if there isn't a valid one"""
+    if offset + 4 > len(data) or data[offset] != 0xFF or (data[offset + 1] & 0xE0) != 0xE0:
+        return None
+    version_bits = (data[offset + 1] >> 3) & 0x03
+    layer_bits = (data[offset + 1] >> 1) & 0x03
+    bitrate_index = data[offset + 2] >> 4
+    sample_rate_index = (data[offset + 2] >> 2) & 0x03
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    
+    version = MPEG_VERSIONS[version_bits]
+    layer = 4 - layer_bits
+    padding = (data[offset + 2] >> 1) & 0x01
+    mono = (data[offset + 3] >> 6) == 0x03
+    bitrate = MPEG_BITRATES[(version == "1", layer)][bitrate_index] * 1000
+    sample_rate = MPEG_SAMPLE_RATES[version][sample_rate_index]
+    
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+        samples = 384
+    elif layer == 3 and version != "1":
+        length = 72 * bitrate // sample_rate + padding
+        samples = 576
+    else:
+        length = 144 * bitrate // sample_rate + padding
+        samples = 1152
+    
+    # Xing/Info headers follow the side information, whose size depends on version and channels
+    if version == "1":
+        side_info_size = 17 if mono else 32
+    else:
+        side_info_size = 9 if mono else 17
+    protected = not (data[offset + 1] & 0x01)
+    
+    return {
+        "length": length,
+        "samples": samples,
+        "sample_rate": sample_rate,
+        "xing_offset": 4 + side_info_size + (2 if protected else 0),
+    }
+
+def _is_vbr_header_frame(data, offset, frame):
+    """Check whether a frame carries a Xing, Info or VBRI header instead of audio"""
+    xing_offset = offset + frame["xing_offset"]
+    if data[xing_offset:xing_offset + 4] in (b"Xing", b"Info"):
+        return True
+    return data[offset + 36:offset + 40] == b"VBRI"
+
+def iter_mp3_frames(data):
+    """Yield (start, end, frame) for each audio frame, skipping ID3/APE tags, VBR headers and junk"""
+    offset = 0
+    size = len(data)
+    while offset < size:
+        # ID3v2 tag: 10-byte header with a syncsafe size, plus an optional 10-byte footer
+        if data[offset:offset + 3] == b"ID3" and offset + 10 <= size:
+            tag_size = (data[offset + 6] << 21) | (data[offset + 7] << 14) | (data[offset + 8] << 7) | data[offset + 9]
+            offset += 10 + tag_size + (10 if data[offset + 5] & 0x10 else 0)
+            continue
+        # ID3v1 tag: fixed 128 bytes
+        if data[offset:offset + 3] == b"TAG" and offset + 128 <= size:
+            offset += 128
+            continue
+        # APEv2 tag: 32-byte header/footer with the size of the rest of the tag
+        if data[offset:offset + 8] == b"APETAGEX" and offset + 32 <= size:
+            offset += 32 + int.from_bytes(data[offset + 12:offset + 16], "little")
+            continue
+        
+        frame = parse_mp3_frame_header(data, offset)
+        if frame is None or offset + frame["length"] > size:
+            # Resynchronize on the next possible frame header
+            next_sync = data.find(b"\xff", offset + 1)
+            if next_sync == -1:
+                break
+            offset = next_sync
+            continue
+        
+        end = offset + frame["length"]
+        if not _is_vbr_header_frame(data, offset, frame):
+            yield offset, end, frame
+        offset = end
+
+def _iter_frame_runs(data):
+    """Yield (start, end) byte ranges covering runs of consecutive audio frames"""
+    run_start = run_end = None
+    for start, end, _ in iter_mp3_frames(data):
+        if start == run_end:
+            run_end = end
+            continue
+        if run_start is not None:
+            yield run_start, run_end
+        run_start, run_end = start, end
+    if run_start is not None:
+        yield run_start, run_end
+
+def strip_mp3_metadata(data):
+    """Return only the MPEG audio frames of an MP3, without tags or VBR header frames"""
+    return b"".join(data[start:end] for start, end in _iter_frame_runs(data))
+
+def combine_audio_data(audio_chunks, output_file, message_callback=None):
+    """Concatenate in-memory MP3 chunks into one file by copying their audio frames"""
+    partial_file = f"{output_file}.part"
+    try:
+        with open(partial_file, 'wb') as output:
+            for i, audio_data in enumerate(audio_chunks):
+                # Write straight from the chunk buffer without copying it
+                view = memoryview(audio_data)
+                bytes_written = 0
+                for start, end in _iter_frame_runs(audio_data):
+                    output.write(view[start:end])
+                    bytes_written += end - start
+                if bytes_written == 0:
+                    raise Exception(f"Chunk {i + 1} contains no MP3 audio frames")
+        
+        os.replace(partial_file, output_file)
+        logger.info(f"Success! Output file created: {output_file}, size: {os.path.getsize(output_file)} bytes")
+        return True
+    except Exception as e:
+        notify(message_callback, "error", f"Error during concatenation: {e}")
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        return False
+
+def read_wav(data):
+    """Return ((channels, sample_width, frame_rate), frames) from WAV data
+
+    The data chunk is read up to the end of the input, because programs writing WAV to a
+    pipe can't go back to fill in its size and leave a placeholder instead.
+    """
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError("Not a WAV file")
+    params = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id, chunk_size = struct.unpack_from('<4sI', data, offset)
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            audio_format, channels, frame_rate, _, _, bits_per_sample = struct.unpack_from('<HHIIHH', data, body)
+            if audio_format != 1:
+                raise ValueError(f"Unsupported WAV encoding {audio_format}, only PCM is supported")
+            params = (channels, bits_per_sample // 8, frame_rate)
+        elif chunk_id == b'data':
+            if params is None:
+                raise ValueError("WAV data chunk comes before its format chunk")
+            frames = data[body:min(body + chunk_size, len(data))]
+            frame_size = params[0] * params[1]
+            return params, frames[:len(frames) - len(frames) % frame_size]
+        offset = body + chunk_size + (chunk_size & 1)
+    raise ValueError("WAV file has no audio data")
+
+def write_wav(params, frames):
+    """Build WAV data with a correct header from (channels, sample_width, frame_rate) and PCM frames"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(params[0])
+        wav_file.setsampwidth(params[1])
+        wav_file.setframerate(params[2])
+        wav_file.writeframes(frames)
+    return buffer.getvalue()
+
+def combine_wav_data(audio_chunks, output_file, message_callback=None):
+    """Concatenate in-memory WAV chunks with matching formats into one WAV file"""
+    partial_file = f"{output_file}.part"
+    try:
+        with wave.open(partial_file, 'wb') as output:
+            params = None
+            for i, audio_data in enumerate(audio_chunks):
+                chunk_params, frames = read_wav(audio_data)
+                if params is None:
+                    params = chunk_params
+                    output.setnchannels(params[0])
+                    output.setsampwidth(params[1])
+                    output.setframerate(params[2])
+                elif chunk_params != params:
+                    raise Exception(f"Chunk {i + 1} is {chunk_params}, expected {params} (channels, sample width, rate)")
+                output.writeframes(frames)
+        
+        os.replace(partial_file, output_file)
+        logger.info(f"Success! Output file created: {output_file}, size: {os.path.getsize(output_file)} bytes")
+        return True
+    except Exception as e:
+        notify(message_callback, "error", f"Error during concatenation: {e}")
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        return False
+
+def combine_audio_chunks(temp_files, output_file, message_callback=None):
+    """Combine MP3 files using ffmpeg with better error handling"""
+    try:
+        logger.debug(f"Starting audio combination with {len(temp_files)} files into {output_file}")
+        
+        # Log all temp files and verify they exist
+        for i, temp_file in enumerate(temp_files):
+            logger.debug(f"Temp file {i}: {temp_file}")
+            if os.path.exists(temp_file):
+                file_size = os.path.getsize(temp_file)
+                logger.debug(f"  - Exists: YES, Size: {file_size} bytes")
+            else:
+                logger.error(f"  - Exists: NO - FILE MISSING!")
+                return False
+        
+        if len(temp_files) == 1:
+            # If only one file, just copy it
+            logger.debug("Only one file, copying directly...")
+            shutil.copy2(temp_files[0], output_file)
+            return True
+        
+        # Create a temporary file list for ffmpeg
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
+            for temp_file in temp_files:
+                # Use absolute paths and escape any special characters
+                abs_path = os.path.abspath(temp_file)
+                f.write(f"file '{abs_path}'\n")
+                logger.debug(f"Added to concat list: {abs_path}")
+            filelist_path = f.name
+        
+        logger.debug(f"Created FFmpeg file list: {filelist_path}")
+        
+        try:
+            # Use ffmpeg with file list for more reliable concatenation
+            command = [
+                'ffmpeg', '-f', 'concat', '-safe', '0', '-i', filelist_path,
+                '-c', 'copy', output_file, '-y'
+            ]
+            
+            logger.debug(f"Running FFmpeg command: {' '.join(command)}")
+            result = subprocess.run(command, capture_output=True, text=True)
+            
+            logger.debug(f"FFmpeg return code: {result.returncode}")
+            if result.stdout:
+                logger.debug(f"FFmpeg stdout: {result.stdout}")
+            if result.stderr:
+                logger.debug(f"FFmpeg stderr: {result.stderr}")
+            
+            if result.returncode == 0:
+                # Verify output file was created
+                if os.path.exists(output_file):
+                    output_size = os.path.getsize(output_file)
+                    logger.info(f"Success! Output file created: {output_file}, size: {output_size} bytes")
+                    return True
+                else:
+                    logger.error("FFmpeg returned success but output file doesn't exist!")
+                    return False
+            else:
+                notify(message_callback, "error", f"FFmpeg error: {result.stderr}")
+                return False
+                
+        finally:
+            # Clean up the temporary file list
+            if os.path.exists(filelist_path):
+                os.remove(filelist_path)
+                logger.debug(f"Cleaned up file list: {filelist_path}")
+        
+    except FileNotFoundError:
+        notify(message_callback, "error", "FFmpeg not found. Please install FFmpeg to combine audio files.")
+        return False
+    except Exception as e:
+        notify(message_callback, "error", f"Error during concatenation: {e}")
+        return False
+
+def get_output_extension(audio_format, output_profile="original"):
+    """File extension of a conversion's output for the engine's audio format and the output profile"""
+    return OUTPUT_PROFILES[output_profile]["extension"] or audio_format
+
+def _iter_raw_audio(audio_chunks, audio_format):
+    """Yield FFmpeg input arguments, then the chunks' audio without headers or tags, ready to concatenate"""
+    if audio_format == "wav":
+        params = None
+        for i, audio_data in enumerate(audio_chunks):
+            chunk_params, frames = read_wav(audio_data)
+            if params is None:
+                params = chunk_params
+                channels, sample_width, rate = params
+                yield ["-f", WAV_SAMPLE_FORMATS[sample_width], "-ar", str(rate), "-ac", str(channels)]
+            elif chunk_params != params:
+                raise Exception(f"Chunk {i + 1} is {chunk_params}, expected {params} (channels, sample width, rate)")
+            yield frames
+    else:
+        yield ["-f", "mp3"]
+        for audio_data in audio_chunks:
+            view = memoryview(audio_data)
+            for start, end in _iter_frame_runs(audio_data):
+                yield view[start:end]
+
+def _format_size(size):
+    return f"{size / (1024 * 1024):.1f} MB" if size >= 1024 * 1024 else f"{size / 1024:.0f} KB"
+
+def transcode_audio_data(audio_chunks, output_file, output_profile, audio_format="mp3", message_callback=None):
+    """Encode all chunks into output_file with a single FFmpeg process fed through a pipe
+
+    The chunks are streamed into FFmpeg's stdin back to back, so there is one encode
+    for the whole document and no intermediate files. Reports the size saved compared
+    with the engine's original audio.
+    """
+    profile = OUTPUT_PROFILES[output_profile]
+    partial_file = f"{output_file}.part"
+    original_size = 0
+    
+    def count_bytes(audio_chunks):
+        # Chunks may come from a generator, so they are counted on their way to FFmpeg
+        nonlocal original_size
+        for audio_data in audio_chunks:
+            original_size += len(audio_data)
+            yield audio_data
+    
+    try:
+        pieces = _iter_raw_audio(count_bytes(audio_chunks), audio_format)
+        input_args = next(pieces)
+        command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', *input_args, '-i', 'pipe:0', *profile["ffmpeg_args"], partial_file]
+        logger.debug(f"Running FFmpeg command: {' '.join(command)}")
+        
+        # FFmpeg's errors go to a file, so a full stderr pipe can't stall it while we write
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=errors)
+            try:
+                for piece in pieces:
+                    process.stdin.write(piece)
+                process.stdin.close()
+            except BrokenPipeError:
+                # FFmpeg exited early; its error message explains why
+                pass
+            except Exception:
+                process.kill()
+                process.wait()
+                raise
+            if process.wait() != 0:
+                errors.seek(0)
+                raise Exception(f"FFmpeg exited with code {process.returncode}: {errors.read().decode('utf-8', 'replace').strip()}")
+        
+        os.replace(partial_file, output_file)
+        output_size = os.path.getsize(output_file)
+        logger.info(f"Success! Output file created: {output_file}, size: {output_size} bytes ({original_size} before encoding)")
+        if output_size < original_size:
+            notify(message_callback, "success", f"🗜️ {profile['label'].split(',')[0]} output is {_format_size(output_size)} instead of {_format_size(original_size)}, "
+                   f"saving {_format_size(original_size - output_size)} ({100 * (original_size - output_size) / original_size:.0f}%)")
+        else:
+            notify(message_callback, "info", f"Output is {_format_size(output_size)}; the original audio was {_format_size(original_size)}")
+        return True
+    except FileNotFoundError:
+        notify(message_callback, "error", "FFmpeg not found. Install FFmpeg or choose the original output format.")
+    except Exception as e:
+        notify(message_callback, "error", f"Error during encoding: {e}")
+    if os.path.exists(partial_file):
+        os.remove(partial_file)
+    return False
+
+# Checkpoints for resumable conversions
+def get_checkpoint_root():
+    """Get or create the directory holding checkpoints of unfinished conversions"""
+    checkpoint_root = os.path.join(os.path.dirname(__file__), '.tts_checkpoints')
+    if not os.path.exists(checkpoint_root):
+        os.makedirs(checkpoint_root)
+    return checkpoint_root
+
+def get_job_id(text_chunks, lang, engine=TTS_ENGINE):
+    """Identify a conversion by everything that determines its chunk audio"""
+    job_hash = hashlib.sha256(f"{AUDIO_CACHE_VERSION}\0{engine}\0{lang}".encode('utf-8'))
+    for chunk in text_chunks:
+        job_hash.update(b"\0" + chunk.encode('utf-8'))
+    return job_hash.hexdigest()[:32]
+
+def prune_checkpoints(max_age=CHECKPOINT_MAX_AGE):
+    """Remove checkpoints of conversions that haven't been touched for max_age seconds"""
+    try:
+        for entry in os.scandir(get_checkpoint_root()):
+            if entry.is_dir() and time.time() - entry.stat().st_mtime > max_age:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                logger.info(f"Removed stale checkpoint {entry.name}")
+    except Exception as e:
+        logger.warning(f"Could not prune checkpoints: {e}")
+
+class JobCheckpoint:
+    """Durable record of the chunks a conversion has finished, so a failed or killed run can resume
+
+    Each finished chunk's audio is written to its own file, then appended to manifest.jsonl.
+    Only chunks listed in the manifest, with a matching file, count as done.
+    """
+    
+    def __init__(self, job_id, text_chunks, audio_format="mp3"):
+        self.job_id = job_id
+        self.audio_format = audio_format
+        self.directory = os.path.join(get_checkpoint_root(), job_id)
+        self.manifest_file = os.path.join(self.directory, "manifest.jsonl")
+        self.chunk_hashes = [hashlib.sha256(chunk.encode('utf-8')).hexdigest() for chunk in text_chunks]
+        os.makedirs(self.directory, exist_ok=True)
+    
+    def load_completed(self):
+        """Return {index: audio_data} for every chunk recorded by an earlier run"""
+        completed = {}
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return completed
+        
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                index = entry["index"]
+                if entry["hash"] != self.chunk_hashes[index]:
+                    continue
+                with open(os.path.join(self.directory, entry["file"]), 'rb') as f:
+                    audio_data = f.read()
+                if len(audio_data) == entry["size"]:
+                    completed[index] = audio_data
+            except (ValueError, KeyError, IndexError, OSError):
+                # A line cut short by a crash, or a chunk file that went missing
+                continue
+        return completed
+    
+    def record(self, index, audio_data):
+        """Persist a finished chunk before adding it to the manifest"""
+        chunk_file = f"chunk_{index:05d}.{self.audio_format}"
+        with open(os.path.join(self.directory, chunk_file), 'wb') as f:
+            f.write(audio_data)
+        entry = {"index": index, "file": chunk_file, "hash": self.chunk_hashes[index], "size": len(audio_data)}
+        with open(self.manifest_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + "\n")
+    
+    def discard(self):
+        """Delete the checkpoint once the output file has been written"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+# Speech engines
+class TTSBackend:
+    """Interface for speech engines; more implementations live in tts_backends.py
+
+    Subclasses set name, label and audio_format ("mp3" or "wav") and implement synthesize.
+    Engines that split a chunk into several requests set retries_requests and retry each
+    request themselves, so one failed request doesn't send the whole chunk again.
+    """
+    name = None
+    label = None
+    audio_format = "mp3"
+    retries_requests = False
+    
+    @property
+    def cache_id(self):
+        """Engine name plus any settings that change the audio, used in cache keys and job IDs"""
+        return self.name
+    
+    def is_available(self):
+        return True
+    
+    def synthesize(self, text, lang):
+        """Return the audio for one chunk of text as bytes in audio_format
+
+        With retries_requests set, it is called with a limiter keyword argument as well.
+        """
+        raise NotImplementedError
+    
+    def count_requests(self, text):
+        """Predict how many requests or processes synthesizing a chunk takes"""
+        return 1
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        HTTP_CONNECTIONS.inc(api=TTS_ENGINE)
+        return super()._new_conn()
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        HTTP_CONNECTIONS.inc(api=TTS_ENGINE)
+        return super()._new_conn()
+
+class _CountingHTTPAdapter(HTTPAdapter):
+    """Connection pool that counts the connections it opens, for the reuse metric"""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _CountingHTTPConnectionPool, "https": _CountingHTTPSConnectionPool}
+
+_gtts_session = None
+_gtts_session_lock = threading.Lock()
+
+def get_gtts_session():
+    """The keep-alive session shared by every gTTS request in this process"""
+    global _gtts_session
+    with _gtts_session_lock:
+        if _gtts_session is None:
+            session = requests.Session()
+            adapter = _CountingHTTPAdapter(pool_connections=4, pool_maxsize=GTTS_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _gtts_session = session
+        return _gtts_session
+
+def _reset_gtts_session():
+    # A forked worker process must not share the parent's sockets
+    global _gtts_session, _gtts_session_lock
+    _gtts_session = None
+    _gtts_session_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_gtts_session)
+
+class PooledGTTS(gTTS):
+    """gTTS sending its requests over the shared keep-alive session
+
+    gTTS opens a new session, and with it a new TLS connection, for every request. This
+    sends the same requests and parses the responses the same way, but over connections
+    that stay open across the pieces of a chunk, the chunks of a job and later jobs.
+    Unlike gTTS, it leaves certificate verification on. Each request is retried on its
+    own and waits for the limiter, if given, so a failure doesn't resend whole chunks.
+    """
+    
+    def __init__(self, *args, limiter=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter
+    
+    def _fetch_audio(self, session, idx, prepared_request):
+        # Read the whole response here, so that errors while reading it are retried too
+        try:
+            HTTP_REQUESTS.inc(api=TTS_ENGINE)
+            response = session.send(prepared_request, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            raise gTTSError(tts=self, response=response)
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"gTTS request {idx} failed: {e}")
+            raise gTTSError(tts=self)
+        
+        audio_parts = []
+        for line in response.iter_lines(chunk_size=1024):
+            decoded_line = line.decode("utf-8")
+            if "jQ1olc" in decoded_line:
+                audio_search = GTTS_AUDIO_PATTERN.search(decoded_line)
+                if not audio_search:
+                    # A successful response without audio, usually an unsupported language
+                    raise gTTSError(tts=self, response=response)
+                audio_parts.append(base64.b64decode(audio_search.group(1).encode("ascii")))
+        return audio_parts
+    
+    def stream(self):
+        session = get_gtts_session()
+        for idx, prepared_request in enumerate(self._prepare_requests()):
+            def request():
+                try:
+                    audio_parts = self._fetch_audio(session, idx, prepared_request)
+                except Exception:
+                    API_REQUESTS.inc(api=TTS_ENGINE, outcome="error")
+                    raise
+                API_REQUESTS.inc(api=TTS_ENGINE, outcome="success")
+                return audio_parts
+            
+            yield from call_with_retries(request, api=TTS_ENGINE, limiter=self.limiter)
+
+class GTTSBackend(TTSBackend):
+    """Google Text-to-Speech through gTTS, packing each chunk into as few requests as possible"""
+    name = TTS_ENGINE
+    label = "Google Text-to-Speech (online)"
+    audio_format = "mp3"
+    retries_requests = True
+    
+    def synthesize(self, text, lang, limiter=None):
+        tts = PooledGTTS(text, lang=lang, tokenizer_func=pack_speech_requests, timeout=GTTS_TIMEOUT, limiter=limiter)
+        buffer = io.BytesIO()
+        tts.write_to_fp(buffer)
+        return buffer.getvalue()
+    
+    def count_requests(self, text):
+        return count_tts_requests(text)
+
+DEFAULT_BACKEND = GTTSBackend()
+
+def synthesize_chunk(chunk, lang, index, use_cache=True, backend=None, limiter=None):
+    """Convert a single text chunk to speech in memory
+
+    Transient engine errors are retried with backoff, and the limiter, if given, caps the
+    number of requests in flight. Engines with retries_requests retry each of their own
+    requests; the others are retried a whole chunk at a time. Returns the audio data and
+    whether it came from the cache.
+    """
+    backend = backend or DEFAULT_BACKEND
+    logger.debug(f"Processing chunk {index + 1} (length: {len(chunk)})")
+    cache_key = get_audio_cache_key(chunk, lang, backend.cache_id)
+    if use_cache:
+        cached_audio = load_cached_audio(cache_key, backend.audio_format)
+        CACHE_REQUESTS.inc(cache="audio", result="hit" if cached_audio else "miss")
+        if cached_audio:
+            logger.debug(f"Chunk {index + 1} loaded from audio cache")
+            return cached_audio, True
+    
+    def request():
+        try:
+            audio_data = backend.synthesize(chunk, lang)
+        except Exception:
+            API_REQUESTS.inc(api=backend.name, outcome="error")
+            raise
+        API_REQUESTS.inc(api=backend.name, outcome="success")
+        return audio_data
+    
+    start_time = time.perf_counter()
+    if backend.retries_requests:
+        # The engine counts, retries and limits each of its requests itself
+        audio_data = backend.synthesize(chunk, lang, limiter=limiter)
+    else:
+        audio_data = call_with_retries(request, api=backend.name, limiter=limiter)
+    CHUNK_LATENCY.observe(time.perf_counter() - start_time, engine=backend.name)
+    SYNTHESIZED_BYTES.inc(len(audio_data), engine=backend.name)
+    
+    logger.debug(f"Chunk {index + 1} synthesized, size: {len(audio_data)} bytes")
+    if not audio_data:
+        raise Exception(f"{backend.name} returned no audio for chunk {index + 1}")
+    if use_cache:
+        save_cached_audio(cache_key, audio_data, backend.audio_format)
+    return audio_data, False
+
+def synthesize_chunks(text_chunks, lang, max_workers=1, progress_callback=None, use_cache=True, chunk_ready_callback=None, checkpoint=None, backend=None):
+    """Convert text chunks to speech on a bounded thread pool, returning audio data in chunk order
+
+    chunk_ready_callback receives (index, audio_data) for each chunk in document order,
+    as soon as that chunk and every chunk before it have finished. With a JobCheckpoint,
+    chunks finished by an earlier run are reused and new ones are recorded as they finish.
+    """
+    total_chunks = len(text_chunks)
+    audio_chunks = [None] * total_chunks
+    
+    resumed = checkpoint.load_completed() if checkpoint else {}
+    for index, audio_data in resumed.items():
+        audio_chunks[index] = audio_data
+    if resumed:
+        logger.info(f"Resuming job {checkpoint.job_id}: {len(resumed)} of {total_chunks} chunks already done")
+    
+    pending = [i for i in range(total_chunks) if audio_chunks[i] is None]
+    max_workers = max(1, min(max_workers, len(pending) or 1))
+    logger.info(f"Synthesizing {len(pending)} chunks with {max_workers} worker(s)")
+    # Workers wait for the limiter, which lowers concurrency while the engine is rate limiting us
+    limiter = AdaptiveLimiter(max_workers, name=f"{backend.name if backend else TTS_ENGINE} requests")
+    
+    completed = len(resumed)
+    cache_hits = 0
+    next_ready = 0
+    
+    def release_ready_chunks():
+        # Release the chunks that are now contiguous with everything already played
+        nonlocal next_ready
+        while chunk_ready_callback and next_ready < total_chunks and audio_chunks[next_ready] is not None:
+            chunk_ready_callback(next_ready, audio_chunks[next_ready])
+            next_ready += 1
+    
+    if progress_callback and resumed:
+        progress_callback(completed, total_chunks)
+    release_ready_chunks()
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(synthesize_chunk, text_chunks[i], lang, i, use_cache, backend, limiter): i
+            for i in pending
+        }
+        try:
+            # Report progress as chunks finish, in whatever order they complete
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    audio_chunks[index], from_cache = future.result()
+                except Exception as chunk_error:
+                    logger.error(f"Error processing chunk {index + 1}: {chunk_error}")
+                    raise
+                if checkpoint:
+                    checkpoint.record(index, audio_chunks[index])
+                completed += 1
+                cache_hits += from_cache
+                if progress_callback:
+                    progress_callback(completed, total_chunks)
+                release_ready_chunks()
+        except Exception:
+            # Don't synthesize the remaining chunks once one has failed
+            for future in futures:
+                future.cancel()
+            raise
+    
+    logger.info(f"Synthesized {len(pending) - cache_hits} chunks, reused {cache_hits} from the audio cache and {len(resumed)} from the checkpoint")
+    if use_cache and cache_hits < len(pending):
+        prune_audio_cache()
+    return audio_chunks
+
+def iter_synthesized_chunks(text_chunks, lang, max_workers=1, use_cache=True, backend=None):
+    """Synthesize chunks from any iterable on a thread pool, yielding their audio in chunk order
+
+    Only twice max_workers chunks are read ahead of the one being yielded, so memory stays
+    the same however long the input is. Identical chunks within that window share one request.
+    """
+    backend = backend or DEFAULT_BACKEND
+    max_workers = max(1, max_workers)
+    limiter = AdaptiveLimiter(max_workers, name=f"{backend.name} requests")
+    window = collections.deque()
+    in_window = {}  # Normalized text -> [future, number of window entries using it]
+    
+    def release_oldest():
+        key, future, index = window.popleft()
+        entry = in_window[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del in_window[key]
+        try:
+            return future.result()[0]
+        except Exception as chunk_error:
+            logger.error(f"Error processing chunk {index + 1}: {chunk_error}")
+            raise
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for index, chunk in enumerate(text_chunks):
+                key = normalize_segment(chunk)
+                if key in in_window:
+                    DEDUPLICATED_CHUNKS.inc()
+                else:
+                    in_window[key] = [executor.submit(synthesize_chunk, chunk, lang, index, use_cache, backend, limiter), 0]
+                in_window[key][1] += 1
+                window.append((key, in_window[key][0], index))
+                while len(window) > 2 * max_workers:
+                    yield release_oldest()
+            while window:
+                yield release_oldest()
+        finally:
+            # Stop early when a chunk failed or the caller stopped reading
+            for _, future, _ in window:
+                future.cancel()
+
+def write_temp_audio_files(audio_chunks):
+    """Write in-memory chunk audio to temporary MP3 files for FFmpeg"""
+    temp_files = []
+    try:
+        for i, audio_data in enumerate(audio_chunks):
+            with tempfile.NamedTemporaryFile(suffix=f"_part_{i}.mp3", delete=False) as temp_file:
+                temp_files.append(temp_file.name)
+                temp_file.write(audio_data)
+        return temp_files
+    except Exception:
+        remove_temp_files(temp_files)
+        raise
+
+def remove_temp_files(temp_files):
+    """Remove temporary files, returning False if any could not be deleted"""
+    cleanup_success = True
+    for temp_file in temp_files:
+        if os.path.exists(temp_file):
+            try:
+                os.remove(temp_file)
+                logger.debug(f"Removed temporary file: {temp_file}")
+            except Exception as cleanup_error:
+                logger.warning(f"Could not delete temporary file {temp_file}: {cleanup_error}")
+                cleanup_success = False
+    return cleanup_success
+
+def _render_inline(text):
+    """Strip inline Markdown and HTML from a block of text in one regex pass"""
+    pieces = []
+    position = 0
+    for match in INLINE_MARKUP_PATTERN.finditer(text):
+        pieces.append(html.unescape(text[position:match.start()]))
+        position = match.end()
+        kind = match.lastgroup
+        if kind == "code":
+            pieces.append(match.group("code_text").strip())
+        elif kind == "link":
+            pieces.append(_render_inline(match.group("link_text")))
+        elif kind == "autolink":
+            pieces.append(match.group("url"))
+        elif kind == "escape":
+            pieces.append(match.group("escaped"))
+        # Images, HTML tags, comments and emphasis markers have no spoken text
+    pieces.append(html.unescape(text[position:]))
+    return ''.join(pieces)
+
+def iter_speech_blocks(lines):
+    """Yield the speakable text of each Markdown block, reading the source one line at a time
+
+    Headings, paragraphs, list items, table rows and code blocks each become one block.
+    Markup is stripped roughly as Python-Markdown would render it, without building the
+    HTML or a parse tree. Unlike the text of the rendered HTML, fenced code blocks lose
+    their language tag and tables lose their |---| delimiter rows, since neither is speech.
+    """
+    paragraph = []
+    code = []
+    fence = None
+    in_comment = False
+    
+    for line in lines:
+        line = line.rstrip('\r\n')
+        
+        # Fenced code keeps its text verbatim until the matching closing fence
+        if fence:
+            if line.strip().startswith(fence) and not line.strip().strip(fence[0]):
+                fence = None
+                if code:
+                    yield '\n'.join(code)
+                    code = []
+            else:
+                code.append(line)
+            continue
+        
+        # Multi-line HTML comments are dropped entirely
+        if in_comment:
+            in_comment = '-->' not in line
+            continue
+        if line.lstrip().startswith('<!--') and '-->' not in line:
+            in_comment = True
+            continue
+        
+        line = BLOCKQUOTE_PATTERN.sub('', line)
+        
+        # Indented code continues until the first line that isn't indented
+        if code and (INDENTED_CODE_PATTERN.match(line) or not line.strip()):
+            code.append(line[4:] if line.startswith('    ') else line.lstrip('\t'))
+            continue
+        if code:
+            yield '\n'.join(code).rstrip()
+            code = []
+        
+        if not line.strip():
+            if paragraph:
+                yield _render_inline('\n'.join(paragraph))
+                paragraph = []
+            continue
+        
+        # Setext underlines turn the paragraph above them into a heading
+        if paragraph and SETEXT_UNDERLINE_PATTERN.match(line):
+            yield _render_inline('\n'.join(paragraph))
+            paragraph = []
+            continue
+        
+        if INDENTED_CODE_PATTERN.match(line) and not paragraph:
+            code.append(line[4:] if line.startswith('    ') else line[1:])
+            continue
+        
+        fence_match = FENCE_PATTERN.match(line)
+        heading_match = ATX_HEADING_PATTERN.match(line)
+        list_match = LIST_ITEM_PATTERN.match(line)
+        starts_block = fence_match or heading_match or list_match or HORIZONTAL_RULE_PATTERN.match(line) \
+            or TABLE_DELIMITER_PATTERN.match(line) or REFERENCE_DEFINITION_PATTERN.match(line)
+        if starts_block and paragraph:
+            yield _render_inline('\n'.join(paragraph))
+            paragraph = []
+        
+        if fence_match:
+            fence = fence_match.group(1)
+        elif heading_match:
+            yield _render_inline(heading_match.group(1) or '')
+        elif list_match:
+            paragraph.append(line[list_match.end():])
+        elif not starts_block:
+            paragraph.append(line.strip())
+    
+    if code:
+        yield '\n'.join(code).rstrip()
+    if paragraph:
+        yield _render_inline('\n'.join(paragraph))
+
+def extract_speech_text(md_file_content):
+    """Convert Markdown straight to plain text for speech, one blank line between blocks"""
+    return '\n\n'.join(block for block in iter_speech_blocks(io.StringIO(md_file_content)) if block.strip())
+
+def iter_speech_chunks(lines, chunk_size, signs_to_exclude, custom_rules=()):
+    """Yield the speakable chunks of Markdown read from an iterable of lines, one block at a time
+
+    The chunks are the ones extract_speech_text, clean_text and split_into_chunks produce,
+    except that repeated text isn't isolated, because finding repeats needs the whole text.
+    """
+    normalize = compile_text_rules(build_text_rules(signs_to_exclude, custom_rules))
+    segments = (
+        segment
+        for block in iter_speech_blocks(lines) if block.strip()
+        for segment in _iter_text_segments(normalize(block) + '\n\n', chunk_size)
+    )
+    for chunk in _pack_segments(segments, chunk_size):
+        chunk = chunk.strip()
+        if chunk and is_speakable(chunk):
+            yield chunk
+
+def extract_plain_text(md_file_content):
+    """Render Markdown to HTML and return its text content (the reference for extract_speech_text)"""
+    html_text = markdown.markdown(md_file_content)
+    soup = BeautifulSoup(html_text, "html.parser")
+    return ''.join(soup.find_all(string=True))
+
+def estimate_speech_cost(md_file_content, chunk_size, signs_to_exclude, custom_rules=(), backend=None, deduplicate=True):
+    """Predict the number of chunks, engine requests and repeated chunks a conversion will have
+
+    Repeated chunks reuse the audio of an identical earlier chunk and make no requests.
+    """
+    backend = backend or DEFAULT_BACKEND
+    cleaned_text = clean_text(extract_speech_text(md_file_content), signs_to_exclude, custom_rules)
+    text_chunks = [chunk for chunk in split_into_chunks(cleaned_text, chunk_size, deduplicate) if is_speakable(chunk)]
+    unique_chunks = deduplicate_chunks(text_chunks)[0] if deduplicate else text_chunks
+    return len(text_chunks), sum(backend.count_requests(chunk) for chunk in unique_chunks), len(text_chunks) - len(unique_chunks)
+
+def convert_markdown(md_file_content, output_file, lang, chunk_size, signs_to_exclude, max_workers=1, use_audio_cache=True, use_ffmpeg=False, progress_callback=None, chunk_ready_callback=None, message_callback=None, resume=True, custom_rules=(), backend=None, deduplicate=True, output_profile="original"):
+    """Convert markdown to an audio file, reporting progress through callbacks
+
+    The file is MP3 or WAV, depending on the backend's audio_format (gTTS by default).
+    Running the same conversion again after a failure only synthesizes the chunks that
+    are missing: they are reloaded from the audio cache, or, with the cache off and
+    resume enabled, from a checkpoint.
+    With deduplicate enabled, text repeated within the document is synthesized once
+    and its audio is reused wherever it appears. An output profile other than
+    "original" re-encodes the result with FFmpeg (see OUTPUT_PROFILES); the caller
+    picks the matching extension with get_output_extension.
+    Returns True if the output file was written.
+    """
+    logger.info(f"=== convert_markdown STARTED ===")
+    logger.info(f"Content length: {len(md_file_content)}")
+    logger.info(f"Output file: {output_file}")
+    logger.info(f"Language: {lang}")
+    logger.info(f"Chunk size: {chunk_size}")
+    logger.info(f"Parallel workers: {max_workers}")
+    logger.info(f"Audio cache: {use_audio_cache}")
+    logger.info(f"Concatenation: {'FFmpeg' if use_ffmpeg else 'built-in'}")
+    logger.info(f"Output profile: {output_profile}")
+    backend = backend or DEFAULT_BACKEND
+    logger.info(f"Speech engine: {backend.cache_id}")
+    
+    def report(status, progress):
+        if progress_callback:
+            progress_callback(status, progress)
+    
+    temp_files = []  # Initialize temp_files list outside try block
+    checkpoint = None
+    try:
+        # Extract the speakable text straight from the Markdown source
+        report("Extracting text from markdown...", 20)
+        logger.info("Step 1: Extracting plain text from markdown")
+        with STAGE_DURATION.time(stage="extract"):
+            plain_text = extract_speech_text(md_file_content)
+        logger.info(f"Plain text extraction complete. Text length: {len(plain_text)}")
+        
+        # Clean the extracted text
+        report("Cleaning text...", 30)
+        logger.info("Step 2: Cleaning text")
+        with STAGE_DURATION.time(stage="clean"):
+            cleaned_text = clean_text(plain_text, signs_to_exclude, custom_rules)
+        logger.info(f"Text cleaning complete. Cleaned text length: {len(cleaned_text)}")
+
+        # Split text into chunks at paragraph and sentence boundaries to handle gTTS limits
+        with STAGE_DURATION.time(stage="split"):
+            text_chunks = [chunk for chunk in split_into_chunks(cleaned_text, chunk_size, deduplicate) if is_speakable(chunk)]
+        total_chunks = len(text_chunks)
+        if total_chunks == 0:
+            raise Exception("No speakable text found in content")
+        
+        # Synthesize each distinct chunk once; chunk_map points every chunk at its audio
+        if deduplicate:
+            unique_chunks, chunk_map = deduplicate_chunks(text_chunks)
+        else:
+            unique_chunks, chunk_map = text_chunks, list(range(total_chunks))
+        repeated_chunks = total_chunks - len(unique_chunks)
+        DEDUPLICATED_CHUNKS.inc(repeated_chunks)
+        logger.info(f"Step 3: Text split into {total_chunks} chunks, {repeated_chunks} of them repeats")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"{sum(backend.count_requests(c) for c in unique_chunks)} {backend.name} requests expected")
+        if repeated_chunks:
+            notify(message_callback, "info", f"♻️ {repeated_chunks} of {total_chunks} chunks repeat earlier text and will reuse its audio")
+        
+        report(f"Processing {len(unique_chunks)} chunks...", 35)
+        
+        # Pick up where an earlier attempt at the same conversion stopped. Finished chunks
+        # are already in the audio cache, so only checkpoint them when it is off
+        if resume and not use_audio_cache:
+            prune_checkpoints()
+            checkpoint = JobCheckpoint(get_job_id(unique_chunks, lang, backend.cache_id), unique_chunks, backend.audio_format)
+        
+        # Convert chunks to speech on the worker pool, keeping the original chunk order
+        def update_chunk_progress(completed, total):
+            # Calculate progress (35% to 80% for chunk processing)
+            reused = f" ({repeated_chunks} repeated chunks reuse their audio)" if repeated_chunks else ""
+            report(f"Converted chunk {completed} of {total}{reused}...", 35 + int((completed / total) * 45))
+        
+        # Distinct chunks finish in order of first appearance, which releases every
+        # chunk of the document up to the next chunk that hasn't been heard yet
+        released_audio = []
+        next_document_chunk = 0
+        def release_document_chunks(unique_index, audio_data):
+            nonlocal next_document_chunk
+            released_audio.append(audio_data)
+            while next_document_chunk < total_chunks and chunk_map[next_document_chunk] <= unique_index:
+                chunk_ready_callback(next_document_chunk, released_audio[chunk_map[next_document_chunk]])
+                next_document_chunk += 1
+
+        with STAGE_DURATION.time(stage="synthesize"):
+            unique_audio = synthesize_chunks(unique_chunks, lang, max_workers, update_chunk_progress, use_audio_cache,
+                                             release_document_chunks if chunk_ready_callback else None, checkpoint, backend)
+        audio_chunks = [unique_audio[index] for index in chunk_map]
+        
+        # Combine all chunks into a single output file
+        report("Combining audio files...", 85)
+        with STAGE_DURATION.time(stage="combine"):
+            if output_profile != "original":
+                logger.info(f"Step 4: Encoding {len(audio_chunks)} chunks into {output_file} as {output_profile}")
+                success = transcode_audio_data(audio_chunks, output_file, output_profile, backend.audio_format, message_callback)
+            elif backend.audio_format == "wav":
+                logger.info(f"Step 4: Joining {len(audio_chunks)} WAV chunks into {output_file}")
+                success = combine_wav_data(audio_chunks, output_file, message_callback)
+            elif use_ffmpeg:
+                logger.info(f"Step 4: Combining {len(audio_chunks)} chunks into {output_file} with FFmpeg")
+                temp_files = write_temp_audio_files(audio_chunks)
+                success = combine_audio_chunks(temp_files, output_file, message_callback)
+            else:
+                logger.info(f"Step 4: Concatenating {len(audio_chunks)} chunks into {output_file}")
+                success = combine_audio_data(audio_chunks, output_file, message_callback)
+        logger.info(f"Audio combination result: {success}")
+        
+        # Clean up temporary files written for FFmpeg
+        cleanup_success = True
+        if temp_files:
+            report("Cleaning up temporary files...", 95)
+            logger.info("Step 5: Cleaning up temporary files")
+            cleanup_success = remove_temp_files(temp_files)
+            if success and not cleanup_success:
+                notify(message_callback, "warning", "Warning: Some temporary files could not be deleted")
+        
+        if not success:
+            if checkpoint or use_audio_cache:
+                notify(message_callback, "info", "💾 Synthesized audio was kept; converting again will resume without re-synthesizing it")
+            return False
+        
+        if checkpoint:
+            checkpoint.discard()
+        
+        # Complete
+        final_file_size = os.path.getsize(output_file) if os.path.exists(output_file) else 0
+        logger.info(f"=== CONVERSION COMPLETE ===")
+        logger.info(f"Output file: {output_file}")
+        logger.info(f"File size: {final_file_size} bytes")
+        logger.info(f"Cleanup successful: {cleanup_success}")
+        
+        if cleanup_success:
+            report(f"✅ Conversion complete! Audio saved as {os.path.basename(output_file)}", 100)
+        else:
+            report(f"✅ Conversion complete! Audio saved as {os.path.basename(output_file)} (some temporary files may remain)", 100)
+        return True
+        
+    except Exception as e:
+        # Ensure cleanup happens even if there's an error
+        logger.error(f"=== CONVERSION FAILED ===")
+        logger.error(f"Error: {str(e)}")
+        logger.error(f"Error type: {type(e).__name__}")
+        report(f"❌ Error during conversion: {str(e)}", 0)
+        if checkpoint or use_audio_cache:
+            notify(message_callback, "info", "💾 Finished chunks were saved; converting the same content again will resume from where this attempt stopped")
+        
+        # Clean up any temporary files that were created
+        if temp_files:
+            logger.info(f"Cleaning up {len(temp_files)} temporary files after error")
+            remove_temp_files(temp_files)
+        
+        return False
+
+def convert_markdown_stream(md_file, output_file, lang, chunk_size, signs_to_exclude, max_workers=1, use_audio_cache=True, progress_callback=None, chunk_ready_callback=None, message_callback=None, custom_rules=(), backend=None, output_profile="original"):
+    """Convert a Markdown file of any size to audio with memory that doesn't grow with the file
+
+    Every stage is a generator: lines are read from md_file, turned into speech blocks,
+    cleaned, packed into chunks and synthesized a window at a time, and the audio is
+    written to output_file in document order as it arrives. Repeated text is only shared
+    within the synthesis window and through the audio cache, and there are no checkpoints;
+    with the audio cache enabled, converting again after a failure reuses finished chunks.
+    Returns True if the output file was written.
+    """
+    backend = backend or DEFAULT_BACKEND
+    logger.info(f"=== convert_markdown_stream STARTED: {md_file} -> {output_file} ===")
+    logger.info(f"Speech engine: {backend.cache_id}, output profile: {output_profile}, parallel workers: {max_workers}")
+    
+    def report(status, progress):
+        if progress_callback:
+            progress_callback(status, progress)
+    
+    total_size = max(1, os.path.getsize(md_file))
+    position = 0
+    failure = {}
+    
+    def read_lines(f):
+        nonlocal position
+        for line in f:
+            position += len(line)
+            yield line
+    
+    def iter_audio(text_chunks):
+        try:
+            for index, audio_data in enumerate(iter_synthesized_chunks(text_chunks, lang, max_workers, use_audio_cache, backend)):
+                if chunk_ready_callback:
+                    chunk_ready_callback(index, audio_data)
+                read = min(position / total_size, 1)
+                report(f"Converted chunk {index + 1}, {read:.0%} of the document read...", 10 + int(read * 85))
+                yield audio_data
+        except Exception as e:
+            failure["error"] = e
+            raise
+    
+    def combine_message(level, message):
+        # A failed chunk stops the writer too; report the chunk's error instead of the writer's
+        if "error" not in failure and message_callback:
+            message_callback(level, message)
+    
+    try:
+        report("Reading markdown...", 5)
+        with open(md_file, 'r', encoding='utf-8') as f, STAGE_DURATION.time(stage="stream"):
+            text_chunks = iter_speech_chunks(read_lines(f), chunk_size, signs_to_exclude, custom_rules)
+            first_chunk = next(text_chunks, None)
+            if first_chunk is None:
+                raise Exception("No speakable text found in content")
+            audio_chunks = iter_audio(itertools.chain([first_chunk], text_chunks))
+            
+            if output_profile != "original":
+                success = transcode_audio_data(audio_chunks, output_file, output_profile, backend.audio_format, combine_message)
+            elif backend.audio_format == "wav":
+                success = combine_wav_data(audio_chunks, output_file, combine_message)
+            else:
+                success = combine_audio_data(audio_chunks, output_file, combine_message)
+        if "error" in failure:
+            raise failure["error"]
+        if not success:
+            report("❌ Error writing the audio file", 0)
+            return False
+        
+        if use_audio_cache:
+            prune_audio_cache()
+        logger.info(f"=== STREAMED CONVERSION COMPLETE: {output_file}, {os.path.getsize(output_file)} bytes ===")
+        report(f"✅ Conversion complete! Audio saved as {os.path.basename(output_file)}", 100)
+        return True
+    except Exception as e:
+        logger.error(f"=== STREAMED CONVERSION FAILED: {e} ===")
+        report(f"❌ Error during conversion: {str(e)}", 0)
+        if use_audio_cache and "error" in failure:
+            notify(message_callback, "info", "💾 Finished chunks are in the audio cache; converting the same file again only synthesizes the rest")
+        return False
+
+def find_markdown_headings(lines):
+    """Return (line index, level, title) for every ATX and setext heading outside code blocks"""
+    headings = []
+    fence = None
+    in_comment = False
+    paragraph_start = None
+    
+    for index, line in enumerate(lines):
+        line = line.rstrip('\r\n')
+        if fence:
+            if line.strip().startswith(fence) and not line.strip().strip(fence[0]):
+                fence = None
+            continue
+        if in_comment:
+            in_comment = '-->' not in line
+            continue
+        if line.lstrip().startswith('<!--') and '-->' not in line:
+            in_comment = True
+            continue
+        if not line.strip() or (paragraph_start is None and INDENTED_CODE_PATTERN.match(line)):
+            paragraph_start = None
+            continue
+        
+        fence_match = FENCE_PATTERN.match(line)
+        heading_match = ATX_HEADING_PATTERN.match(line)
+        if fence_match:
+            fence = fence_match.group(1)
+        elif heading_match:
+            level = len(line.lstrip()) - len(line.lstrip().lstrip('#'))
+            headings.append((index, level, _render_inline(heading_match.group(1) or '').strip()))
+        elif paragraph_start is not None and SETEXT_UNDERLINE_PATTERN.match(line):
+            # The underline turns the whole paragraph above it into the heading
+            title = _render_inline(' '.join(text.strip() for text in lines[paragraph_start:index])).strip()
+            headings.append((paragraph_start, 1 if line.strip().startswith('=') else 2, title))
+        elif paragraph_start is None and not (LIST_ITEM_PATTERN.match(line) or HORIZONTAL_RULE_PATTERN.match(line)):
+            paragraph_start = index
+            continue
+        else:
+            continue
+        paragraph_start = None
+    return headings
+
+def split_markdown_sections(md_file_content):
+    """Split Markdown at its top-level headings into a list of (title, markdown) pairs
+
+    The top level is the highest heading level used more than once, so a document with a
+    single title above its chapters is split at the chapters. Text before the first of
+    these headings becomes a section of its own, titled after its first heading if it has one.
+    Headings without a title, such as a stray "#", never start a section.
+    """
+    lines = md_file_content.splitlines(keepends=True)
+    headings = [heading for heading in find_markdown_headings(lines) if heading[2]]
+    if not headings:
+        return [(SECTION_DEFAULT_TITLE, md_file_content)]
+    levels = [level for _, level, _ in headings]
+    top_level = min((level for level in levels if levels.count(level) > 1), default=min(levels))
+    starts = [(index, title) for index, level, title in headings if level == top_level]
+    
+    sections = []
+    if starts[0][0] > 0:
+        preamble_title = next((title for index, _, title in headings if index < starts[0][0]), SECTION_DEFAULT_TITLE)
+        sections.append((preamble_title, ''.join(lines[:starts[0][0]])))
+    for (start, title), (end, _) in zip(starts, starts[1:] + [(len(lines), None)]):
+        sections.append((title, ''.join(lines[start:end])))
+    return sections
+
+def get_audio_duration(path):
+    """Length of an MP3, WAV or Ogg Opus file in seconds, counted from its frames, or None for other formats"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    extension = os.path.splitext(path)[1]
+    if extension == ".mp3":
+        return sum(frame["samples"] / frame["sample_rate"] for _, _, frame in iter_mp3_frames(data))
+    if extension == ".wav":
+        (channels, sample_width, frame_rate), frames = read_wav(data)
+        return len(frames) / (channels * sample_width * frame_rate)
+    if extension == ".ogg":
+        # The last page's granule position counts 48 kHz samples, including the pre-skip from the Opus header
+        last_page = data.rfind(b"OggS")
+        opus_head = data.find(b"OpusHead")
+        if last_page != -1 and opus_head != -1:
+            granule = int.from_bytes(data[last_page + 6:last_page + 14], "little")
+            pre_skip = int.from_bytes(data[opus_head + 10:opus_head + 12], "little")
+            return max(0, granule - pre_skip) / 48000
+    return None
+
+def format_timestamp(seconds):
+    """Format seconds as HH:MM:SS.mmm, the notation chapter lists use"""
+    milliseconds = round(seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    return f"{hours:02d}:{minutes:02d}:{milliseconds // 1000:02d}.{milliseconds % 1000:03d}"
+
+def get_section_paths(playlist_file):
+    """Return the manifest and chapter list paths that belong to a sectioned conversion's playlist"""
+    base = os.path.splitext(playlist_file)[0]
+    return base + SECTION_MANIFEST_SUFFIX, base + SECTION_CHAPTERS_SUFFIX
+
+def load_section_manifest(manifest_file):
+    """Read a sections manifest, returning None if it is missing, unreadable or from another version"""
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if isinstance(manifest, dict) and manifest.get("version") == SECTION_MANIFEST_VERSION else None
+
+def _write_text_file(path, text):
+    """Write a small text file in full or not at all"""
+    with open(f"{path}.part", 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(f"{path}.part", path)
+
+def write_section_playlist(playlist_file, sections):
+    """Write the extended M3U playlist and, when every duration is known, the chapter list"""
+    lines = ["#EXTM3U"]
+    for section in sections:
+        duration = round(section["duration"]) if section["duration"] is not None else -1
+        lines.append(f"#EXTINF:{duration},{section['title']}")
+        lines.append(section["file"])
+    _write_text_file(playlist_file, "\n".join(lines) + "\n")
+    
+    # Chapter start times assume the tracks are played back to back, as the playlist does
+    chapters_file = get_section_paths(playlist_file)[1]
+    if all(section["duration"] is not None for section in sections):
+        start = 0.0
+        chapters = []
+        for section in sections:
+            chapters.append(f"{format_timestamp(start)} {section['title']}")
+            start += section["duration"]
+        _write_text_file(chapters_file, "\n".join(chapters) + "\n")
+    elif os.path.exists(chapters_file):
+        os.remove(chapters_file)
+
+def convert_markdown_sections(md_file_content, playlist_file, lang, chunk_size, signs_to_exclude, max_workers=1, progress_callback=None, message_callback=None, backend=None, output_profile="original", **options):
+    """Convert each top-level section of a document to its own track, listed in an M3U playlist
+
+    Tracks are written next to playlist_file as <name>-NN-<title>, together with a chapter
+    list and a manifest of the sections. A section whose Markdown and settings match the
+    manifest keeps its track, so editing one section re-renders only that section. The
+    other sections are rendered in parallel, sharing max_workers between them. Remaining
+    options are passed on to convert_markdown.
+    Returns True if every section has a track.
+    """
+    backend = backend or DEFAULT_BACKEND
+    output_dir = os.path.dirname(playlist_file)
+    name = os.path.splitext(os.path.basename(playlist_file))[0]
+    extension = get_output_extension(backend.audio_format, output_profile)
+    manifest_file = get_section_paths(playlist_file)[0]
+    logger.info(f"=== convert_markdown_sections STARTED: {playlist_file} ===")
+    
+    def report(status, progress):
+        if progress_callback:
+            progress_callback(status, progress)
+    
+    report("Splitting document into sections...", 5)
+    sections = [(title, text) for title, text in split_markdown_sections(md_file_content) if is_speakable(extract_speech_text(text))]
+    if not sections:
+        notify(message_callback, "error", "No speakable text found in content")
+        report("❌ No speakable text found in content", 0)
+        return False
+    
+    # Tracks can be reused only if they were rendered with the same settings
+    settings_hash = get_content_hash(json.dumps([
+        lang, chunk_size, sorted(signs_to_exclude), list(options.get("custom_rules", ())),
+        backend.cache_id, output_profile, options.get("deduplicate", True),
+    ]))
+    previous = load_section_manifest(manifest_file) or {"sections": []}
+    reusable = {}
+    if previous.get("settings") == settings_hash:
+        for entry in previous["sections"]:
+            if os.path.exists(os.path.join(output_dir, os.path.basename(entry["file"]))):
+                reusable.setdefault(entry["hash"], entry)
+    
+    entries = []
+    reused = {}
+    for number, (title, text) in enumerate(sections, start=1):
+        slug = SECTION_SLUG_PATTERN.sub('-', title.lower()).strip('-_')[:40].rstrip('-_') or "section"
+        entry = {"title": title, "hash": get_content_hash(text), "file": f"{name}-{number:02d}-{slug}.{extension}", "duration": None}
+        old_entry = reusable.pop(entry["hash"], None)
+        if old_entry:
+            entry["duration"] = old_entry["duration"]
+            reused[number - 1] = os.path.basename(old_entry["file"])
+        entries.append(entry)
+    
+    # Delete tracks of removed or edited sections, then move kept tracks to their new numbers.
+    # Renaming in two steps keeps one kept track from overwriting another when sections swap places.
+    for entry in previous["sections"]:
+        old_file = os.path.basename(entry["file"])
+        if old_file not in reused.values() and os.path.exists(os.path.join(output_dir, old_file)):
+            os.remove(os.path.join(output_dir, old_file))
+    moved = {index: old_file for index, old_file in reused.items() if old_file != entries[index]["file"]}
+    for index, old_file in moved.items():
+        os.replace(os.path.join(output_dir, old_file), os.path.join(output_dir, f"{old_file}.moving"))
+    for index, old_file in moved.items():
+        os.replace(os.path.join(output_dir, f"{old_file}.moving"), os.path.join(output_dir, entries[index]["file"]))
+    
+    to_build = [index for index in range(len(entries)) if index not in reused]
+    SECTIONS.inc(len(reused), result="reused")
+    logger.info(f"{len(entries)} sections, {len(reused)} unchanged, {len(to_build)} to render")
+    if reused:
+        notify(message_callback, "info", f"♻️ {len(reused)} of {len(entries)} sections are unchanged and keep their tracks")
+    
+    # Each section gets an equal share of the workers, so the engine sees about max_workers requests at once
+    section_workers = max(1, min(len(to_build), max_workers))
+    workers_per_section = max(1, max_workers // section_workers)
+    progress = dict.fromkeys(to_build, 0)
+    progress_lock = threading.Lock()
+    errors = {}
+    
+    def render_section(index):
+        title = entries[index]["title"]
+        output_file = os.path.join(output_dir, entries[index]["file"])
+        
+        def section_progress(status, value):
+            if status.startswith("❌"):
+                errors[index] = status.lstrip("❌ ")
+            with progress_lock:
+                progress[index] = value
+                overall = 10 + int(85 * sum(progress.values()) / (100 * len(progress)))
+            report(f"{title}: {status}", overall)
+        
+        def section_message(level, message):
+            if message_callback:
+                message_callback(level, f"{title}: {message}")
+        
+        success = convert_markdown(sections[index][1], output_file, lang, chunk_size, signs_to_exclude, max_workers=workers_per_section,
+                                   progress_callback=section_progress, message_callback=section_message, backend=backend,
+                                   output_profile=output_profile, **options)
+        if success:
+            entries[index]["duration"] = get_audio_duration(output_file)
+        elif index in errors:
+            section_message("error", errors[index])
+        return success
+    
+    with ThreadPoolExecutor(max_workers=section_workers, thread_name_prefix="section") as executor:
+        results = dict(zip(to_build, executor.map(render_section, to_build)))
+    failed = [entries[index]["title"] for index, success in results.items() if not success]
+    SECTIONS.inc(len(to_build) - len(failed), result="built")
+    SECTIONS.inc(len(failed), result="failed")
+    
+    # Record finished sections even after a failure, so the next run only renders the rest
+    finished = [entry for index, entry in enumerate(entries) if results.get(index, True)]
+    _write_text_file(manifest_file, json.dumps({"version": SECTION_MANIFEST_VERSION, "settings": settings_hash, "sections": finished}, indent=2))
+    if failed:
+        notify(message_callback, "error", f"{len(failed)} of {len(entries)} sections failed: {', '.join(failed)}. Converting again renders only those")
+        report(f"❌ {len(failed)} of {len(entries)} sections failed", 0)
+        return False
+    
+    write_section_playlist(playlist_file, entries)
+    total_duration = sum(entry["duration"] or 0 for entry in entries)
+    logger.info(f"=== SECTIONED CONVERSION COMPLETE: {len(entries)} tracks, {total_duration:.0f}s ===")
+    report(f"✅ Conversion complete! {len(entries)} section tracks listed in {os.path.basename(playlist_file)}", 100)
+    return True
@@ -0,0 +1,141 @@
+"""Background conversion jobs shared by every session of the Streamlit app
+
+Jobs run on a thread pool owned by a JobRegistry, so a conversion keeps going when the
+browser tab is closed or refreshed, and any session that knows a job's ID can follow it.
+Each job writes its audio to its own directory, outputs/<job_id>/, which is removed
+together with the job.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from tts_core import convert_markdown, convert_markdown_sections, convert_markdown_stream
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_JOBS = int(os.environ.get("TTS_MAX_JOBS", "2"))  # Conversions running at once, across all users
+JOB_TTL = 60 * 60  # Keep finished jobs for an hour so their results can be reopened
+OUTPUT_ROOT = os.path.join(os.path.dirname(__file__), 'outputs')
+
+class ConversionJob:
+    """State of one conversion, written by its worker thread and read by polling sessions"""
+
+    def __init__(self, job_id, filename, output_file, stream_id=None):
+        self.job_id = job_id
+        self.filename = filename
+        self.output_file = output_file
+        self.stream_id = stream_id
+        self.status = "queued"
+        self.progress = 0
+        self.status_text = "Waiting for a free worker..."
+        self.messages = []
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def is_finished(self):
+        return self.status in ("done", "failed")
+
+    def update_progress(self, status_text, progress):
+        self.status_text = status_text
+        self.progress = progress
+
+    def add_message(self, level, message):
+        self.messages.append((level, message))
+
+class JobRegistry:
+    """Runs conversions on a shared thread pool and keeps their state by job ID"""
+
+    def __init__(self, max_workers=MAX_CONCURRENT_JOBS, output_root=OUTPUT_ROOT):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="conversion")
+        self.output_root = output_root
+        self.jobs = {}
+        self.lock = threading.Lock()
+        with self.lock:
+            self.prune()
+
+    def submit(self, md_file_content, output_name, lang, chunk_size, signs_to_exclude, filename=None, stream_id=None, on_finish=None, **options):
+        """Queue a conversion writing outputs/<job_id>/<output_name> and return its job
+
+        Options are passed on to convert_markdown. With sections=True, output_name is an
+        .m3u playlist and each section's track is written next to it by convert_markdown_sections.
+        With stream=True, md_file_content is the path of a Markdown file instead, which
+        convert_markdown_stream reads a block at a time.
+        """
+        job_id = uuid.uuid4().hex
+        output_file = os.path.join(self.output_root, job_id, output_name)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        job = ConversionJob(job_id, filename or output_name, output_file, stream_id)
+        with self.lock:
+            self.prune()
+            self.jobs[job.job_id] = job
+        self.executor.submit(self.run, job, md_file_content, output_file, lang, chunk_size, signs_to_exclude, on_finish, options)
+        logger.info(f"Queued conversion job {job.job_id} for {job.filename}")
+        return job
+
+    def run(self, job, md_file_content, output_file, lang, chunk_size, signs_to_exclude, on_finish, options):
+        job.status = "running"
+        logger.info(f"Starting conversion job {job.job_id}")
+        if options.pop("stream", False):
+            convert = convert_markdown_stream
+        elif options.pop("sections", False):
+            convert = convert_markdown_sections
+        else:
+            convert = convert_markdown
+        try:
+            success = convert(
+                md_file_content,
+                output_file,
+                lang,
+                chunk_size,
+                signs_to_exclude,
+                progress_callback=job.update_progress,
+                message_callback=job.add_message,
+                **options
+            )
+            job.status = "done" if success else "failed"
+        except Exception as e:
+            logger.error(f"Conversion job {job.job_id} failed: {str(e)}", exc_info=True)
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+            if on_finish:
+                on_finish()
+        logger.info(f"Conversion job {job.job_id} finished with status {job.status} in {job.finished - job.created:.1f}s")
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def active_jobs(self):
+        """Jobs that are queued or running, oldest first"""
+        with self.lock:
+            return [job for job in self.jobs.values() if not job.is_finished]
+
+    def prune(self):
+        """Forget finished jobs older than JOB_TTL and delete their outputs; the caller must hold the lock
+
+        Output directories of jobs this registry doesn't know, left over from an earlier
+        server process, are deleted once they are older than JOB_TTL as well.
+        """
+        expired = [job_id for job_id, job in self.jobs.items() if job.is_finished and time.time() - job.finished > JOB_TTL]
+        for job_id in expired:
+            del self.jobs[job_id]
+        
+        if not os.path.isdir(self.output_root):
+            return
+        for job_id in os.listdir(self.output_root):
+            job_dir = os.path.join(self.output_root, job_id)
+            if job_id in self.jobs:
+                continue
+            try:
+                if job_id in expired or time.time() - os.path.getmtime(job_dir) > JOB_TTL:
+                    shutil.rmtree(job_dir)
+            except OSError as e:
+                logger.warning(f"Could not remove output directory {job_dir}: {str(e)}")
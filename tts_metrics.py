@@ -0,0 +1,219 @@
+"""Counters, histograms and derived gauges for the conversion pipeline, exported as Prometheus text or JSON
+
+The pipeline records stage durations, chunk latency, bytes synthesized, cache hits and
+misses and API requests and retries into the module-level REGISTRY. The Streamlit app
+serves it at /metrics on the audio stream server, and the CLI can write it to a file
+with --metrics-out. Snapshots from other processes can be merged into a registry, which
+is how the CLI adds up the metrics of its worker processes.
+"""
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram buckets in seconds, from a fast stage on a small document to a slow API call
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+class Counter:
+    """A value that only goes up, kept separately for each combination of label values"""
+    type = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [{"labels": dict(zip(self.label_names, key)), "value": value} for key, value in sorted(self.values.items())]
+
+    def merge(self, samples):
+        for sample in samples:
+            self.inc(sample["value"], **sample["labels"])
+
+    def reset(self):
+        with self.lock:
+            self.values.clear()
+
+    def prometheus_lines(self):
+        return [f"{self.name}{_format_labels(sample['labels'])} {_format_value(sample['value'])}" for sample in self.samples()]
+
+class Gauge:
+    """A value derived from other metrics when it is exported, such as a ratio of two counters
+
+    compute returns a list of (labels, value) pairs. Gauges have no state of their own,
+    so merging and resetting leave them alone.
+    """
+    type = "gauge"
+
+    def __init__(self, name, help_text, compute):
+        self.name = name
+        self.help_text = help_text
+        self.compute = compute
+
+    def samples(self):
+        return [{"labels": labels, "value": value} for labels, value in self.compute()]
+
+    def merge(self, samples):
+        pass
+
+    def reset(self):
+        pass
+
+    def prometheus_lines(self):
+        return [f"{self.name}{_format_labels(sample['labels'])} {_format_value(sample['value'])}" for sample in self.samples()]
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, with their count and sum"""
+    type = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how many seconds the with block takes, including when it raises"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def samples(self):
+        with self.lock:
+            return [
+                {
+                    "labels": dict(zip(self.label_names, key)),
+                    "count": counts[-1],
+                    "sum": total,
+                    "buckets": {_format_value(bound): count for bound, count in zip(self.buckets, counts)},
+                }
+                for key, (counts, total) in sorted(self.values.items())
+            ]
+
+    def merge(self, samples):
+        for sample in samples:
+            key = tuple(str(sample["labels"][name]) for name in self.label_names)
+            with self.lock:
+                counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+                for i, bound in enumerate(self.buckets):
+                    counts[i] += sample["buckets"].get(_format_value(bound), 0)
+                self.values[key] = (counts, total + sample["sum"])
+
+    def reset(self):
+        with self.lock:
+            self.values.clear()
+
+    def prometheus_lines(self):
+        lines = []
+        for sample in self.samples():
+            for bound, count in sample["buckets"].items():
+                lines.append(f"{self.name}_bucket{_format_labels({**sample['labels'], 'le': bound})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(sample['labels'])} {_format_value(sample['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(sample['labels'])} {sample['count']}")
+        return lines
+
+class MetricsRegistry:
+    """A named set of metrics that can be exported, merged and reset together"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def counter(self, name, help_text, label_names=()):
+        return self.metrics.setdefault(name, Counter(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DURATION_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(name, help_text, label_names, buckets))
+
+    def gauge(self, name, help_text, compute):
+        return self.metrics.setdefault(name, Gauge(name, help_text, compute))
+
+    def snapshot(self):
+        """All metrics as a JSON-serializable dict"""
+        return {
+            name: {"type": metric.type, "help": metric.help_text, "samples": metric.samples()}
+            for name, metric in self.metrics.items()
+        }
+
+    def merge(self, snapshot):
+        """Add the samples of a snapshot taken from another registry, usually in another process"""
+        for name, data in snapshot.items():
+            if name in self.metrics:
+                self.metrics[name].merge(data["samples"])
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.reset()
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(metric.prometheus_lines())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+STAGE_DURATION = REGISTRY.histogram("tts_stage_duration_seconds", "Time spent in each pipeline stage", ("stage",))
+CHUNK_LATENCY = REGISTRY.histogram("tts_chunk_latency_seconds", "Time to synthesize one chunk that was not cached", ("engine",))
+SYNTHESIZED_BYTES = REGISTRY.counter("tts_synthesized_bytes_total", "Bytes of audio returned by speech engines", ("engine",))
+CACHE_REQUESTS = REGISTRY.counter("tts_cache_requests_total", "Cache lookups by cache and result (hit or miss)", ("cache", "result"))
+API_REQUESTS = REGISTRY.counter("tts_api_requests_total", "Calls to speech engines and the OpenAI API by outcome", ("api", "outcome"))
+API_RETRIES = REGISTRY.counter("tts_api_retries_total", "Calls to speech engines and the OpenAI API that were retried", ("api",))
+OPENAI_TOKENS = REGISTRY.counter("tts_openai_tokens_total", "Tokens sent to (prompt) and received from (completion) GPT-4o", ("kind",))
+DEDUPLICATED_CHUNKS = REGISTRY.counter("tts_deduplicated_chunks_total", "Chunks that reused the audio of identical text earlier in the same document")
+SECTIONS = REGISTRY.counter("tts_sections_total", "Sections of sectioned conversions by result (built, reused or failed)", ("result",))
+HTTP_REQUESTS = REGISTRY.counter("tts_http_requests_total", "HTTP requests sent through pooled sessions", ("api",))
+HTTP_CONNECTIONS = REGISTRY.counter("tts_http_connections_total", "HTTP connections opened by pooled sessions", ("api",))
+
+def _connection_reuse():
+    connections = {tuple(sample["labels"].items()): sample["value"] for sample in HTTP_CONNECTIONS.samples()}
+    return [
+        (sample["labels"], max(0.0, 1 - connections.get(tuple(sample["labels"].items()), 0) / sample["value"]))
+        for sample in HTTP_REQUESTS.samples() if sample["value"]
+    ]
+
+CONNECTION_REUSE = REGISTRY.gauge("tts_http_connection_reuse_ratio", "Share of HTTP requests sent over an already open connection", _connection_reuse)
+
+def write_metrics(path, registry=REGISTRY):
+    """Write the metrics to path, as JSON if it ends in .json and as Prometheus text otherwise"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(registry.to_json() if path.endswith('.json') else registry.to_prometheus())
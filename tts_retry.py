@@ -0,0 +1,134 @@
+"""Retries with jittered backoff and adaptive concurrency for speech and OpenAI requests
+
+Failed requests are classified by what went wrong. Rate limiting (HTTP 429), server
+errors (5xx), timeouts and dropped connections are retried after an exponentially
+growing, randomized delay, or after the delay the server asked for in Retry-After.
+Anything else, such as a bad API key, fails immediately.
+
+An AdaptiveLimiter caps how many requests are in flight. It works like TCP congestion
+control (AIMD): each success raises the limit slowly, and each rate-limit response
+halves it. Throughput therefore settles just below the provider's limit instead of
+failing jobs.
+"""
+import logging
+import os
+import random
+import socket
+import subprocess
+import threading
+import time
+
+from tts_metrics import API_RETRIES
+
+logger = logging.getLogger(__name__)
+
+RETRY_ATTEMPTS = int(os.environ.get("TTS_MAX_RETRIES", "5"))  # Retries per request after the first attempt
+RETRY_BASE_DELAY = 1.0  # Seconds; the nth retry waits a random time up to RETRY_BASE_DELAY * 2**n
+RETRY_MAX_DELAY = 60.0
+RETRY_AFTER_MAX = 120.0  # Longest Retry-After we honor, in seconds
+
+def _response_of(error):
+    # gTTSError keeps the HTTP response in rsp, requests and OpenAI errors in response.
+    # A requests.Response for an error status is falsy, so compare with None.
+    response = getattr(error, "rsp", None)
+    return response if response is not None else getattr(error, "response", None)
+
+def get_status_code(error):
+    """HTTP status code of the response that caused an error, if there was one"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(_response_of(error), "status_code", None)
+    return status if isinstance(status, int) else None
+
+def classify_error(error):
+    """Return "rate_limit", "server", "timeout" or "connection" for transient errors, None otherwise"""
+    status = get_status_code(error)
+    if status == 429:
+        return "rate_limit"
+    if status is not None and status >= 500:
+        return "server"
+    if status is not None:
+        return None
+
+    name = type(error).__name__
+    if isinstance(error, (TimeoutError, socket.timeout, subprocess.TimeoutExpired)) or "Timeout" in name:
+        return "timeout"
+    if isinstance(error, ConnectionError) or "ConnectionError" in name:
+        return "connection"
+    # gTTS reports a request that never got a response as a gTTSError without one
+    if name == "gTTSError" and getattr(error, "rsp", None) is None and str(error).startswith("Failed to connect"):
+        return "connection"
+    return None
+
+def get_retry_after(error):
+    """Seconds the server asked us to wait in a Retry-After header, or None"""
+    headers = getattr(_response_of(error), "headers", None) or {}
+    try:
+        seconds = float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+    return min(max(seconds, 0.0), RETRY_AFTER_MAX)
+
+def backoff_delay(retry, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """Full-jitter exponential backoff: a random delay up to base_delay * 2**retry"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** retry))
+
+class AdaptiveLimiter:
+    """Limits requests in flight, growing the limit additively and halving it when throttled"""
+
+    def __init__(self, max_limit, min_limit=1, name="requests"):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.name = name
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Wait for a free slot and return the time the request started"""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                # Requests sent before the last decrease were throttled by the old limit
+                if started >= self.last_decrease:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self.last_decrease = time.monotonic()
+                    logger.warning(f"Rate limited, reducing concurrent {self.name} to {int(self.limit)}")
+            elif self.limit < self.max_limit:
+                # Additive increase: about one more slot for every limit's worth of successes
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+def call_with_retries(function, *args, api="api", limiter=None, max_retries=RETRY_ATTEMPTS, **kwargs):
+    """Call function, retrying transient errors with backoff; the last error is raised when retries run out"""
+    retry = 0
+    while True:
+        started = limiter.acquire() if limiter else None
+        throttled = False
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            kind = classify_error(e)
+            throttled = kind == "rate_limit"
+            if kind is None or retry >= max_retries:
+                raise
+            error = e
+        finally:
+            if limiter:
+                limiter.release(started, throttled)
+
+        delay = get_retry_after(error)
+        if delay is None:
+            delay = backoff_delay(retry, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+        retry += 1
+        API_RETRIES.inc(api=api)
+        logger.warning(f"{api} request failed ({classify_error(error)}: {error}), retry {retry} of {max_retries} in {delay:.1f}s")
+        time.sleep(delay)
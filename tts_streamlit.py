@@ -1,59 +1,76 @@
 import streamlit as st
-import markdown
-from gtts import gTTS
+import streamlit.components.v1 as components
 import os
-import tempfile
-import subprocess
-import shutil
-from bs4 import BeautifulSoup
+import re
 import time
 import json
+import threading
+import uuid
 import base64
 import socket
 import hashlib
+import html
 import logging
+import shutil
+import tempfile
+from urllib.parse import quote, unquote, urlsplit, parse_qs
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from cryptography.fernet import Fernet
 
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Set up logging; TTS_DEBUG_LOGGING=1 adds per-chunk and per-rerun details
+DEBUG_LOGGING = os.environ.get("TTS_DEBUG_LOGGING", "") not in ("", "0")
+logging.basicConfig(level=logging.DEBUG if DEBUG_LOGGING else logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-try:
-    import openai
-    OPENAI_AVAILABLE = True
-    logger.info("OpenAI library loaded successfully")
-except ImportError:
-    OPENAI_AVAILABLE = False
-    logger.warning("OpenAI library not available")
+from tts_core import (
+    LANGUAGES,
+    SIGNS,
+    AUDIO_CACHE_MAX_BYTES,
+    OPTIMIZATION_CACHE_MAX_BYTES,
+    OPENAI_AVAILABLE,
+    OUTPUT_PROFILES,
+    TEXT_RULE_SEPARATOR,
+    get_cache_stats,
+    get_optimization_cache_path,
+    clear_optimization_cache,
+    get_audio_cache_stats,
+    get_audio_cache_dir,
+    clear_audio_cache,
+    optimize_for_speech,
+    estimate_speech_cost,
+    format_timestamp,
+    get_output_extension,
+    get_section_paths,
+    load_section_manifest,
+    parse_text_rules,
+    strip_mp3_metadata,
+)
+from tts_backends import BACKENDS, available_backends, get_backend
+from tts_jobs import OUTPUT_ROOT, JobRegistry
+from tts_metrics import REGISTRY
+
+# Progressive playback stream server
+AUDIO_STREAM_HOST = os.environ.get("TTS_STREAM_HOST", "0.0.0.0")
+AUDIO_STREAM_PORT = int(os.environ.get("TTS_STREAM_PORT", "8502"))
+AUDIO_STREAM_TTL = 60 * 60  # Keep finished streams replayable for an hour
+AUDIO_STREAM_IDLE_TIMEOUT = 5 * 60  # Give up on a stream that stops growing
+
+# Content types of the audio formats the speech engines produce
+AUDIO_MIME_TYPES = {".mp3": "audio/mpeg", ".wav": "audio/wav", ".ogg": "audio/ogg"}
 
-# Supported languages
-LANGUAGES = {
-    "English": "en",
-    "German": "de",
-    "French": "fr",
-    "Spanish": "es",
-    "Italian": "it",
-    "Portuguese": "pt",
-    "Dutch": "nl",
-    "Russian": "ru",
-    "Chinese (Simplified)": "zh-cn",
-    "Japanese": "ja",
-    "Korean": "ko"
-}
+# Seconds between progress updates of a running background conversion
+JOB_POLL_INTERVAL = 1
 
-# Signs to exclude
-SIGNS = {
-    "Pipes (|)": "|",
-    "Hyphens (-)": "-",
-    "Equals (=)": "=",
-    "Double Underscores (__)": "__",
-    "Backticks (`)": "`",
-    "Asterisks (*)": "*",
-    "Hashes (#)": "#",
-    "Exclamation Marks (!)": "!",
-    "Square Brackets ([])": "[]",
-    "Parentheses (())": "()",
-}
+# Uploads larger than this are copied to disk and converted in streaming mode instead of being loaded into the editor
+STREAM_UPLOAD_BYTES = int(os.environ.get("TTS_STREAM_UPLOAD_MB", "5")) * 1024 * 1024
+UPLOAD_SPOOL_DIR = os.path.join(tempfile.gettempdir(), "markdown_to_speech_uploads")
+UPLOAD_SPOOL_MAX_AGE = 24 * 60 * 60
+
+# Rerun profiling, also available per page with ?profile=1
+PROFILE_RERUNS = os.environ.get("TTS_PROFILE_RERUNS", "") not in ("", "0")
+PROFILE_HISTORY = 20  # Number of reruns averaged in the profile
 
 # API Key storage functions
 def get_key_file_path():
@@ -82,24 +99,31 @@ def save_api_key(api_key):
         st.error(f"Error saving API key: {str(e)}")
         return False
 
+def file_signature(path):
+    """Return (mtime_ns, size) of a path, or None if it doesn't exist, for keying caches on file changes"""
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+@lru_cache(maxsize=4)
+def decrypt_api_key(key_file, signature, encryption_key):
+    """Decrypt the stored API key; signature is part of the cache key so a changed file is read again"""
+    with open(key_file, 'rb') as f:
+        encrypted_key = f.read()
+    return Fernet(encryption_key).decrypt(encrypted_key).decode()
+
 def load_api_key():
     """Load and decrypt the API key from the local file"""
+    key_file = get_key_file_path()
+    signature = file_signature(key_file)
+    if signature is None:
+        return None
     try:
-        key_file = get_key_file_path()
-        if not os.path.exists(key_file):
-            return None
-        
-        encryption_key = get_or_create_encryption_key()
-        fernet = Fernet(encryption_key)
-        
-        with open(key_file, 'rb') as f:
-            encrypted_key = f.read()
-        
-        decrypted_key = fernet.decrypt(encrypted_key).decode()
-        return decrypted_key
+        return decrypt_api_key(key_file, signature, get_or_create_encryption_key())
     except Exception as e:
         # If decryption fails, remove the corrupted file
-        key_file = get_key_file_path()
         if os.path.exists(key_file):
             try:
                 os.remove(key_file)
@@ -118,456 +142,409 @@ def delete_stored_api_key():
         st.error(f"Error deleting stored API key: {str(e)}")
         return False
 
-# Cache functions for optimized content
-def get_cache_dir():
-    """Get or create the cache directory for optimized content"""
-    cache_dir = os.path.join(os.path.dirname(__file__), '.optimization_cache')
-    if not os.path.exists(cache_dir):
-        os.makedirs(cache_dir)
-    return cache_dir
+def show_message(level, message):
+    """Display a message from tts_core in the Streamlit page"""
+    {"info": st.info, "success": st.success, "warning": st.warning, "error": st.error}[level](message)
 
-def get_content_hash(content):
-    """Generate a hash for the markdown content"""
-    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+@lru_cache(maxsize=1)
+def _optimization_cache_stats(database_signature, wal_signature):
+    return get_cache_stats()
 
-def save_optimized_content(content_hash, optimized_content):
-    """Save optimized content to cache"""
-    try:
-        cache_dir = get_cache_dir()
-        cache_file = os.path.join(cache_dir, f"{content_hash}.json")
-        
-        cache_data = {
-            "timestamp": time.time(),
-            "optimized_content": optimized_content,
-            "version": "1.0"  # For future compatibility
-        }
-        
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(cache_data, f, ensure_ascii=False, indent=2)
-        
-        return True
-    except Exception as e:
-        st.warning(f"Could not save optimized content to cache: {str(e)}")
-        return False
+def cached_optimization_cache_stats():
+    """Optimization cache stats, queried again only after the database or its write-ahead log changes"""
+    database_path = get_optimization_cache_path()
+    return _optimization_cache_stats(file_signature(database_path), file_signature(database_path + "-wal"))
 
-def load_optimized_content(content_hash):
-    """Load optimized content from cache if it exists"""
-    try:
-        cache_dir = get_cache_dir()
-        cache_file = os.path.join(cache_dir, f"{content_hash}.json")
-        
-        if not os.path.exists(cache_file):
-            return None
-        
-        with open(cache_file, 'r', encoding='utf-8') as f:
-            cache_data = json.load(f)
-        
-        # Check if cache is recent (within 30 days)
-        cache_age = time.time() - cache_data.get("timestamp", 0)
-        if cache_age > (30 * 24 * 60 * 60):  # 30 days in seconds
-            # Remove old cache file
-            os.remove(cache_file)
-            return None
-        
-        return cache_data.get("optimized_content")
-        
-    except Exception as e:
-        # If there's an error reading the cache, remove the corrupted file
-        try:
-            cache_file = os.path.join(get_cache_dir(), f"{content_hash}.json")
-            if os.path.exists(cache_file):
-                os.remove(cache_file)
-        except:
-            pass
-        return None
+@lru_cache(maxsize=1)
+def _audio_cache_stats(directory_signature):
+    return get_audio_cache_stats()
 
-def clear_optimization_cache():
-    """Clear all cached optimized content"""
-    try:
-        cache_dir = get_cache_dir()
-        if os.path.exists(cache_dir):
-            for filename in os.listdir(cache_dir):
-                if filename.endswith('.json'):
-                    file_path = os.path.join(cache_dir, filename)
-                    os.remove(file_path)
-        return True
-    except Exception as e:
-        st.error(f"Error clearing cache: {str(e)}")
-        return False
+def cached_audio_cache_stats():
+    """Audio cache stats, rescanned only after files are added to or removed from the cache directory"""
+    return _audio_cache_stats(file_signature(get_audio_cache_dir()))
+
+# Rerun profiling
+def is_profiling_enabled():
+    """Show rerun timings when TTS_PROFILE_RERUNS is set or the page is opened with ?profile=1"""
+    return PROFILE_RERUNS or st.query_params.get("profile") == "1"
 
-def get_cache_stats():
-    """Get cache statistics"""
+@contextmanager
+def profile_section(name):
+    """Time a section of the current rerun, adding up repeated runs of the same section"""
+    start_time = time.perf_counter()
     try:
-        cache_dir = get_cache_dir()
-        if not os.path.exists(cache_dir):
-            return {"count": 0, "total_size": 0}
-        
-        count = 0
-        total_size = 0
-        
-        for filename in os.listdir(cache_dir):
-            if filename.endswith('.json'):
-                count += 1
-                file_path = os.path.join(cache_dir, filename)
-                total_size += os.path.getsize(file_path)
-        
-        return {"count": count, "total_size": total_size}
-    except:
-        return {"count": 0, "total_size": 0}
+        yield
+    finally:
+        timings = st.session_state.setdefault("rerun_timings", {})
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start_time
 
-def optimize_for_speech(content, api_key, progress_callback=None):
-    """Optimize markdown content for better speech synthesis using OpenAI GPT-4o with caching"""
-    if not OPENAI_AVAILABLE:
-        st.error("OpenAI library not installed. Run: pip install openai")
-        return content
-    
+def run_profiled(app):
+    """Run the app for one rerun, recording how long it and each profiled section took"""
+    st.session_state["rerun_timings"] = {}
+    start_time = time.perf_counter()
     try:
-        # Check cache first
-        content_hash = get_content_hash(content)
-        cached_content = load_optimized_content(content_hash)
-        
-        if cached_content:
-            if progress_callback:
-                progress_callback("✅ Found optimized content in cache!", 100)
-            st.info("🚀 Using cached optimized content (no API call needed)")
-            return cached_content
-        
-        # If not in cache, proceed with OpenAI optimization
-        if progress_callback:
-            progress_callback("Connecting to OpenAI API...", 5)
-        
-        client = openai.OpenAI(api_key=api_key)
-        
-        # Calculate chunk size (aim for ~3000 characters to leave room for prompt)
-        max_chunk_size = 3000
-        content_chunks = []
-        
-        # Split content into chunks
-        for i in range(0, len(content), max_chunk_size):
-            chunk = content[i:i + max_chunk_size]
-            content_chunks.append(chunk)
-        
-        total_chunks = len(content_chunks)
-        optimized_chunks = []
-        
-        prompt = """You are an expert at converting written text to speech-friendly format. 
+        app()
+    finally:
+        total = time.perf_counter() - start_time
+        history = st.session_state.setdefault("rerun_history", [])
+        history.append(total)
+        del history[:-PROFILE_HISTORY]
+        timings = st.session_state["rerun_timings"]
+        logger.debug(f"Rerun took {total * 1000:.1f} ms: " + ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in timings.items()))
+    
+    # Only reached when the rerun finished normally, not when st.rerun() or st.stop() cut it short
+    if is_profiling_enabled():
+        with st.sidebar.expander("⏱️ Rerun Profile", expanded=True):
+            st.write(f"**This rerun:** {total * 1000:.1f} ms")
+            for name, seconds in timings.items():
+                st.write(f"- {name}: {seconds * 1000:.1f} ms")
+            st.write(f"**Average of last {len(history)}:** {sum(history) / len(history) * 1000:.1f} ms")
 
-Please optimize the following markdown content for text-to-speech conversion by:
-1. Expanding abbreviations and acronyms 
-2. Converting numbers to written form (e.g., "123" to "one hundred twenty-three")
-3. Adding pronunciation guides for technical terms in parentheses
-4. Converting symbols and special characters to spoken words
-5. Adding natural pauses with commas and periods
-6. Removing or converting markdown formatting that doesn't translate well to speech
-7. Making sentences flow more naturally when spoken aloud
-8. Converting URLs to "link" or describing their purpose
-9. Handling code blocks by describing what they do instead of reading code syntax
+def parse_byte_range(range_header, size):
+    """Parse a single "bytes=" Range header into an inclusive (start, end) pair
 
-Keep the core meaning and content intact, but make it sound natural when read aloud.
-Return ONLY the optimized text without any additional commentary.
+    Returns None for headers that should be ignored, such as multiple ranges, in which
+    case the whole file is sent. Raises ValueError if the range can't be satisfied.
+    """
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', range_header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        suffix_length = int(last)
+        if suffix_length == 0 or size == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - suffix_length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range starts beyond the end of the file")
+    return start, end
 
-Content to optimize:
-"""
+# Progressive audio streaming
+class AudioStream:
+    """Growing MP3 byte stream that HTTP clients can play while chunks are still being synthesized"""
+    
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+        self.created = time.time()
+        self.condition = threading.Condition()
+    
+    def append(self, audio_data):
+        """Add the next chunk of MP3 frames and wake up waiting readers"""
+        with self.condition:
+            self.parts.append(audio_data)
+            self.condition.notify_all()
+    
+    def close(self):
+        """Mark the stream as complete so readers finish once they have sent every part"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+    
+    def iter_parts(self, idle_timeout=AUDIO_STREAM_IDLE_TIMEOUT):
+        """Yield parts in order, blocking until more arrive or the stream is closed"""
+        index = 0
+        while True:
+            with self.condition:
+                if not self.condition.wait_for(lambda: index < len(self.parts) or self.closed, timeout=idle_timeout):
+                    return
+                if index >= len(self.parts):
+                    return
+                part = self.parts[index]
+            index += 1
+            yield part
 
-        # Process each chunk
-        for i, chunk in enumerate(content_chunks):
-            if progress_callback:
-                progress = 10 + int((i / total_chunks) * 80)  # 10% to 90% for processing
-                progress_callback(f"Optimizing chunk {i + 1} of {total_chunks}...", progress)
-            
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are an expert at optimizing text for speech synthesis. Return only the optimized text."},
-                    {"role": "user", "content": prompt + chunk}
-                ],
-                temperature=0.3,
-                max_tokens=4000
-            )
-            
-            optimized_chunks.append(response.choices[0].message.content)
-        
-        # Combine all optimized chunks
-        optimized_content = "\n".join(optimized_chunks)
-        
-        # Save to cache
-        if progress_callback:
-            progress_callback("Saving to cache...", 95)
+class AudioStreamHandler(BaseHTTPRequestHandler):
+    """Serve /stream/<id> as a close-delimited MP3 response that grows as chunks are released,
+    finished files as /files/<job_id>/<name> straight from disk with Range support, and the
+    pipeline metrics as /metrics (Prometheus text, or JSON with ?format=json)
+    """
+    
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/metrics":
+            self.send_metrics(parse_qs(url.query).get("format") == ["json"])
+            return
         
-        if save_optimized_content(content_hash, optimized_content):
-            st.success("💾 Optimized content saved to cache for future use!")
+        file_match = re.fullmatch(r'/files/([0-9a-f]{32})/([^/]+)', url.path)
+        if file_match:
+            download = "download" in parse_qs(url.query)
+            self.send_audio_file(file_match.group(1), unquote(file_match.group(2)), download)
+            return
         
-        if progress_callback:
-            progress_callback("Optimization complete!", 100)
+        match = re.fullmatch(r'/stream/([0-9a-f]{32})', url.path)
+        stream = self.server.get_stream(match.group(1)) if match else None
+        if stream is None:
+            self.send_error(404, "Unknown audio stream")
+            return
         
-        return optimized_content
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        try:
+            for part in stream.iter_parts():
+                self.wfile.write(part)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info(f"Listener disconnected from audio stream {match.group(1)}")
+    
+    def do_HEAD(self):
+        url = urlsplit(self.path)
+        file_match = re.fullmatch(r'/files/([0-9a-f]{32})/([^/]+)', url.path)
+        if not file_match:
+            self.send_error(404, "Unknown audio file")
+            return
+        self.send_audio_file(file_match.group(1), unquote(file_match.group(2)), "download" in parse_qs(url.query), head_only=True)
+    
+    def send_metrics(self, as_json=False):
+        body = (REGISTRY.to_json() if as_json else REGISTRY.to_prometheus()).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json" if as_json else "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_audio_file(self, job_id, filename, download=False, head_only=False):
+        """Send all or the requested range of a finished file with sendfile, without reading it into memory"""
+        path = self.server.get_output_path(job_id, filename)
+        try:
+            audio_file = open(path, 'rb') if path else None
+        except OSError:
+            audio_file = None
+        if audio_file is None:
+            self.send_error(404, "Unknown audio file")
+            return
         
-    except Exception as e:
-        st.error(f"Error optimizing content with OpenAI: {str(e)}")
-        return content
+        with audio_file:
+            size = os.fstat(audio_file.fileno()).st_size
+            try:
+                byte_range = parse_byte_range(self.headers.get("Range", ""), size) if self.headers.get("Range") else None
+            except ValueError:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            start, end = byte_range or (0, size - 1)
+            
+            self.send_response(206 if byte_range else 200)
+            self.send_header("Content-Type", AUDIO_MIME_TYPES.get(os.path.splitext(filename)[1], "application/octet-stream"))
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            if byte_range:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            if download:
+                self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(filename)}")
+            self.send_header("Cache-Control", "private, max-age=3600")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            if head_only or end < start:
+                return
+            try:
+                self.wfile.flush()
+                self.connection.sendfile(audio_file, start, end - start + 1)
+            except (BrokenPipeError, ConnectionResetError):
+                logger.debug(f"Listener disconnected from audio file {job_id}/{filename}")
+    
+    def log_message(self, format, *args):
+        logger.debug(f"Audio stream server: {format % args}")
 
-def clean_text(text, signs_to_exclude):
-    """Remove unwanted Markdown elements by replacing them with appropriate text or removing them"""
-    replacements = [
-        ("|", ""),       # Remove pipe characters from tables
-        ("-", " "),      # Replace hyphens with spaces
-        ("=", " "),      # Replace equal signs with spaces
-        ("__", " "),     # Replace double underscores with spaces
-        ("`", ""),       # Remove backticks
-        ("*", ""),       # Remove asterisks
-        ("#", ""),       # Remove hashes
-        ("!", ""),       # Remove exclamation marks
-        ("[", ""),       # Remove square brackets
-        ("]", ""),       # Remove square brackets
-        ("(", ""),       # Remove parentheses
-        (")", ""),       # Remove parentheses
-    ]
+class AudioStreamServer(ThreadingHTTPServer):
+    """HTTP server holding the audio streams of conversions in progress and serving finished audio"""
+    daemon_threads = True
     
-    for old, new in replacements:
-        if old in signs_to_exclude:
-            text = text.replace(old, new)
+    def __init__(self, host, port, output_root=OUTPUT_ROOT):
+        super().__init__((host, port), AudioStreamHandler)
+        self.output_root = os.path.realpath(output_root)
+        self.streams = {}
+        self.streams_lock = threading.Lock()
     
-    return text
+    def create_stream(self):
+        """Register a new stream, dropping streams older than AUDIO_STREAM_TTL"""
+        stream_id = uuid.uuid4().hex
+        with self.streams_lock:
+            expired = [key for key, stream in self.streams.items() if time.time() - stream.created > AUDIO_STREAM_TTL]
+            for key in expired:
+                self.streams.pop(key).close()
+            self.streams[stream_id] = AudioStream()
+            return stream_id, self.streams[stream_id]
+    
+    def get_stream(self, stream_id):
+        with self.streams_lock:
+            return self.streams.get(stream_id)
+    
+    def get_output_path(self, job_id, filename):
+        """Path of a job's output file, or None if the name would point outside the job's directory"""
+        job_dir = os.path.join(self.output_root, job_id)
+        path = os.path.realpath(os.path.join(job_dir, filename))
+        return path if os.path.dirname(path) == job_dir else None
 
-def combine_audio_chunks(temp_files, output_file):
-    """Combine MP3 files using ffmpeg with better error handling"""
+@st.cache_resource(show_spinner=False)
+def get_audio_stream_server():
+    """Start the shared audio stream server once per Streamlit process"""
     try:
-        logger.info(f"Starting audio combination with {len(temp_files)} files")
-        logger.info(f"Output file: {output_file}")
-        
-        # Log all temp files and verify they exist
-        for i, temp_file in enumerate(temp_files):
-            logger.info(f"Temp file {i}: {temp_file}")
-            if os.path.exists(temp_file):
-                file_size = os.path.getsize(temp_file)
-                logger.info(f"  - Exists: YES, Size: {file_size} bytes")
-            else:
-                logger.error(f"  - Exists: NO - FILE MISSING!")
-                return False
-        
-        if len(temp_files) == 1:
-            # If only one file, just copy it
-            logger.info("Only one file, copying directly...")
-            shutil.copy2(temp_files[0], output_file)
-            return True
-        
-        # Create a temporary file list for ffmpeg
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
-            for temp_file in temp_files:
-                # Use absolute paths and escape any special characters
-                abs_path = os.path.abspath(temp_file)
-                f.write(f"file '{abs_path}'\n")
-                logger.info(f"Added to concat list: {abs_path}")
-            filelist_path = f.name
-        
-        logger.info(f"Created FFmpeg file list: {filelist_path}")
-        
-        # Read back the file list for debugging
-        try:
-            with open(filelist_path, 'r') as f:
-                file_list_content = f.read()
-                logger.info(f"File list content:\n{file_list_content}")
-        except Exception as e:
-            logger.warning(f"Could not read back file list: {e}")
-        
-        try:
-            # Use ffmpeg with file list for more reliable concatenation
-            command = [
-                'ffmpeg', '-f', 'concat', '-safe', '0', '-i', filelist_path,
-                '-c', 'copy', output_file, '-y'
-            ]
-            
-            logger.info(f"Running FFmpeg command: {' '.join(command)}")
-            result = subprocess.run(command, capture_output=True, text=True)
-            
-            logger.info(f"FFmpeg return code: {result.returncode}")
-            if result.stdout:
-                logger.info(f"FFmpeg stdout: {result.stdout}")
-            if result.stderr:
-                logger.info(f"FFmpeg stderr: {result.stderr}")
-            
-            if result.returncode == 0:
-                # Verify output file was created
-                if os.path.exists(output_file):
-                    output_size = os.path.getsize(output_file)
-                    logger.info(f"Success! Output file created: {output_file}, size: {output_size} bytes")
-                    return True
-                else:
-                    logger.error("FFmpeg returned success but output file doesn't exist!")
-                    return False
-            else:
-                st.error(f"FFmpeg error: {result.stderr}")
-                return False
-                
-        finally:
-            # Clean up the temporary file list
-            if os.path.exists(filelist_path):
-                os.remove(filelist_path)
-                logger.info(f"Cleaned up file list: {filelist_path}")
-        
-    except FileNotFoundError:
-        st.error("FFmpeg not found. Please install FFmpeg to combine audio files.")
-        logger.error("FFmpeg not found on system PATH")
-        return False
-    except Exception as e:
-        st.error(f"Error during concatenation: {e}")
-        logger.error(f"Exception during audio combination: {e}")
-        return False
+        server = AudioStreamServer(AUDIO_STREAM_HOST, AUDIO_STREAM_PORT)
+    except OSError as e:
+        logger.error(f"Could not start audio stream server on port {AUDIO_STREAM_PORT}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="audio-stream-server", daemon=True).start()
+    logger.info(f"Audio stream server listening on {AUDIO_STREAM_HOST}:{AUDIO_STREAM_PORT}")
+    return server
+
+def render_audio_player(path, autoplay=False, download_name=None):
+    """Show an audio player for a path on the stream server, with an optional download link"""
+    # Without an explicit URL, assume the stream server is reachable on the same host as the app
+    stream_base_url = os.environ.get("TTS_STREAM_URL", "")
+    download_link = ""
+    if download_name:
+        download_link = f"""<a download="{html.escape(download_name)}" style="display: inline-block; margin-top: 8px; padding: 6px 14px;
+  border-radius: 8px; background: #ff4b4b; color: white; font-family: sans-serif; text-decoration: none">📥 Download Audio File</a>"""
+    components.html(f"""
+<audio controls {"autoplay" if autoplay else ""} preload="{"auto" if autoplay else "metadata"}" style="width: 100%"></audio>
+{download_link}
+<script>
+  const base = {json.dumps(stream_base_url)} ||
+    `${{window.parent.location.protocol}}//${{window.parent.location.hostname}}:{AUDIO_STREAM_PORT}`;
+  document.querySelector("audio").src = `${{base}}{path}`;
+  const link = document.querySelector("a");
+  if (link) link.href = `${{base}}{path}?download=1`;
+</script>
+""", height=110 if download_name else 60)
 
-def markdown_to_speech(md_file_content, output_file, lang, chunk_size, signs_to_exclude, progress_bar, status_text):
-    """Convert markdown to speech with progress tracking"""
-    logger.info(f"=== markdown_to_speech STARTED ===")
-    logger.info(f"Content length: {len(md_file_content)}")
-    logger.info(f"Output file: {output_file}")
-    logger.info(f"Language: {lang}")
-    logger.info(f"Chunk size: {chunk_size}")
+def render_stream_player(stream_id):
+    """Show an audio player that starts playing the stream as soon as the first chunk arrives"""
+    render_audio_player(f"/stream/{stream_id}", autoplay=True)
+
+def spool_upload(uploaded_file):
+    """Copy an upload to a temporary file in 1 MB blocks and return its path, deleting spooled uploads older than a day"""
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    for name in os.listdir(UPLOAD_SPOOL_DIR):
+        path = os.path.join(UPLOAD_SPOOL_DIR, name)
+        try:
+            if time.time() - os.path.getmtime(path) > UPLOAD_SPOOL_MAX_AGE:
+                os.remove(path)
+        except OSError as e:
+            logger.warning(f"Could not remove spooled upload {path}: {str(e)}")
     
-    temp_files = []  # Initialize temp_files list outside try block
+    path = os.path.join(UPLOAD_SPOOL_DIR, f"{uuid.uuid4().hex}.md")
+    uploaded_file.seek(0)
+    with open(path, 'wb') as spool:
+        shutil.copyfileobj(uploaded_file, spool, 1024 * 1024)
+    return path
+
+def remove_spooled_upload(path):
+    """Delete a spooled upload once the conversion reading it has ended"""
     try:
-        # Update status
-        status_text.text("Reading markdown content...")
-        logger.info("Step 1: Reading markdown content")
-        time.sleep(0.1)  # Small delay for UI update
-        
-        # Convert markdown to HTML
-        status_text.text("Converting markdown to HTML...")
-        progress_bar.progress(10)
-        logger.info("Step 2: Converting markdown to HTML")
-        html_text = markdown.markdown(md_file_content)
-        logger.info(f"HTML conversion complete. HTML length: {len(html_text)}")
-        
-        # Convert HTML to plain text
-        status_text.text("Extracting text from HTML...")
-        progress_bar.progress(20)
-        logger.info("Step 3: Extracting plain text from HTML")
-        soup = BeautifulSoup(html_text, "html.parser")
-        plain_text = ''.join(soup.find_all(string=True))
-        logger.info(f"Plain text extraction complete. Text length: {len(plain_text)}")
-        
-        # Clean the extracted text
-        status_text.text("Cleaning text...")
-        progress_bar.progress(30)
-        logger.info("Step 4: Cleaning text")
-        cleaned_text = clean_text(plain_text, signs_to_exclude)
-        logger.info(f"Text cleaning complete. Cleaned text length: {len(cleaned_text)}")
+        os.remove(path)
+        logger.info(f"Removed spooled upload {path}")
+    except OSError as e:
+        logger.warning(f"Could not remove spooled upload {path}: {str(e)}")
 
-        # Split text into chunks to handle gTTS limits
-        text_chunks = [cleaned_text[i:i + chunk_size] for i in range(0, len(cleaned_text), chunk_size)]
-        total_chunks = len(text_chunks)
-        logger.info(f"Step 5: Text split into {total_chunks} chunks")
-        
-        status_text.text(f"Processing {total_chunks} chunks...")
-        progress_bar.progress(35)
-        
-        # Convert each chunk to speech and save as a temporary file
-        for i, chunk in enumerate(text_chunks):
-            current_chunk = i + 1
-            status_text.text(f"Converting chunk {current_chunk} of {total_chunks}...")
-            logger.info(f"Processing chunk {current_chunk}/{total_chunks} (length: {len(chunk)})")
-            
-            # Calculate progress (35% to 80% for chunk processing)
-            chunk_progress = 35 + int((current_chunk / total_chunks) * 45)
-            progress_bar.progress(chunk_progress)
-            
-            try:
-                tts = gTTS(chunk, lang=lang)
-                # Create temporary file in system temp directory with proper naming
-                temp_file = tempfile.NamedTemporaryFile(suffix=f"_part_{i}.mp3", delete=False)
-                temp_file_path = temp_file.name
-                temp_file.close()  # Close the file handle so gTTS can write to it
-                
-                logger.info(f"Creating temporary file: {temp_file_path}")
-                tts.save(temp_file_path)
-                temp_files.append(temp_file_path)
-                logger.info(f"Chunk {current_chunk} saved successfully to {temp_file_path}")
-                
-                # Verify the file was created and has content
-                if os.path.exists(temp_file_path):
-                    file_size = os.path.getsize(temp_file_path)
-                    logger.info(f"Temporary file {temp_file_path} created successfully, size: {file_size} bytes")
-                    if file_size == 0:
-                        logger.error(f"Warning: Temporary file {temp_file_path} is empty!")
-                else:
-                    logger.error(f"Error: Temporary file {temp_file_path} was not created!")
-                    raise Exception(f"Failed to create temporary file {temp_file_path}")
-                    
-            except Exception as chunk_error:
-                logger.error(f"Error processing chunk {current_chunk}: {chunk_error}")
-                raise chunk_error
-        
-        # Combine all temporary files into a single output file
-        status_text.text("Combining audio files...")
-        progress_bar.progress(85)
-        logger.info(f"Step 6: Combining {len(temp_files)} temporary files into {output_file}")
-        success = combine_audio_chunks(temp_files, output_file)
-        logger.info(f"Audio combination result: {success}")
-        
-        if not success:
-            # Clean up temporary files before returning False
-            status_text.text("Cleaning up temporary files after error...")
-            logger.error("Audio combination failed, cleaning up temporary files")
-            for temp_file in temp_files:
-                if os.path.exists(temp_file):
-                    try:
-                        os.remove(temp_file)
-                        logger.info(f"Removed temporary file: {temp_file}")
-                    except Exception:
-                        logger.warning(f"Failed to remove temporary file: {temp_file}")
-            return False
-        
-        # Clean up temporary files after successful combination
-        status_text.text("Cleaning up temporary files...")
-        progress_bar.progress(95)
-        logger.info("Step 7: Cleaning up temporary files")
-        cleanup_success = True
-        for temp_file in temp_files:
-            if os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                    logger.info(f"Removed temporary file: {temp_file}")
-                except Exception as cleanup_error:
-                    logger.warning(f"Could not delete temporary file {temp_file}: {cleanup_error}")
-                    st.warning(f"Warning: Could not delete temporary file {temp_file}: {cleanup_error}")
-                    cleanup_success = False
-        
-        # Complete
-        progress_bar.progress(100)
-        final_file_size = os.path.getsize(output_file) if os.path.exists(output_file) else 0
-        logger.info(f"=== CONVERSION COMPLETE ===")
-        logger.info(f"Output file: {output_file}")
-        logger.info(f"File size: {final_file_size} bytes")
-        logger.info(f"Cleanup successful: {cleanup_success}")
-        
-        if cleanup_success:
-            status_text.text(f"✅ Conversion complete! Audio saved as {os.path.basename(output_file)}")
+@st.cache_resource
+def get_job_registry():
+    """Start the background conversion pool once per server process, shared by all sessions"""
+    return JobRegistry()
+
+def render_job(job):
+    """Show a background conversion's progress, or its result once it has finished"""
+    st.subheader("🔄 Conversion Progress")
+    if not job.is_finished:
+        if job.stream_id:
+            st.subheader("🎧 Listen While Converting")
+            render_stream_player(job.stream_id)
+        render_job_progress(job.job_id)
+        return
+    
+    for level, message in job.messages:
+        show_message(level, message)
+    
+    if job.status == "done" and job.output_file.endswith(".m3u") and os.path.exists(job.output_file):
+        st.success("🎉 Conversion completed successfully!")
+        render_section_tracks(job)
+    elif job.status == "done" and os.path.exists(job.output_file):
+        file_size = os.path.getsize(job.output_file)
+        logger.info(f"Showing result of job {job.job_id}: {job.output_file} ({file_size} bytes)")
+        st.success("🎉 Conversion completed successfully!")
+        st.write(f"🔍 **Debug:** File created successfully! Size: {file_size} bytes")
+        
+        # Serve the file from disk through the stream server, so it is never held in the session's memory
+        output_name = os.path.basename(job.output_file)
+        if get_audio_stream_server():
+            render_audio_player(f"/files/{job.job_id}/{quote(output_name)}", download_name=output_name)
         else:
-            status_text.text(f"✅ Conversion complete! Audio saved as {os.path.basename(output_file)} (some temporary files may remain)")
-        return True
-        
-    except Exception as e:
-        # Ensure cleanup happens even if there's an error
-        logger.error(f"=== CONVERSION FAILED ===")
-        logger.error(f"Error: {str(e)}")
-        logger.error(f"Error type: {type(e).__name__}")
-        status_text.text(f"❌ Error during conversion: {str(e)}")
-        progress_bar.progress(0)
-        
-        # Clean up any temporary files that were created
-        if temp_files:
-            logger.info(f"Cleaning up {len(temp_files)} temporary files after error")
-            for temp_file in temp_files:
-                if os.path.exists(temp_file):
-                    try:
-                        os.remove(temp_file)
-                        logger.info(f"Removed temporary file after error: {temp_file}")
-                    except Exception:
-                        logger.warning(f"Failed to remove temporary file after error: {temp_file}")
-        
-        return False
+            st.warning(f"⚠️ The audio server on port {AUDIO_STREAM_PORT} isn't running, so the audio is sent through Streamlit instead")
+            with open(job.output_file, "rb") as file:
+                st.download_button(
+                    label="📥 Download Audio File",
+                    data=file,
+                    file_name=output_name,
+                    mime=AUDIO_MIME_TYPES[os.path.splitext(output_name)[1]],
+                    type="primary"
+                )
+            st.audio(job.output_file, format=AUDIO_MIME_TYPES[os.path.splitext(output_name)[1]])
+    else:
+        if job.error:
+            st.error(f"❌ Error during conversion: {job.error}")
+        st.error("❌ Conversion failed. Please check your input and try again.")
+
+def render_section_tracks(job):
+    """Show a player for every track of a sectioned conversion, with its playlist and chapter list"""
+    manifest_file, chapters_file = get_section_paths(job.output_file)
+    manifest = load_section_manifest(manifest_file)
+    if not manifest:
+        st.error("❌ The list of section tracks could not be read")
+        return
+    logger.info(f"Showing {len(manifest['sections'])} section tracks of job {job.job_id}")
+    
+    columns = st.columns(2)
+    for column, path, mime in ((columns[0], job.output_file, "audio/x-mpegurl"), (columns[1], chapters_file, "text/plain")):
+        if os.path.exists(path):
+            with column, open(path, "rb") as file:
+                st.download_button(f"📥 {os.path.basename(path)}", data=file.read(), file_name=os.path.basename(path), mime=mime)
+    
+    stream_server = get_audio_stream_server()
+    for number, section in enumerate(manifest["sections"], start=1):
+        duration = f" ({format_timestamp(section['duration']).split('.')[0]})" if section["duration"] is not None else ""
+        st.markdown(f"**{number}. {html.escape(section['title'])}**{duration}")
+        track_file = os.path.join(os.path.dirname(job.output_file), section["file"])
+        if stream_server:
+            render_audio_player(f"/files/{job.job_id}/{quote(section['file'])}", download_name=section["file"])
+        else:
+            st.audio(track_file, format=AUDIO_MIME_TYPES[os.path.splitext(section["file"])[1]])
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def render_job_progress(job_id):
+    """Poll the job registry, rerunning only this fragment until the job finishes"""
+    job = get_job_registry().get(job_id)
+    if job is None or job.is_finished:
+        st.rerun()
+    st.progress(job.progress)
+    st.text(job.status_text)
+    for level, message in job.messages:
+        show_message(level, message)
+
+def cached_speech_cost(md_file_content, chunk_size, signs_to_exclude, custom_rules=(), engine="gtts"):
+    """Reuse the session's last estimate while the content and settings are unchanged
+
+    Comparing against the previous text is a single memory compare, where st.cache_data
+    would hash the whole document on every rerun.
+    """
+    settings = (chunk_size, signs_to_exclude, custom_rules, engine)
+    previous = st.session_state.get("speech_cost")
+    if previous and previous[0] == settings and previous[1] == md_file_content:
+        return previous[2]
+    cost = estimate_speech_cost(md_file_content, chunk_size, signs_to_exclude, custom_rules, get_backend(engine))
+    st.session_state["speech_cost"] = (settings, md_file_content, cost)
+    return cost
 
 def main():
-    logger.info("=== MAIN FUNCTION STARTED ===")
-    logger.info(f"Session state keys at start: {list(st.session_state.keys())}")
+    logger.debug("=== MAIN FUNCTION STARTED ===")
+    logger.debug(f"Session state keys at start: {list(st.session_state.keys())}")
     
     st.set_page_config(
         page_title="Markdown to Speech Converter",
@@ -576,12 +553,14 @@ def main():
     )
     
     st.title("🎵 Markdown to Speech Converter")
+    # Start the stream server with the app so /metrics can be scraped before the first conversion
+    get_audio_stream_server()
     st.markdown("Convert your Markdown files to high-quality speech audio using Google Text-to-Speech")
     
-    logger.info("Starting sidebar configuration...")
+    logger.debug("Starting sidebar configuration...")
     
     # Sidebar for settings - MOVED TO TOP TO DEFINE VARIABLES FIRST
-    with st.sidebar:
+    with st.sidebar, profile_section("sidebar"):
         st.header("⚙️ Settings")
         
         # OpenAI API Key section
@@ -589,7 +568,8 @@ def main():
         
         if OPENAI_AVAILABLE:
             # Load stored API key
-            stored_api_key = load_api_key()
+            with profile_section("sidebar: load API key"):
+                stored_api_key = load_api_key()
             
             # Initialize session state for API key
             if 'api_key_input' not in st.session_state:
@@ -641,17 +621,30 @@ def main():
                 disabled=not api_key
             )
             
+            # Concurrent optimization requests
+            optimization_workers = st.slider(
+                "Concurrent Optimization Requests:",
+                min_value=1,
+                max_value=8,
+                value=4,
+                step=1,
+                help="Number of chunks sent to GPT-4o at the same time. Lower this if you hit OpenAI rate limits",
+                disabled=not use_openai
+            )
+            
             # Cache management section
             if use_openai or api_key:
                 st.markdown("---")
                 st.subheader("📦 Optimization Cache")
                 
-                cache_stats = get_cache_stats()
+                with profile_section("sidebar: optimization cache stats"):
+                    cache_stats = cached_optimization_cache_stats()
                 cache_count = cache_stats["count"]
                 cache_size_mb = cache_stats["total_size"] / (1024 * 1024)
+                cache_limit_mb = OPTIMIZATION_CACHE_MAX_BYTES / (1024 * 1024)
                 
                 if cache_count > 0:
-                    st.info(f"💾 Cached items: {cache_count} ({cache_size_mb:.1f} MB)")
+                    st.info(f"💾 Cached items: {cache_count} ({cache_size_mb:.1f} of {cache_limit_mb:.0f} MB)")
                     
                     col1, col2 = st.columns(2)
                     with col1:
@@ -667,7 +660,8 @@ def main():
                             st.write(f"**Cache Statistics:**")
                             st.write(f"- Items: {cache_count}")
                             st.write(f"- Size: {cache_size_mb:.1f} MB")
-                            st.write(f"- Location: `.optimization_cache/`")
+                            st.write(f"- Size limit: {cache_limit_mb:.0f} MB, least recently used entries are evicted first")
+                            st.write(f"- Location: `.optimization_cache/cache.sqlite3`")
                 else:
                     st.info("💾 No cached optimizations yet")
         else:
@@ -675,6 +669,7 @@ def main():
             st.code("pip install openai", language="bash")
             use_openai = False
             api_key = None
+            optimization_workers = 1
         
         st.markdown("---")
         
@@ -685,6 +680,15 @@ def main():
             index=0
         )
         
+        # Speech engine
+        engine = st.selectbox(
+            "Speech Engine:",
+            options=available_backends(),
+            format_func=lambda name: BACKENDS[name].label,
+            help="Google needs a network connection. Install espeak-ng to convert offline without rate limits"
+        )
+        backend = get_backend(engine)
+        
         # Chunk size
         chunk_size = st.slider(
             "Chunk Size (characters):",
@@ -692,19 +696,99 @@ def main():
             max_value=5000,
             value=1000,
             step=100,
-            help="Larger chunks = fewer API calls but may hit rate limits"
+            help="Text is cut at paragraph and sentence boundaries up to this size. The estimate below the editor shows the resulting number of speech requests"
         )
         
+        # Parallel synthesis workers
+        max_workers = st.slider(
+            "Parallel Workers:",
+            min_value=1,
+            max_value=16,
+            value=4,
+            step=1,
+            help="Number of chunks converted at the same time. Lower this if you hit rate limits"
+        )
+        
+        # One track per top-level heading
+        split_sections = st.checkbox(
+            "One track per section",
+            value=False,
+            help="Render each top-level heading as its own track, in parallel, with an M3U playlist and a chapter list. Handy for long manuals"
+        )
+        
+        # Progressive playback
+        stream_audio = st.checkbox(
+            "Play audio while converting",
+            value=True,
+            disabled=backend.audio_format != "mp3" or split_sections,
+            help="Start playback as soon as the first chunks are ready instead of waiting for the whole document. Only available for engines producing MP3, as a single track"
+        ) and backend.audio_format == "mp3" and not split_sections
+        
+        # Audio concatenation method
+        concat_method = st.selectbox(
+            "Audio Concatenation:",
+            options=["Built-in", "FFmpeg"],
+            index=0,
+            disabled=backend.audio_format != "mp3",
+            help="Built-in joins the MP3 frames in memory and doesn't need FFmpeg installed. WAV from offline engines is always joined built-in"
+        )
+        use_ffmpeg = concat_method == "FFmpeg"
+        
+        # Output format
+        ffmpeg_installed = shutil.which("ffmpeg") is not None
+        output_profile = st.selectbox(
+            "Output Format:",
+            options=list(OUTPUT_PROFILES),
+            format_func=lambda name: OUTPUT_PROFILES[name]["label"],
+            disabled=not ffmpeg_installed,
+            help="Compact formats re-encode the finished audio once with FFmpeg, which makes long documents much smaller to download and share"
+        )
+        if not ffmpeg_installed:
+            st.caption("Install FFmpeg to choose a compact output format")
+            output_profile = "original"
+        
+        # Audio cache
+        st.subheader("🔊 Audio Cache")
+        use_audio_cache = st.checkbox(
+            "Reuse audio for unchanged chunks",
+            value=True,
+            help="Chunks whose text, language and engine match a previous conversion are taken from the cache instead of being synthesized again"
+        )
+        
+        with profile_section("sidebar: audio cache stats"):
+            audio_cache_stats = cached_audio_cache_stats()
+        if audio_cache_stats["count"] > 0:
+            audio_cache_size_mb = audio_cache_stats["total_size"] / (1024 * 1024)
+            audio_cache_limit_mb = AUDIO_CACHE_MAX_BYTES / (1024 * 1024)
+            st.info(f"🔊 Cached chunks: {audio_cache_stats['count']} ({audio_cache_size_mb:.1f} of {audio_cache_limit_mb:.0f} MB)")
+            if st.button("🗑️ Clear Audio Cache", help="Remove all cached chunk audio"):
+                if clear_audio_cache():
+                    st.success("✅ Audio cache cleared!")
+                    st.rerun()
+                else:
+                    st.error("❌ Failed to clear audio cache")
+        
         # Signs to exclude
         st.subheader("🚫 Exclude Signs")
         signs_to_exclude = []
         for sign_text, sign in SIGNS.items():
             if st.checkbox(sign_text, key=f"exclude_{sign}"):
                 signs_to_exclude.append(sign)
+        
+        custom_rules_text = st.text_area(
+            "Custom Replacements",
+            placeholder=f"e.g. {TEXT_RULE_SEPARATOR} for example\n~ {TEXT_RULE_SEPARATOR} about",
+            help=f"One rule per line as 'old {TEXT_RULE_SEPARATOR} new'. Leave out the replacement to remove the text. Applied together with the excluded signs in a single pass."
+        )
+        try:
+            custom_rules = parse_text_rules(custom_rules_text)
+        except ValueError as e:
+            st.error(f"❌ {str(e)}")
+            custom_rules = ()
     
-    logger.info("Sidebar configuration completed")
-    logger.info(f"Variables defined: selected_language={selected_language}, chunk_size={chunk_size}, use_openai={use_openai}")
-    logger.info(f"signs_to_exclude={signs_to_exclude}")
+    logger.debug("Sidebar configuration completed")
+    logger.debug(f"Variables defined: selected_language={selected_language}, chunk_size={chunk_size}, use_openai={use_openai}")
+    logger.debug(f"signs_to_exclude={signs_to_exclude}")
     
     # Initialize session state for file content
     if 'file_content' not in st.session_state:
@@ -712,22 +796,22 @@ def main():
     if 'filename' not in st.session_state:
         st.session_state.filename = None
 
-    logger.info("Session state initialized")
-    logger.info(f"Checking for should_convert flag: {getattr(st.session_state, 'should_convert', False)}")
+    logger.debug("Session state initialized")
+    logger.debug(f"Checking for should_convert flag: {getattr(st.session_state, 'should_convert', False)}")
     
     # Check if any proceed button was clicked (look for proceed_conversion_* keys in session state)
     proceed_button_keys = [key for key in st.session_state.keys() if key.startswith('proceed_conversion_')]
-    logger.info(f"Found proceed button keys in session state: {proceed_button_keys}")
+    logger.debug(f"Found proceed button keys in session state: {proceed_button_keys}")
     
     # Check if any of these buttons were just clicked (have True value)
     proceed_buttons_clicked = []
     for key in proceed_button_keys:
         value = st.session_state.get(key, False)
-        logger.info(f"Button {key} has value: {value}")
+        logger.debug(f"Button {key} has value: {value}")
         if value is True:
             proceed_buttons_clicked.append(key)
     
-    logger.info(f"Proceed buttons clicked (True values): {proceed_buttons_clicked}")
+    logger.debug(f"Proceed buttons clicked (True values): {proceed_buttons_clicked}")
     
     if proceed_buttons_clicked:
         logger.info(f"=== PROCEED BUTTON DETECTED IN SESSION STATE ===")
@@ -791,96 +875,88 @@ def main():
         st.success(f"🚀 Ready to convert! Using content: {len(content)} characters")
         
         # Create output filename
-        base_name = os.path.splitext(filename)[0]
-        output_file = f"{base_name}.mp3"
-        logger.info(f"Output file will be: {output_file}")
+        base_name = os.path.splitext(os.path.basename(filename))[0]
+        output_name = f"{base_name}.m3u" if split_sections else f"{base_name}.{get_output_extension(backend.audio_format, output_profile)}"
+        logger.info(f"Output file will be: {output_name}")
         
         # Debug: Show what we're about to convert
-        st.info(f"🔄 Starting conversion of {len(content)} characters to {output_file}")
-        st.write(f"🔍 **Debug:** About to call markdown_to_speech with:")
+        st.info(f"🔄 Starting conversion of {len(content)} characters to {output_name}")
+        st.write(f"🔍 **Debug:** Starting a background conversion with:")
         st.write(f"- Content length: {len(content)} chars")
-        st.write(f"- Output file: {output_file}")
+        st.write(f"- Output file: {output_name}")
         st.write(f"- Language: {selected_language}")
+        st.write(f"- Speech engine: {backend.label}")
         st.write(f"- Chunk size: {chunk_size}")
+        st.write(f"- Parallel workers: {max_workers}")
+        st.write(f"- Audio cache: {use_audio_cache}")
+        st.write(f"- Concatenation: {concat_method}")
+        st.write(f"- Output format: {output_profile}")
+        st.write(f"- One track per section: {split_sections}")
+        st.write(f"- Play while converting: {stream_audio}")
         st.write(f"- Signs to exclude: {signs_to_exclude}")
+        st.write(f"- Custom replacements: {len(custom_rules)}")
+        
+        # Stream chunks to the browser as they finish, in document order
+        audio_stream = None
+        stream_id = None
+        if stream_audio:
+            stream_server = get_audio_stream_server()
+            if stream_server:
+                stream_id, audio_stream = stream_server.create_stream()
+                logger.info(f"Streaming conversion audio as stream {stream_id}")
+            else:
+                st.warning(f"⚠️ Could not start the audio stream server on port {AUDIO_STREAM_PORT}; audio will play when conversion finishes")
         
-        # Show conversion progress
-        st.subheader("🔄 Conversion Progress")
-        progress_bar = st.progress(0)
-        status_text = st.empty()
+        def stream_chunk(index, audio_data):
+            audio_stream.append(strip_mp3_metadata(audio_data))
         
-        # Convert to speech
+        # Convert to speech in the background, so the page stays responsive and survives a refresh
         lang_code = LANGUAGES[selected_language]
         logger.info(f"Starting TTS conversion with parameters:")
         logger.info(f"- lang_code: {lang_code}")
         logger.info(f"- chunk_size: {chunk_size}")
+        logger.info(f"- max_workers: {max_workers}")
         logger.info(f"- signs_to_exclude: {signs_to_exclude}")
-        logger.info(f"- output_file: {output_file}")
-        
-        try:
-            logger.info("About to call markdown_to_speech function...")
-            success = markdown_to_speech(
-                content, 
-                output_file, 
-                lang_code, 
-                chunk_size, 
-                signs_to_exclude,
-                progress_bar,
-                status_text
-            )
-            logger.info(f"markdown_to_speech returned: {success}")
-        except Exception as e:
-            logger.error(f"Exception caught in main conversion: {str(e)}")
-            logger.error(f"Exception type: {type(e).__name__}")
-            logger.error(f"Exception traceback:", exc_info=True)
-            st.error(f"❌ Error during conversion: {str(e)}")
-            success = False
-        
-        logger.info(f"Conversion function returned: {success}")
-        logger.info(f"Output file exists: {os.path.exists(output_file)}")
-        if os.path.exists(output_file):
-            file_size = os.path.getsize(output_file)
-            logger.info(f"Output file size: {file_size} bytes")
-        
-        if success and os.path.exists(output_file):
-            file_size = os.path.getsize(output_file)
-            logger.info(f"SUCCESS! Conversion completed successfully!")
-            logger.info(f"- Output file: {output_file}")
-            logger.info(f"- File size: {file_size} bytes")
-            st.success("🎉 Conversion completed successfully!")
-            st.write(f"🔍 **Debug:** File created successfully! Size: {file_size} bytes")
-            
-            # Provide download button
-            with open(output_file, "rb") as file:
-                st.download_button(
-                    label="📥 Download Audio File",
-                    data=file.read(),
-                    file_name=output_file,
-                    mime="audio/mpeg",
-                    type="primary"
-                )
-            
-            # Show audio player
-            st.audio(output_file)
-            logger.info("Download button and audio player displayed")
-        else:
-            logger.error("=== CONVERSION FAILED ===")
-            logger.error(f"Success flag: {success}")
-            logger.error(f"File exists: {os.path.exists(output_file)}")
-            if os.path.exists(output_file):
-                file_size = os.path.getsize(output_file)
-                logger.error(f"File size: {file_size} bytes")
-            else:
-                logger.error("Output file does not exist")
-            st.error("❌ Conversion failed. Please check your input and try again.")
-            st.write("🔍 **Debug:** Conversion failed - check the logs above for details")
+        logger.info(f"- output_name: {output_name}")
+        
+        job = get_job_registry().submit(
+            content,
+            output_name,
+            lang_code,
+            chunk_size,
+            signs_to_exclude,
+            filename=filename,
+            stream_id=stream_id,
+            on_finish=audio_stream.close if audio_stream else None,
+            max_workers=max_workers,
+            use_audio_cache=use_audio_cache,
+            use_ffmpeg=use_ffmpeg,
+            chunk_ready_callback=stream_chunk if audio_stream else None,
+            custom_rules=custom_rules,
+            backend=backend,
+            output_profile=output_profile,
+            sections=split_sections
+        )
+        st.query_params["job"] = job.job_id
+        render_job(job)
         
-        # Stop execution after conversion attempt
-        logger.info("Conversion attempt completed, stopping execution with return")
         logger.info("=== MAIN FUNCTION ENDING (CONVERSION PATH) ===")
         return
     
-    logger.info("No conversion flag found, proceeding to main UI")
+    # Follow the background conversion named in the URL, so a refresh reconnects to it
+    job_id = st.query_params.get("job")
+    if job_id:
+        job = get_job_registry().get(job_id)
+        if job:
+            render_job(job)
+        else:
+            st.warning("⚠️ This conversion is no longer available. Finished conversions are kept for an hour.")
+        if st.button("➕ Convert Another Document"):
+            del st.query_params["job"]
+            st.rerun()
+        return
+    
+    logger.debug("No conversion flag found, proceeding to main UI")
     # Main content area
     st.header("📄 Upload Markdown File or Enter Content")
     
@@ -891,17 +967,59 @@ def main():
         help="Upload a .md file to auto-fill the content below"
     )
     
-    # Store file content in session state when file is uploaded
-    if uploaded_file is not None:
-        file_content = uploaded_file.read().decode('utf-8')
+    # Large files go to disk and are converted a block at a time, so neither the session nor the editor holds their text
+    if uploaded_file is not None and uploaded_file.size > STREAM_UPLOAD_BYTES:
+        if st.session_state.get("uploaded_file_id") != uploaded_file.file_id:
+            with profile_section("spool upload"):
+                st.session_state.spooled_upload = spool_upload(uploaded_file)
+            st.session_state.file_content = None
+            st.session_state.filename = uploaded_file.name
+            st.session_state.uploaded_file_id = uploaded_file.file_id
+            logger.info(f"Large file uploaded: {uploaded_file.name}, {uploaded_file.size} bytes spooled to {st.session_state.spooled_upload}")
+        
+        st.info(f"📦 {uploaded_file.name} is {uploaded_file.size / (1024 * 1024):.1f} MB, so it is converted in streaming mode: "
+                "read, synthesized and written a block at a time without loading it into the editor. "
+                "AI optimization, section tracks and playback while converting aren't available for it")
+        if st.button("🎵 Convert to Speech", type="primary", key="convert_large_file"):
+            logger.info(f"=== STREAMING CONVERSION OF {uploaded_file.name} ===")
+            output_name = f"{os.path.splitext(uploaded_file.name)[0]}.{get_output_extension(backend.audio_format, output_profile)}"
+            # The job deletes its spooled copy when it ends, so converting the upload again spools it again
+            spooled_upload = st.session_state.pop("spooled_upload", None)
+            if not spooled_upload or not os.path.exists(spooled_upload):
+                with profile_section("spool upload"):
+                    spooled_upload = spool_upload(uploaded_file)
+            job = get_job_registry().submit(
+                spooled_upload,
+                output_name,
+                LANGUAGES[selected_language],
+                chunk_size,
+                signs_to_exclude,
+                filename=uploaded_file.name,
+                max_workers=max_workers,
+                use_audio_cache=use_audio_cache,
+                custom_rules=custom_rules,
+                backend=backend,
+                output_profile=output_profile,
+                on_finish=partial(remove_spooled_upload, spooled_upload),
+                stream=True
+            )
+            st.query_params["job"] = job.job_id
+            render_job(job)
+        return
+    
+    # Store file content in session state when a new file is uploaded, instead of decoding it on every rerun
+    if uploaded_file is not None and st.session_state.get("uploaded_file_id") != uploaded_file.file_id:
+        with profile_section("read upload"):
+            file_content = uploaded_file.read().decode('utf-8')
         st.session_state.file_content = file_content
         st.session_state.filename = uploaded_file.name
+        st.session_state.uploaded_file_id = uploaded_file.file_id
         logger.info(f"File uploaded: {uploaded_file.name}, content length: {len(file_content)}")
     
     # Combined text area for file content or manual input
     # Use file content if available, otherwise empty
     initial_value = st.session_state.file_content if st.session_state.file_content else ""
-    logger.info(f"Text area initial value length: {len(initial_value)}")
+    logger.debug(f"Text area initial value length: {len(initial_value)}")
     
     markdown_text = st.text_area(
         "Markdown Content:",
@@ -911,7 +1029,14 @@ def main():
         help="This area will auto-fill when you upload a file, or you can type/paste content directly"
     )
     
-    logger.info(f"Current markdown_text length: {len(markdown_text)}")
+    logger.debug(f"Current markdown_text length: {len(markdown_text)}")
+    
+    # Show what the current chunk size will cost in gTTS requests
+    if markdown_text.strip():
+        with profile_section("cost estimate"):
+            estimated_chunks, estimated_requests, repeated_chunks = cached_speech_cost(markdown_text, chunk_size, tuple(signs_to_exclude), custom_rules, engine)
+        repeated_note = f" ({repeated_chunks} repeated, reusing their audio)" if repeated_chunks else ""
+        st.caption(f"📊 Estimated cost: {estimated_chunks} chunks{repeated_note}, about {estimated_requests} speech requests at chunk size {chunk_size}")
     
     # Convert button
     st.markdown("---")
@@ -982,7 +1107,7 @@ def main():
                             
                             # Perform optimization
                             with st.spinner("Optimizing content for speech using GPT-4o..."):
-                                content = optimize_for_speech(content, api_key, update_optimization_progress)
+                                content = optimize_for_speech(content, api_key, update_optimization_progress, optimization_workers, show_message)
                             
                             st.success("✅ Content optimized for speech!")
                             
@@ -1084,7 +1209,7 @@ def main():
                     logger.warning("No content provided for conversion")
                     st.warning("⚠️ Please upload a file or paste some markdown content to convert.")
 
-    logger.info("=== MAIN FUNCTION ENDING (NORMAL PATH) ===")
+    logger.debug("=== MAIN FUNCTION ENDING (NORMAL PATH) ===")
 
 if __name__ == "__main__":
-    main()
+    run_profiled(main)